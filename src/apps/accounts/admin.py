@@ -1,9 +1,19 @@
 from django.contrib import admin
 from .models import User
+from .paginators import EstimatedCountPaginator, KeysetChangeList
 
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
     list_display = ('id', 'username', 'nickname', 'email', 
                     'phone', 'birth_date', 'email_verified', 'phone_verified')
-    search_fields = ('username', 'nickname', 'email', 'phone')
\ No newline at end of file
+    # prefix matches for username / phone, substring (trigram index) for nickname / email,
+    # see the indexes in User.Meta
+    search_fields = ('^username', 'nickname', 'email', '^phone')
+    search_help_text = 'Username or phone prefix, or part of a nickname or email.'
+    ordering = ('-date_joined', '-id')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
@@ -4,3 +4,15 @@ from django.apps import AppConfig
 class AccountsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.accounts'
+
+    def ready(self):
+        from rest_framework_simplejwt.tokens import Token
+        from config.metrics import registry
+        from . import metrics, signals  # noqa: F401
+        from .tokens import build_token_backend
+
+        registry.register_collector(metrics.collect, metrics.HELP)
+        backend = build_token_backend()
+        if backend is not None:
+            # Token.token_backend reads this class attribute before falling back to the shared backend
+            Token._token_backend = backend
@@ -0,0 +1,155 @@
+"""
+Async versions of the v1/auth/ views, used when settings.AUTH_VIEW_MODE is "async".
+
+DRF's APIView is sync only, so under ASGI every request to it is pushed
+through sync_to_async. These views run on the event loop and use the async
+ORM; responses keep the same payloads and error envelope as the sync views.
+"""
+from django.http import QueryDict
+from django.utils.decorators import classonlymethod
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed, MethodNotAllowed, Throttled, ValidationError
+from rest_framework.response import Response
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.serializers import (
+    TokenObtainPairSerializer,
+    TokenRefreshSerializer,
+    TokenVerifySerializer,
+)
+from config.exceptions import api_exception_handler
+from config.fastjson import FastJSONParser, FastJSONRenderer
+from . import tokens, verification
+from .availability import FIELDS as AVAILABILITY_FIELDS, aensure_available, availability_index
+from .serializers import RegistrationSerializer
+from .throttling import AvailabilityIPThrottle, LoginIPThrottle, LoginUsernameThrottle, RegistrationIPThrottle
+
+
+class AsyncAPIView(View):
+    """
+    Minimal async counterpart of APIView:
+    parses JSON / form bodies into request.data, checks throttle_classes,
+    renders Response objects and routes every exception through api_exception_handler.
+    """
+    http_method_names = ["post", "options"]
+    throttle_classes = ()
+    parser = FastJSONParser()
+    renderer = FastJSONRenderer()
+
+    @classonlymethod
+    def as_view(cls, **initkwargs):
+        # same as APIView, auth here is JWT only
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            request.data = self.parse(request)
+            await self.check_throttles(request)
+            response = await super().dispatch(request, *args, **kwargs)
+        except Exception as exc:
+            response = api_exception_handler(exc, {"view": self, "request": request})
+        return self.finalize_response(response)
+
+    def http_method_not_allowed(self, request, *args, **kwargs):
+        raise MethodNotAllowed(request.method)
+
+    async def check_throttles(self, request):
+        # like APIView.check_throttles: every throttle is charged, the longest wait is reported
+        waits = []
+        for throttle_class in self.throttle_classes:
+            throttle = throttle_class()
+            if not await throttle.aallow_request(request, self):
+                waits.append(throttle.wait())
+        if waits:
+            raise Throttled(wait=max((wait for wait in waits if wait is not None), default=None))
+
+    def parse(self, request):
+        if not request.body:
+            return {}
+        if request.content_type == "application/json":
+            return self.parser.parse(request, "application/json", {"request": request})
+        if isinstance(request.POST, QueryDict):
+            return request.POST
+        return {}
+
+    def finalize_response(self, response):
+        if isinstance(response, Response):
+            response.accepted_renderer = self.renderer
+            response.accepted_media_type = self.renderer.media_type
+            response.renderer_context = {"view": self}
+            response.render()
+        return response
+
+
+class AsyncRegistrationView(AsyncAPIView):
+    throttle_classes = (RegistrationIPThrottle,)
+
+    async def post(self, request):
+        serializer = RegistrationSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        await aensure_available(serializer.validated_data)
+        user = await serializer.asave()
+        verification.enqueue(user)  # acreate_user has committed
+        return Response({"ok": True}, status=status.HTTP_201_CREATED)
+
+
+class AsyncAvailabilityView(AsyncAPIView):
+    http_method_names = ["get", "options"]
+    throttle_classes = (AvailabilityIPThrottle,)
+
+    async def get(self, request):
+        values = {field: request.GET.get(field) for field in AVAILABILITY_FIELDS if request.GET.get(field)}
+        if not values:
+            raise ValidationError("Provide at least one of username, email or phone.")
+        return Response({"ok": True, "available": await availability_index.acheck(**values)}, status=status.HTTP_200_OK)
+
+
+class AsyncLoginView(AsyncAPIView):
+    throttle_classes = (LoginIPThrottle, LoginUsernameThrottle)
+
+    async def post(self, request):
+        serializer = TokenObtainPairSerializer()
+        # field checks only, credentials are checked on the async path below
+        attrs = serializer.to_internal_value(request.data)
+
+        user = await tokens.aauthenticate(attrs[serializer.username_field], attrs["password"])
+        if user is None:
+            raise AuthenticationFailed(
+                serializer.error_messages["no_active_account"],
+                "no_active_account",
+            )
+        return Response(await tokens.aissue_token_pair(user), status=status.HTTP_200_OK)
+
+
+class AsyncLogoutView(AsyncAPIView):
+    async def post(self, request):
+        refresh = request.data.get("refresh")
+        if not refresh:
+            raise ValidationError({"refresh": "Refresh token is required."})
+        try:
+            await tokens.alogout(refresh)
+        except Exception:
+            raise ValidationError({"refresh": "Invalid refresh token."})
+
+        return Response({"ok": True}, status=status.HTTP_205_RESET_CONTENT)
+
+
+class AsyncTokenRefreshView(AsyncAPIView):
+    async def post(self, request):
+        attrs = TokenRefreshSerializer().to_internal_value(request.data)
+        try:
+            data = await tokens.arotate(attrs["refresh"])
+        except TokenError as e:
+            raise InvalidToken(e.args[0])
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class AsyncTokenVerifyView(AsyncAPIView):
+    async def post(self, request):
+        attrs = TokenVerifySerializer().to_internal_value(request.data)
+        try:
+            await tokens.averify(attrs["token"])
+        except TokenError as e:
+            raise InvalidToken(e.args[0])
+        return Response({}, status=status.HTTP_200_OK)
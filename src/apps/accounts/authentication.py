@@ -0,0 +1,145 @@
+"""
+JWT authentication with a process-local cache of verified tokens.
+
+Access tokens live for 15 minutes and clients send the same one on every
+request, so after the first successful decode the signature check is
+replaced by a dict lookup until the token's own `exp`. The user behind the
+token comes from apps.accounts.user_cache instead of a query per request.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import UntypedToken
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .user_cache import user_cache
+
+
+class TokenCache:
+    """
+    Bounded LRU of verified Token objects keyed by a digest of the raw token.
+    Entries are dropped at the token's `exp` claim.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # digest -> (exp, token)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def digest(raw_token):
+        if isinstance(raw_token, str):
+            raw_token = raw_token.encode()
+        return hashlib.sha256(raw_token).digest()
+
+    def get(self, raw_token, token_classes=None):
+        """
+        Cached token for raw_token, or None. With token_classes, only a token of
+        one of those classes counts as a hit.
+        """
+        key = self.digest(raw_token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                exp, token = entry
+                if exp <= time.time():
+                    del self._entries[key]
+                elif token_classes is None or isinstance(token, token_classes):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return token
+            self.misses += 1
+            return None
+
+    def set(self, raw_token, token):
+        exp = token.payload.get('exp')
+        if exp is None or self.max_entries <= 0:
+            return
+        key = self.digest(raw_token)
+        with self._lock:
+            self._entries[key] = (exp, token)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+verified_tokens = TokenCache(getattr(settings, 'TOKEN_CACHE', {}).get('MAX_ENTRIES', 10000))
+
+
+def verify_untyped(raw_token):
+    """
+    UntypedToken(raw_token) through `verified_tokens`. Raises TokenError for
+    invalid tokens, those are never cached.
+    """
+    token = verified_tokens.get(raw_token)
+    if token is None:
+        token = UntypedToken(raw_token)
+        verified_tokens.set(raw_token, token)
+    return token
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that checks `verified_tokens` before decoding and
+    resolves the user through `user_cache`.
+    """
+
+    def get_validated_token(self, raw_token):
+        token_classes = tuple(api_settings.AUTH_TOKEN_CLASSES)
+        token = verified_tokens.get(raw_token, token_classes)
+        if token is None:
+            token = super().get_validated_token(raw_token)
+            verified_tokens.set(raw_token, token)
+        return token
+
+    def get_user(self, validated_token):
+        # same checks as JWTAuthentication.get_user, on the cached user
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        try:
+            user = user_cache.get(
+                str(user_id),
+                lambda: self.user_model.objects.get(**{api_settings.USER_ID_FIELD: user_id}),
+            )
+        except self.user_model.DoesNotExist:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return user
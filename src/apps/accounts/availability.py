@@ -0,0 +1,299 @@
+"""
+"Is this username / email / phone taken?" with a bloom filter in front of the database.
+
+The filter holds every taken value of the three unique User columns. A value
+the filter has never seen is free without a query; only possible hits (real
+ones plus ~FALSE_POSITIVE_RATE of misses) go to the database, all fields in
+one OR query over the unique indexes.
+
+- Users saved in this process are added through post_save (apps.accounts.signals);
+  bulk imports add theirs explicitly, since bulk_create sends no signals.
+- Users created by other processes are picked up by an incremental query on
+  date_joined at most every SYNC_INTERVAL seconds.
+- A bloom filter cannot forget a value, so deletes only count towards a full
+  rebuild (REBUILD_AFTER_DELETES, or every REBUILD_INTERVAL seconds). Until
+  then a deleted value is a false positive, which costs a query, never a
+  wrong answer.
+
+Loads, rebuilds and incremental syncs run on a background thread, started by
+the request that finds one due; requests only read the current filter. Until
+the first load is done every check goes to the database. With BACKGROUND_SYNC
+off nothing is loaded unless sync() is called.
+"""
+import datetime
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.base_user import BaseUserManager
+from django.core.signals import setting_changed
+from django.db.models import Q
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework import serializers
+
+DEFAULTS = {
+    'EXPECTED_USERS': 1_000_000,
+    'FALSE_POSITIVE_RATE': 0.01,
+    'SYNC_INTERVAL': 5,
+    'SYNC_OVERLAP': 60,            # seconds re-read below the last seen date_joined
+    'REBUILD_INTERVAL': 3600,
+    'REBUILD_AFTER_DELETES': 1000,
+    'LOAD_BATCH_SIZE': 10000,
+    'BACKGROUND_SYNC': True,
+}
+
+FIELDS = ('username', 'email', 'phone')
+
+log = logging.getLogger(__name__)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'AVAILABILITY', {})}
+
+
+def normalize(field, value):
+    """The form the value is stored in by UserManager._build_user."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    if not value:
+        return None
+    if field == 'email':
+        return BaseUserManager.normalize_email(value)
+    return value
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class AvailabilityIndex:
+    def __init__(self, config=None):
+        self.config = config or get_config()
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._sync_pid = os.getpid()
+        self._retry_at = 0.0
+        self._filter = None
+        self._watermark = None
+        self._last_sync = 0.0
+        self._built_at = 0.0
+        self._deletes = 0
+        # counters for /metrics
+        self.filtered = 0   # answered "free" without a query
+        self.queries = 0
+
+    def _new_filter(self):
+        # one filter for all three fields, keys are prefixed with the field name
+        return BloomFilter(self.config['EXPECTED_USERS'] * len(FIELDS), self.config['FALSE_POSITIVE_RATE'])
+
+    # -- writes ---------------------------------------------------------
+
+    def add_user(self, user):
+        if self._filter is None:
+            return  # the first load will see it
+        with self._lock:
+            for field in FIELDS:
+                value = normalize(field, getattr(user, field))
+                if value is not None:
+                    self._filter.add(f'{field}:{value}')
+
+    def user_deleted(self):
+        self._deletes += 1
+
+    # -- reads ----------------------------------------------------------
+
+    def maybe_taken(self, values):
+        """{field: value} -> the subset the filter cannot rule out."""
+        self.sync_if_due()
+        bloom = self._filter
+        if bloom is None:
+            return values  # not loaded yet
+        return {field: value for field, value in values.items() if f'{field}:{value}' in bloom}
+
+    def check(self, **values):
+        """
+        username= / email= / phone= -> {field: available}, for the fields given.
+        At most one query, none when the filter rules every value out.
+        """
+        values = {field: normalize(field, values.get(field)) for field in FIELDS if values.get(field)}
+        values = {field: value for field, value in values.items() if value is not None}
+        result = {field: True for field in values}
+        suspects = self.maybe_taken(values)
+        if not suspects:
+            self.filtered += 1
+            return result
+
+        self.queries += 1
+        User = get_user_model()
+        condition = Q()
+        for field, value in suspects.items():
+            condition |= Q(**{field: value})
+        for row in User.objects.filter(condition).values_list(*suspects)[:len(suspects)]:
+            for field, value in zip(suspects, row):
+                if value == suspects[field]:
+                    result[field] = False
+        return result
+
+    async def acheck(self, **values):
+        return await sync_to_async(self.check)(**values)
+
+    # -- maintenance ----------------------------------------------------
+
+    def _needs_sync(self):
+        now = time.time()
+        if now < self._retry_at:
+            return False
+        if self._filter is None:
+            return True
+        if now - self._built_at >= self.config['REBUILD_INTERVAL'] or \
+                self._deletes >= self.config['REBUILD_AFTER_DELETES']:
+            return True
+        interval = self.config['SYNC_INTERVAL']
+        return interval is not None and now - self._last_sync >= interval
+
+    def sync_if_due(self):
+        """Start a background sync when one is due, without waiting for it."""
+        if not self.config['BACKGROUND_SYNC'] or not self._needs_sync():
+            return
+        with self._lock:
+            if self._sync_pid != os.getpid():
+                # forked while a sync ran: its thread doesn't exist here
+                self._sync_lock = threading.Lock()
+                self._sync_pid = os.getpid()
+        # one thread syncs; requests keep using the current filter meanwhile
+        if self._sync_lock.acquire(blocking=False):
+            try:
+                threading.Thread(target=self._background_sync, name='availability-sync', daemon=True).start()
+            except BaseException:
+                self._sync_lock.release()
+                raise
+
+    def _background_sync(self):
+        from django.db import connections
+
+        try:
+            if self._needs_sync():
+                self.sync()
+        except Exception:
+            # not again before SYNC_INTERVAL (at least a second), whatever is due
+            self._retry_at = time.time() + max(self.config['SYNC_INTERVAL'] or 0, 1)
+            log.warning('syncing the availability index failed', exc_info=True)
+        finally:
+            connections.close_all()  # this thread's connections only
+            self._sync_lock.release()
+
+    def sync(self):
+        """Full load when there is no filter or it is due a rebuild, else users joined since the last sync."""
+        User = get_user_model()
+        now = time.time()
+        rebuild = (
+            self._filter is None
+            or now - self._built_at >= self.config['REBUILD_INTERVAL']
+            or self._deletes >= self.config['REBUILD_AFTER_DELETES']
+        )
+        bloom = self._new_filter() if rebuild else self._filter
+        deletes = self._deletes
+        sync_started = timezone.now()
+
+        queryset = User.objects.order_by('date_joined', 'pk')
+        if not rebuild:
+            overlap = datetime.timedelta(seconds=self.config['SYNC_OVERLAP'])
+            queryset = queryset.filter(date_joined__gte=self._watermark - overlap)
+
+        batch_size = self.config['LOAD_BATCH_SIZE']
+        last = None
+        while True:
+            page = queryset
+            if last is not None:
+                page = page.filter(Q(date_joined__gt=last[0]) | Q(date_joined=last[0], pk__gt=last[1]))
+            rows = list(page.values_list('date_joined', 'pk', *FIELDS)[:batch_size])
+            with self._lock:
+                for row in rows:
+                    for field, value in zip(FIELDS, row[2:]):
+                        if value is not None:
+                            bloom.add(f'{field}:{value}')
+            if rows:
+                last = rows[-1][:2]
+            if len(rows) < batch_size:
+                break
+
+        with self._lock:
+            if rebuild:
+                self._filter = bloom
+                self._built_at = now
+                self._deletes -= deletes
+            self._watermark = sync_started
+            self._last_sync = now
+
+    def reset(self):
+        with self._lock:
+            self._filter = None
+            self._watermark = None
+            self._last_sync = self._built_at = self._retry_at = 0.0
+            self._deletes = 0
+            self.filtered = self.queries = 0
+
+    def stats(self):
+        bloom = self._filter
+        return {
+            'entries': bloom.count if bloom else 0,
+            'bytes': len(bloom.bits) if bloom else 0,
+            'filtered': self.filtered,
+            'queries': self.queries,
+        }
+
+
+availability_index = AvailabilityIndex()
+
+
+def _conflicts(result):
+    return {
+        field: [f'A user with that {field} already exists.']
+        for field, available in result.items() if not available
+    }
+
+
+def ensure_available(validated_data):
+    """Registration pre-check, run before the password is hashed."""
+    errors = _conflicts(availability_index.check(**{f: validated_data.get(f) for f in FIELDS}))
+    if errors:
+        raise serializers.ValidationError(errors)
+
+
+async def aensure_available(validated_data):
+    errors = _conflicts(await availability_index.acheck(**{f: validated_data.get(f) for f in FIELDS}))
+    if errors:
+        raise serializers.ValidationError(errors)
+
+
+@receiver(setting_changed)
+def _reset_on_setting_change(*, setting, **kwargs):
+    if setting == 'AVAILABILITY':
+        availability_index.config = get_config()
+        availability_index.reset()
@@ -0,0 +1,259 @@
+"""
+In-memory index of blacklisted refresh-token JTIs.
+
+simplejwt answers "is this token blacklisted?" with a query on the
+token_blacklist tables for every refresh, logout and verify. The index keeps
+jti -> exp for every blacklisted, not yet expired token, so those checks are
+a dict lookup and a negative answer never touches the database.
+
+- New rows are added through the post_save signal on BlacklistedToken
+  (apps.accounts.signals), whichever code path created them.
+- On first use the index loads the live rows once, on a background thread;
+  until then misses are checked in the database, so a blacklisted token is
+  never let through.
+- Deleted rows are not removed: purge_tokens only deletes expired tokens,
+  and expired entries are pruned every PRUNE_INTERVAL (and time out in the
+  shared cache). A row deleted by hand keeps its token refused until it
+  expires, unless `discard()` is called for it.
+- With JTI_BLACKLIST['SHARED_CACHE'] set (a CACHES alias, normally redis), entries
+  are also written there with a timeout of the token's remaining life, and
+  local misses are answered by the shared cache. This is what keeps several
+  worker processes consistent.
+- Without a shared cache, each process picks up rows written by other
+  processes with an incremental query (id > last seen) at most every
+  SYNC_INTERVAL seconds, on the same background thread.
+
+Requests never wait for a sync: one thread runs it while the others answer
+from the current entries. With BACKGROUND_SYNC off nothing is loaded unless
+sync() is called.
+"""
+import logging
+import os
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from config.db.routers import primary
+
+DEFAULTS = {
+    'SHARED_CACHE': None,
+    'KEY_PREFIX': 'jti-bl:',
+    'SYNC_INTERVAL': 5,
+    'SYNC_OVERLAP': 100,
+    'PRUNE_INTERVAL': 60,
+    'LOAD_BATCH_SIZE': 5000,
+    'BACKGROUND_SYNC': True,
+}
+
+log = logging.getLogger(__name__)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'JTI_BLACKLIST', {})}
+
+
+class BlacklistIndex:
+    def __init__(self, config=None):
+        self.config = config or get_config()
+        self._entries = {}  # jti -> exp (epoch seconds)
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._sync_pid = os.getpid()
+        self._retry_at = 0.0
+        self._loaded = False
+        self._last_id = 0
+        self._last_sync = 0.0
+        self._last_prune = time.time()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def shared(self):
+        alias = self.config['SHARED_CACHE']
+        return caches[alias] if alias else None
+
+    def _key(self, jti):
+        return self.config['KEY_PREFIX'] + jti
+
+    # -- writes ---------------------------------------------------------
+
+    def add(self, jti, exp):
+        now = time.time()
+        if exp <= now:
+            return
+        with self._lock:
+            self._entries[jti] = exp
+        if self.shared is not None:
+            self.shared.set(self._key(jti), 1, timeout=int(exp - now) + 1)
+
+    def discard(self, jti):
+        with self._lock:
+            self._entries.pop(jti, None)
+        if self.shared is not None:
+            self.shared.delete(self._key(jti))
+
+    # -- reads ----------------------------------------------------------
+
+    def contains(self, jti):
+        self.sync_if_due()
+        self._maybe_prune()
+        if self._local_contains(jti):
+            return True
+        if self.shared is not None and self.shared.get(self._key(jti)):
+            return self._remember(jti)
+        if not self._loaded:
+            return self._stored(jti)
+        self.misses += 1
+        return False
+
+    async def acontains(self, jti):
+        self.sync_if_due()
+        self._maybe_prune()
+        if self._local_contains(jti):
+            return True
+        if self.shared is not None and await self.shared.aget(self._key(jti)):
+            return self._remember(jti)
+        if not self._loaded:
+            return await sync_to_async(self._stored)(jti)
+        self.misses += 1
+        return False
+
+    def _local_contains(self, jti):
+        exp = self._entries.get(jti)
+        if exp is not None and exp > time.time():
+            self.hits += 1
+            return True
+        return False
+
+    def _stored(self, jti):
+        """The database's answer, while the index is not loaded yet."""
+        from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+        with primary():
+            if BlacklistedToken.objects.filter(token__jti=jti).exists():
+                self.hits += 1
+                return True
+        self.misses += 1
+        return False
+
+    def _remember(self, jti):
+        # exp is unknown here; keep it until the next prune window at most
+        with self._lock:
+            self._entries.setdefault(jti, time.time() + self.config['PRUNE_INTERVAL'])
+        self.hits += 1
+        return True
+
+    # -- maintenance ----------------------------------------------------
+
+    def _needs_sync(self):
+        if time.time() < self._retry_at:
+            return False
+        if not self._loaded:
+            return True
+        if self.shared is not None:
+            return False
+        interval = self.config['SYNC_INTERVAL']
+        return interval is not None and time.time() - self._last_sync >= interval
+
+    def sync_if_due(self):
+        """Start a background sync when one is due, without waiting for it."""
+        if not self.config['BACKGROUND_SYNC'] or not self._needs_sync():
+            return
+        with self._lock:
+            if self._sync_pid != os.getpid():
+                # forked while a sync ran: its thread doesn't exist here
+                self._sync_lock = threading.Lock()
+                self._sync_pid = os.getpid()
+        if self._sync_lock.acquire(blocking=False):
+            try:
+                threading.Thread(target=self._background_sync, name='blacklist-sync', daemon=True).start()
+            except BaseException:
+                self._sync_lock.release()
+                raise
+
+    def _background_sync(self):
+        from django.db import connections
+
+        try:
+            if self._needs_sync():
+                self.sync()
+        except Exception:
+            self._retry_at = time.time() + max(self.config['SYNC_INTERVAL'] or 0, 1)
+            log.warning('syncing the blacklist index failed', exc_info=True)
+        finally:
+            connections.close_all()  # this thread's connections only
+            self._sync_lock.release()
+
+    def sync(self):
+        """
+        Load blacklisted rows with id > last seen id (all live rows on the
+        first call), in batches.
+        """
+        from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+        from rest_framework_simplejwt.utils import aware_utcnow
+
+        batch_size = self.config['LOAD_BATCH_SIZE']
+        now = aware_utcnow()
+        # ids are not committed in order under concurrent writers, so re-read
+        # a small window below the last seen id
+        last_id = max(self._last_id - self.config['SYNC_OVERLAP'], 0) if self._loaded else 0
+        while True:
+            # from the primary: a row missing on a lagging replica would be skipped for good
+            with primary():
+                rows = list(
+                    BlacklistedToken.objects
+                    .filter(id__gt=last_id, token__expires_at__gt=now)
+                    .order_by('id')
+                    .values_list('id', 'token__jti', 'token__expires_at')[:batch_size]
+                )
+            with self._lock:
+                for row_id, jti, expires_at in rows:
+                    self._entries[jti] = expires_at.timestamp()
+            if rows:
+                last_id = rows[-1][0]
+            if len(rows) < batch_size:
+                break
+        with self._lock:
+            self._last_id = max(self._last_id, last_id)
+            self._loaded = True
+            self._last_sync = time.time()
+
+    def _maybe_prune(self):
+        now = time.time()
+        if now - self._last_prune < self.config['PRUNE_INTERVAL']:
+            return
+        with self._lock:
+            self._last_prune = now
+            expired = [jti for jti, exp in self._entries.items() if exp <= now]
+            for jti in expired:
+                del self._entries[jti]
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+            self._loaded = False
+            self._last_id = 0
+            self._last_sync = self._retry_at = 0.0
+            self.hits = self.misses = 0
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'shared_cache': self.config['SHARED_CACHE'],
+        }
+
+
+blacklist_index = BlacklistIndex()
+
+
+@receiver(setting_changed)
+def _reset_on_setting_change(*, setting, **kwargs):
+    if setting in ('JTI_BLACKLIST', 'CACHES'):
+        blacklist_index.config = get_config()
+        blacklist_index.reset()
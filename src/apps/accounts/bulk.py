@@ -0,0 +1,151 @@
+"""
+Bulk account creation shared by `manage.py import_users` and the batch
+registration endpoint.
+
+Rows are consumed from an iterator in chunks, so memory stays bounded by the
+chunk size however large the input is. Per chunk: every row is validated with
+RegistrationSerializer, duplicates within the chunk and against the database
+are reported per field, the remaining passwords are hashed in parallel and the
+users are inserted with one bulk_create. A row never aborts its chunk.
+"""
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+
+from . import hashing
+from .availability import availability_index
+from .serializers import RegistrationSerializer
+
+User = get_user_model()
+
+UNIQUE_FIELDS = ('username', 'email', 'phone')
+
+CREATED = 'created'
+INVALID = 'invalid'
+CONFLICT = 'conflict'
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _build(validated_data):
+    user = User.objects._build_user(
+        first_name=validated_data.get('first_name'),
+        last_name=validated_data.get('last_name'),
+        username=validated_data.get('username'),
+        password=validated_data.get('password'),
+        nickname=validated_data.get('nickname'),
+        email=(validated_data.get('email') or None),
+        phone=(validated_data.get('phone') or None),
+        birth_date=validated_data.get('birth_date'),
+    )
+    return user
+
+
+def _existing(field, values):
+    if not values:
+        return set()
+    return set(User.objects.filter(**{f'{field}__in': values}).values_list(field, flat=True))
+
+
+def _insert_one_by_one(users):
+    """Fallback when bulk_create lost a race: returns {index: error} for rows that failed."""
+    failed = {}
+    for index, user in users:
+        try:
+            with transaction.atomic():
+                user.save(force_insert=True)
+        except IntegrityError:
+            failed[index] = {'non_field_errors': ['A user with the same username, email or phone already exists.']}
+    return failed
+
+
+def import_chunk(rows, pool=None, dry_run=False):
+    """
+    rows: [(row_id, dict)]. Returns [(row_id, status, errors)] in input order,
+    where status is CREATED, INVALID or CONFLICT.
+    """
+    results = {}
+    candidates = []  # (row_id, user, password)
+
+    for row_id, data in rows:
+        serializer = RegistrationSerializer(data=data)
+        if not serializer.is_valid():
+            results[row_id] = (INVALID, serializer.errors)
+            continue
+        try:
+            user = _build(serializer.validated_data)
+        except ValueError as exc:
+            results[row_id] = (INVALID, {'non_field_errors': [str(exc)]})
+            continue
+        candidates.append((row_id, user, serializer.validated_data['password']))
+
+    # first occurrence in the chunk wins, later ones conflict
+    seen = {field: {} for field in UNIQUE_FIELDS}
+    unique = []
+    for row_id, user, password in candidates:
+        errors = {}
+        for field in UNIQUE_FIELDS:
+            value = getattr(user, field)
+            if value is None:
+                continue
+            if value in seen[field]:
+                errors[field] = [f'Duplicate of row {seen[field][value]}.']
+        if errors:
+            results[row_id] = (CONFLICT, errors)
+            continue
+        for field in UNIQUE_FIELDS:
+            value = getattr(user, field)
+            if value is not None:
+                seen[field][value] = row_id
+        unique.append((row_id, user, password))
+
+    # one query per unique field for the whole chunk
+    taken = {field: _existing(field, list(seen[field])) for field in UNIQUE_FIELDS}
+    ready = []
+    for row_id, user, password in unique:
+        errors = {
+            field: [f'A user with that {field} already exists.']
+            for field in UNIQUE_FIELDS
+            if getattr(user, field) is not None and getattr(user, field) in taken[field]
+        }
+        if errors:
+            results[row_id] = (CONFLICT, errors)
+        else:
+            ready.append((row_id, user, password))
+
+    if ready and not dry_run:
+        encoded = hashing.make_passwords([password for _, _, password in ready], pool=pool)
+        for (_, user, _), password in zip(ready, encoded):
+            user.password = password
+        users = [user for _, user, _ in ready]
+        try:
+            with transaction.atomic():
+                User.objects.bulk_create(users)
+        except IntegrityError:
+            # someone registered one of these between the check and the insert
+            failed = _insert_one_by_one([(row_id, user) for row_id, user, _ in ready])
+            for row_id, errors in failed.items():
+                results[row_id] = (CONFLICT, errors)
+
+    for row_id, user, _ in ready:
+        if row_id not in results:
+            results[row_id] = (CREATED, None)
+            if not dry_run:
+                # bulk_create sends no post_save
+                availability_index.add_user(user)
+
+    return [(row_id, *results[row_id]) for row_id, _ in rows]
+
+
+def import_rows(rows, chunk_size=500, pool=None, dry_run=False):
+    """Stream (row_id, status, errors) for an iterable of (row_id, dict)."""
+    for chunk in chunked(rows, chunk_size):
+        yield from import_chunk(chunk, pool=pool, dry_run=dry_run)
@@ -0,0 +1,320 @@
+"""
+Refresh-token families: rotation as one compare-and-swap.
+
+With ROTATE_REFRESH_TOKENS and BLACKLIST_AFTER_ROTATION, simplejwt writes an
+OutstandingToken and a BlacklistedToken row (get_or_create, so a SELECT and
+an INSERT each) on every refresh. Here a login creates a TokenFamily and its
+refresh tokens carry the family id and a generation ("fam", "gen"). A
+refresh is
+
+    UPDATE token_family SET generation = gen + 1 ... WHERE id = fam AND generation = gen AND revoked_at IS NULL
+
+and only the token whose generation is current can succeed. Presenting an
+older one again fails the CAS: that is reuse of a rotated token, and the
+whole family is revoked (except within REUSE_GRACE seconds of the rotation,
+which is a client retrying, so the request fails without revoking). Logout
+revokes the family.
+
+The OutstandingToken / BlacklistedToken rows are kept for the admin, the
+verify endpoint (through the JTI index) and purge_tokens, but written behind:
+a daemon thread collects them and writes each batch with a few bulk queries.
+If the process dies before a flush, those rows are missing, which affects the
+bookkeeping only; the family row decides what can still be refreshed.
+
+Tokens without a "fam" claim (issued before families) go through simplejwt.
+"""
+import atexit
+import datetime
+import logging
+import os
+import queue
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import close_old_connections
+from django.dispatch import receiver
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.utils import aware_utcnow, datetime_from_epoch
+from config.db.routers import pin_user, primary
+from config.metrics import registry
+from .blacklist import blacklist_index
+from .models import TokenFamily
+
+log = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    'REUSE_GRACE': 10,
+    'WRITE_BEHIND': True,  # False: write the rows in the request (tests on SQLite)
+    'QUEUE_SIZE': 10000,
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': 1.0,
+}
+
+FAMILY_CLAIM = 'fam'
+GENERATION_CLAIM = 'gen'
+
+_STOP = object()
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'TOKEN_FAMILIES', {})}
+
+
+def outstanding_row(token, user_id=None, blacklisted=False):
+    """What the bookkeeper writes for a token: (blacklisted, user id, jti, token, exp)."""
+    return blacklisted, user_id, token[api_settings.JTI_CLAIM], str(token), token['exp']
+
+
+def record(row):
+    get_bookkeeper().submit(row)
+
+
+async def arecord(row):
+    bookkeeper = get_bookkeeper()
+    if bookkeeper.inline:
+        await sync_to_async(bookkeeper.submit)(row)
+    else:
+        bookkeeper.submit(row)
+
+
+def start(token, user):
+    """Open a family for a new login's refresh token (see tokens.FamilyRefreshToken)."""
+    family = TokenFamily.objects.create(user=user, expires_at=datetime_from_epoch(token['exp']))
+    pin_user(user.pk)  # the client refreshes with this token next
+    record(_started(token, family, user))
+    return token
+
+
+async def astart(token, user):
+    family = await TokenFamily.objects.acreate(user=user, expires_at=datetime_from_epoch(token['exp']))
+    pin_user(user.pk)
+    await arecord(_started(token, family, user))
+    return token
+
+
+def _started(token, family, user):
+    token[FAMILY_CLAIM] = str(family.pk)
+    token[GENERATION_CLAIM] = 0
+    return outstanding_row(token, user.pk)
+
+
+def is_family_token(token):
+    return FAMILY_CLAIM in token.payload
+
+
+def _user_id(token):
+    return token.get(api_settings.USER_ID_CLAIM)
+
+
+def _next(token):
+    """
+    Advance the token in place; returns the CAS arguments (family, generation,
+    new exp) and the blacklist row of the presented token.
+    """
+    family, generation = token[FAMILY_CLAIM], token[GENERATION_CLAIM]
+    row = outstanding_row(token, _user_id(token), blacklisted=True)
+    token.set_jti()
+    token.set_exp()
+    token.set_iat()
+    token[GENERATION_CLAIM] = generation + 1
+    return family, generation, datetime_from_epoch(token['exp']), row
+
+
+def _cas(family, generation):
+    return TokenFamily.objects.filter(pk=family, generation=generation, revoked_at=None)
+
+
+def _reused(family, generation):
+    """The CAS failed: tell a retried rotation from reuse of an old token, revoke on reuse."""
+    now = aware_utcnow()
+    row = TokenFamily.objects.filter(pk=family).values('generation', 'rotated_at', 'revoked_at').first()
+    if row is None or row['revoked_at'] is not None:
+        return TokenError('Token is blacklisted')
+    grace = datetime.timedelta(seconds=get_config()['REUSE_GRACE'])
+    if row['generation'] == generation + 1 and row['rotated_at'] and now - row['rotated_at'] <= grace:
+        return TokenError('Token has already been rotated')
+    TokenFamily.objects.filter(pk=family, revoked_at=None).update(revoked_at=now)
+    registry.inc('artq_refresh_reuse_total', ())
+    log.warning('refresh token reuse in family %s (generation %s of %s), family revoked',
+                family, generation, row['generation'])
+    return TokenError('Token is blacklisted')
+
+
+def rotate(token):
+    """TokenRefreshSerializer.validate for a family token: {"access", "refresh"}."""
+    if not api_settings.ROTATE_REFRESH_TOKENS:
+        if not TokenFamily.objects.filter(pk=token[FAMILY_CLAIM], revoked_at=None).exists():
+            raise TokenError('Token is blacklisted')
+        return {'access': str(token.access_token)}
+    family, generation, expires_at, row = _next(token)
+    if not _cas(family, generation).update(
+        generation=generation + 1, rotated_at=aware_utcnow(), expires_at=expires_at,
+    ):
+        # a reused token was blacklisted when it was rotated
+        raise _reused(family, generation)
+    record(row)
+    record(outstanding_row(token, _user_id(token)))
+    return {'access': str(token.access_token), 'refresh': str(token)}
+
+
+async def arotate(token):
+    if not api_settings.ROTATE_REFRESH_TOKENS:
+        if not await TokenFamily.objects.filter(pk=token[FAMILY_CLAIM], revoked_at=None).aexists():
+            raise TokenError('Token is blacklisted')
+        return {'access': str(token.access_token)}
+    family, generation, expires_at, row = _next(token)
+    if not await _cas(family, generation).aupdate(
+        generation=generation + 1, rotated_at=aware_utcnow(), expires_at=expires_at,
+    ):
+        raise await sync_to_async(_reused)(family, generation)
+    await arecord(row)
+    await arecord(outstanding_row(token, _user_id(token)))
+    return {'access': str(token.access_token), 'refresh': str(token)}
+
+
+def revoke(token):
+    """Logout: no token of the family can be refreshed any more."""
+    TokenFamily.objects.filter(pk=token[FAMILY_CLAIM], revoked_at=None).update(revoked_at=aware_utcnow())
+    record(outstanding_row(token, _user_id(token), blacklisted=True))
+
+
+async def arevoke(token):
+    await TokenFamily.objects.filter(pk=token[FAMILY_CLAIM], revoked_at=None).aupdate(revoked_at=aware_utcnow())
+    await arecord(outstanding_row(token, _user_id(token), blacklisted=True))
+
+
+class Bookkeeper:
+    """Write-behind for OutstandingToken / BlacklistedToken rows."""
+
+    def __init__(self, config):
+        self.config = config
+        self.queue = queue.Queue(maxsize=config['QUEUE_SIZE'])
+        self.submitted = 0
+        self.dropped = 0
+        self.written = 0
+        self.errors = 0
+        self._drop_lock = threading.Lock()
+        self.pid = os.getpid()
+        self._thread = None
+        if config['WRITE_BEHIND']:
+            self._thread = threading.Thread(target=self._run, name='token-bookkeeper', daemon=True)
+            self._thread.start()
+
+    @property
+    def inline(self):
+        return self._thread is None
+
+    def submit(self, item):
+        if self.inline:
+            self.submitted += 1
+            self._write([item], close=False)
+            return
+        try:
+            self.queue.put_nowait(item)
+            self.submitted += 1
+        except queue.Full:
+            with self._drop_lock:
+                self.dropped += 1
+
+    def _run(self):
+        batch_size = self.config['BATCH_SIZE']
+        interval = self.config['FLUSH_INTERVAL']
+        while True:
+            try:
+                first = self.queue.get(timeout=interval)
+            except queue.Empty:
+                continue
+            batch = [first]
+            while len(batch) < batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = any(item is _STOP for item in batch)
+            self._write([item for item in batch if item is not _STOP])
+            if stop:
+                return
+
+    def _write(self, batch, close=True):
+        if not batch:
+            return
+        now = aware_utcnow()
+        blacklisted = {jti: exp for is_blacklisted, _, jti, _, exp in batch if is_blacklisted}
+        try:
+            OutstandingToken.objects.bulk_create(
+                [
+                    OutstandingToken(user_id=user_id, jti=jti, token=raw, created_at=now, expires_at=datetime_from_epoch(exp))
+                    for _, user_id, jti, raw, exp in batch
+                ],
+                ignore_conflicts=True,
+            )
+            if blacklisted:
+                # just written, not necessarily on a replica yet
+                with primary():
+                    ids = list(OutstandingToken.objects.filter(jti__in=list(blacklisted)).values_list('id', flat=True))
+                BlacklistedToken.objects.bulk_create([BlacklistedToken(token_id=pk) for pk in ids], ignore_conflicts=True)
+            self.written += len(batch)
+        except Exception:
+            self.errors += 1
+            with self._drop_lock:
+                self.dropped += len(batch)
+            log.exception('token bookkeeping write failed, %d rows lost', len(batch))
+        finally:
+            # bulk_create sends no post_save, index them here
+            for jti, exp in blacklisted.items():
+                blacklist_index.add(jti, exp)
+            if close:
+                close_old_connections()
+
+    def close(self, timeout=5):
+        if self._thread is None:
+            return
+        try:
+            self.queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def stats(self):
+        return {
+            'submitted': self.submitted,
+            'written': self.written,
+            'dropped': self.dropped,
+            'errors': self.errors,
+            'queued': self.queue.qsize(),
+        }
+
+
+_bookkeeper = None
+_bookkeeper_lock = threading.Lock()
+
+
+def get_bookkeeper():
+    """Process-wide bookkeeper, started on first use (and again after fork)."""
+    global _bookkeeper
+    if _bookkeeper is None or _bookkeeper.pid != os.getpid():
+        with _bookkeeper_lock:
+            if _bookkeeper is None or _bookkeeper.pid != os.getpid():
+                _bookkeeper = Bookkeeper(get_config())
+                atexit.register(_bookkeeper.close)
+    return _bookkeeper
+
+
+def flush(timeout=5):
+    """Write everything queued so far and start a new bookkeeper (tests, benchmarks)."""
+    global _bookkeeper
+    with _bookkeeper_lock:
+        bookkeeper, _bookkeeper = _bookkeeper, None
+    if bookkeeper is not None:
+        bookkeeper.close(timeout)
+
+
+@receiver(setting_changed)
+def _reset_on_setting_change(*, setting, **kwargs):
+    if setting == 'TOKEN_FAMILIES':
+        flush()
@@ -0,0 +1,210 @@
+"""
+Password hashing off the request thread.
+
+PBKDF2 holds the GIL for the whole hash, so a burst of logins or
+registrations starves every other request served by the same worker. When
+settings.PASSWORD_HASHING_POOL['ENABLED'] is set, make_password / verify_password
+run in a bounded process pool instead and the request thread only waits on
+the result. With the pool disabled everything runs inline, as before.
+"""
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from config.metrics import observe_password_hash
+from config.tracing import span
+
+DEFAULTS = {
+    'ENABLED': False,
+    'MAX_WORKERS': None,    # None -> os.cpu_count()
+    'MAX_QUEUE': 64,        # submissions waiting on top of MAX_WORKERS running
+    'TIMEOUT': 10,          # seconds a request waits for its hash
+}
+
+
+class HashingPoolFull(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many authentication requests in progress, try again shortly.'
+    default_code = 'hashing_busy'
+
+
+def _init_worker(settings_module, password_hashers):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    settings.PASSWORD_HASHERS = password_hashers
+
+
+def _make_password(password):
+    return hashers.make_password(password)
+
+
+def _verify_password(password, encoded):
+    return hashers.verify_password(password, encoded)
+
+
+class HashingPool:
+    def __init__(self, max_workers=None, max_queue=64, timeout=10):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(self.max_workers + max_queue)
+        self.rejected = 0
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(os.environ.get('DJANGO_SETTINGS_MODULE', 'config.settings'), list(settings.PASSWORD_HASHERS)),
+        )
+        self.pid = os.getpid()
+
+    def submit(self, fn, *args, block=False):
+        # reject instead of queueing without bound: a full pool means the
+        # caller should back off, not wait behind hundreds of hashes
+        acquired = self._slots.acquire(timeout=self.timeout) if block else self._slots.acquire(blocking=False)
+        if not acquired:
+            self.rejected += 1
+            raise HashingPoolFull()
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def run(self, fn, *args):
+        try:
+            return self.submit(fn, *args).result(timeout=self.timeout)
+        except TimeoutError:
+            raise HashingPoolFull()
+
+    async def arun(self, fn, *args):
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(self.submit(fn, *args)), self.timeout)
+        except asyncio.TimeoutError:
+            raise HashingPoolFull()
+
+    def map(self, fn, items):
+        """
+        Bulk work (imports): at most max_workers items are in flight at a time,
+        so interactive requests can still queue in between.
+        """
+        results = []
+        for start in range(0, len(items), self.max_workers):
+            futures = [self.submit(fn, item, block=True) for item in items[start:start + self.max_workers]]
+            results.extend(future.result() for future in futures)
+        return results
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(bulk=False):
+    """
+    Process-wide pool, or None when disabled. Recreated after fork. Bulk work
+    (batch registration) always gets one: hundreds of inline hashes would hold
+    the worker's GIL for seconds.
+    """
+    global _pool
+    config = {**DEFAULTS, **getattr(settings, 'PASSWORD_HASHING_POOL', {})}
+    if not (config['ENABLED'] or bulk):
+        return None
+    if _pool is None or _pool.pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool.pid != os.getpid():
+                _pool = HashingPool(config['MAX_WORKERS'], config['MAX_QUEUE'], config['TIMEOUT'])
+    return _pool
+
+
+def reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool.pid == os.getpid():
+            _pool.shutdown()
+        _pool = None
+
+
+@receiver(setting_changed)
+def _reset_on_setting_change(*, setting, **kwargs):
+    if setting in ('PASSWORD_HASHERS', 'PASSWORD_HASHING_POOL'):
+        reset_pool()
+
+
+def make_password(password):
+    pool = get_pool()
+    start = time.perf_counter()
+    with span('password.make'):
+        if pool is None or password is None:
+            encoded = hashers.make_password(password)
+        else:
+            encoded = pool.run(_make_password, password)
+    observe_password_hash('make', time.perf_counter() - start)
+    return encoded
+
+
+async def amake_password(password):
+    pool = get_pool()
+    start = time.perf_counter()
+    with span('password.make'):
+        if pool is None or password is None:
+            encoded = await sync_to_async(hashers.make_password, thread_sensitive=False)(password)
+        else:
+            encoded = await pool.arun(_make_password, password)
+    observe_password_hash('make', time.perf_counter() - start)
+    return encoded
+
+
+def make_passwords(passwords, pool=None):
+    """Hash a list of passwords, in parallel when a pool is given or enabled."""
+    pool = pool or get_pool()
+    if pool is None:
+        return [hashers.make_password(password) for password in passwords]
+    return pool.map(_make_password, list(passwords))
+
+
+def check_password(password, encoded, setter=None):
+    """Same contract as django.contrib.auth.hashers.check_password."""
+    if password is None or not hashers.is_password_usable(encoded):
+        return False
+    pool = get_pool()
+    start = time.perf_counter()
+    with span('password.verify'):
+        if pool is None:
+            is_correct, must_update = hashers.verify_password(password, encoded)
+        else:
+            is_correct, must_update = pool.run(_verify_password, password, encoded)
+    observe_password_hash('verify', time.perf_counter() - start)
+    if setter and is_correct and must_update:
+        setter(password)
+    return is_correct
+
+
+async def acheck_password(password, encoded, setter=None):
+    """Same contract as django.contrib.auth.hashers.acheck_password."""
+    if password is None or not hashers.is_password_usable(encoded):
+        return False
+    pool = get_pool()
+    start = time.perf_counter()
+    with span('password.verify'):
+        if pool is None:
+            # never hash on the event loop itself
+            is_correct, must_update = await sync_to_async(hashers.verify_password, thread_sensitive=False)(password, encoded)
+        else:
+            is_correct, must_update = await pool.arun(_verify_password, password, encoded)
+    observe_password_hash('verify', time.perf_counter() - start)
+    if setter and is_correct and must_update:
+        await setter(password)
+    return is_correct
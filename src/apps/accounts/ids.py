@@ -0,0 +1,59 @@
+"""
+Time-ordered UUIDs (version 7, RFC 9562) for primary keys.
+
+    48 bits  unix time in milliseconds
+     4 bits  version (7)
+    12 bits  counter within the millisecond, started at a random value
+     2 bits  variant
+    62 bits  random
+
+New keys sort after older ones, so inserts land on the right edge of the
+primary-key index (and of every foreign-key index to it) instead of on a
+random page: fewer page splits, and the pages being written stay cached.
+Version 4 keys created before keep working, a UUIDField takes both.
+
+The counter keeps keys of one process strictly increasing inside a
+millisecond; when it runs out the timestamp is advanced by one. The creation
+time can be read back with `timestamp()`, so don't use these ids where that
+must stay secret.
+"""
+import os
+import threading
+import time
+import uuid
+
+_lock = threading.Lock()
+_last_ms = 0
+_counter = 0
+
+
+def uuid7():
+    global _last_ms, _counter
+    ms = time.time_ns() // 1_000_000
+    rand = int.from_bytes(os.urandom(10), 'big')
+    with _lock:
+        if ms > _last_ms:
+            _last_ms = ms
+            # the top bit stays clear, leaving at least 2048 keys for this millisecond
+            _counter = rand >> 69
+        else:
+            _counter += 1
+            if _counter > 0xfff:
+                _last_ms += 1
+                _counter = 0
+            ms = _last_ms
+        counter = _counter
+    return uuid.UUID(int=(
+        ms << 80
+        | 0x7 << 76
+        | counter << 64
+        | 0b10 << 62
+        | rand & 0x3fff_ffff_ffff_ffff
+    ))
+
+
+def timestamp(value):
+    """Unix time in seconds a version 7 UUID was created at, or None for other versions."""
+    if value.version != 7:
+        return None
+    return (value.int >> 80) / 1000
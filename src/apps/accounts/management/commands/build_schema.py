@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from config import schema
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate the OpenAPI schema served on /schema/ for the current code version "
+        "(YAML and JSON, plus gzip/br variants) into SCHEMA_CACHE['DIR'], so worker "
+        "processes load it instead of generating it on their first request."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=None, help="defaults to SCHEMA_CACHE['DIR']")
+
+    def handle(self, *args, dir, **options):
+        directory = dir or schema.get_config()['DIR']
+        if not directory:
+            raise CommandError("Set SCHEMA_CACHE['DIR'] (SCHEMA_CACHE_DIR) or pass --dir")
+
+        key = schema.schema_key()
+        variants = schema.build_variants(schema.generate())
+        schema.write_files(directory, key, variants)
+
+        sizes = ', '.join(
+            f"{fmt}: {len(by_encoding[None].body)} B"
+            + ''.join(f" / {encoding} {len(v.body)} B" for encoding, v in by_encoding.items() if encoding)
+            for fmt, by_encoding in variants.items()
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote schema {key} to {directory} [{sizes}]"
+        ))
@@ -0,0 +1,100 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from config.startup import group, parse_importtime
+
+PHASES = ('setup_s', 'handler_s', 'urlconf_s', 'warmup_s', 'first_request_s', 'steady_request_s')
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure worker cold start in fresh interpreters: time to django.setup(), "
+        "middleware, URLconf and the first response, and per-package import cost "
+        "(python -X importtime). --compare runs the full and api BOOT_PROFILEs side by side."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profile', choices=('full', 'api'), default=None,
+                            help='BOOT_PROFILE to measure (default: the current one)')
+        parser.add_argument('--compare', action='store_true', help='measure both profiles')
+        parser.add_argument('--runs', type=int, default=5, help='cold starts per profile, the median is reported')
+        parser.add_argument('--path', default='/v1/auth/verify/')
+        parser.add_argument('--method', default='POST')
+        parser.add_argument('--top', type=int, default=15, help='packages / modules to list (0 to skip)')
+        parser.add_argument('--json', dest='json_path', default=None, help='also write the results to this file')
+        parser.add_argument('--warmup', action='store_true',
+                            help='run config.warmup.warm() before the first request, as `serve` does')
+
+    def handle(self, *args, profile, compare, runs, path, method, top, json_path, warmup, **options):
+        self.warmup = warmup
+        profiles = ['full', 'api'] if compare else [profile or settings.BOOT_PROFILE]
+        results = {}
+        with tempfile.TemporaryDirectory(prefix='artq-startup-') as workdir:
+            for name in profiles:
+                results[name] = self.profile(name, runs, method, path, top, workdir)
+
+        if compare:
+            full, api = results['full']['total_s'], results['api']['total_s']
+            self.stdout.write(self.style.SUCCESS(
+                f"\napi vs full: {api * 1000:.0f} ms vs {full * 1000:.0f} ms to first response "
+                f"({(full - api) / full:+.1%})"
+            ))
+        if json_path:
+            with open(json_path, 'w') as f:
+                json.dump(results, f, indent=2)
+
+    def run(self, profile, method, path, workdir, importtime=False):
+        env = {
+            **os.environ,
+            'BOOT_PROFILE': profile,
+            'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'config.settings'),
+            'REQUEST_LOG_PATH': os.path.join(workdir, 'requests.jsonl'),
+            'PYTHONDONTWRITEBYTECODE': '',
+            'STARTUP_WARMUP': '1' if self.warmup else '0',
+        }
+        cmd = [sys.executable] + (['-X', 'importtime'] if importtime else []) + \
+              ['-m', 'config.startup', method, path]
+        spawned = time.time()
+        proc = subprocess.run(cmd, cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise CommandError(f"startup run failed:\n{proc.stderr[-2000:]}")
+        data = json.loads(proc.stdout.strip().splitlines()[-1])
+        # includes interpreter start, which the child cannot time itself
+        data['total_s'] = data['ready_at'] - spawned
+        return data, proc.stderr
+
+    def profile(self, name, runs, method, path, top, workdir):
+        samples = [self.run(name, method, path, workdir)[0] for _ in range(runs)]
+        result = {key: statistics.median(s[key] for s in samples) for key in PHASES + ('total_s',)}
+        result.update(status=samples[0]['status'], modules=samples[0]['modules'])
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\nBOOT_PROFILE={name} (median of {runs})"))
+        for key in ('total_s',) + PHASES:
+            self.stdout.write(f"  {key[:-2]:<16}{result[key] * 1000:>9.1f} ms")
+        self.stdout.write(f"  {'status':<16}{result['status']:>9}")
+        self.stdout.write(f"  {'modules':<16}{result['modules']:>9}")
+
+        if top:
+            _, stderr = self.run(name, method, path, workdir, importtime=True)
+            rows = parse_importtime(stderr)
+            packages = Counter()
+            for module, self_us, _, _ in rows:
+                packages[group(module)] += self_us
+            result['imports_ms'] = round(sum(packages.values()) / 1000, 1)
+            result['packages_ms'] = {k: round(v / 1000, 1) for k, v in packages.most_common(top)}
+            self.stdout.write(f"  imports {result['imports_ms']:.1f} ms (self time, -X importtime); top packages:")
+            for package, ms in result['packages_ms'].items():
+                self.stdout.write(f"    {ms:>8.1f} ms  {package}")
+            self.stdout.write("  top modules (cumulative):")
+            for module, _, cumulative, depth in sorted(rows, key=lambda r: -r[2])[:top]:
+                self.stdout.write(f"    {cumulative / 1000:>8.1f} ms  {'  ' * depth}{module}")
+        return result
@@ -0,0 +1,79 @@
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.utils import aware_utcnow
+from apps.accounts.models import TokenFamily
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete expired outstanding tokens, their blacklist rows and expired token families in small, "
+        "separately committed batches (flushexpiredtokens issues one unbounded DELETE). "
+        "With --checkpoint an interrupted run resumes where it stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--sleep', type=float, default=0.0,
+                            help='seconds to pause between batches to limit load on the primary')
+        parser.add_argument('--max-batches', type=int, default=None,
+                            help='stop after this many batches')
+        parser.add_argument('--checkpoint', type=Path, default=None,
+                            help='file holding the last scanned id; removed when a scan completes')
+
+    def handle(self, *args, batch_size, sleep, max_batches, checkpoint, **options):
+        # fixed cutoff, so every batch of one run agrees on what "expired" means
+        now = aware_utcnow()
+        checkpoint = Path(checkpoint) if checkpoint else None
+        last_id = 0
+        if checkpoint and checkpoint.exists():
+            last_id = int(checkpoint.read_text().strip() or 0)
+            self.stdout.write(f"Resuming after id {last_id}")
+
+        batches = deleted_outstanding = deleted_blacklisted = 0
+        while max_batches is None or batches < max_batches:
+            rows = list(
+                OutstandingToken.objects
+                .filter(id__gt=last_id)
+                .order_by('id')
+                .values_list('id', 'expires_at')[:batch_size]
+            )
+            if not rows:
+                if checkpoint and checkpoint.exists():
+                    checkpoint.unlink()
+                break
+
+            expired = [pk for pk, expires_at in rows if expires_at <= now]
+            if expired:
+                with transaction.atomic():
+                    blacklisted, _ = BlacklistedToken.objects.filter(token_id__in=expired).delete()
+                    outstanding, _ = OutstandingToken.objects.filter(id__in=expired).delete()
+                deleted_blacklisted += blacklisted
+                deleted_outstanding += outstanding
+
+            last_id = rows[-1][0]
+            if checkpoint:
+                checkpoint.write_text(str(last_id))
+            batches += 1
+            if sleep:
+                time.sleep(sleep)
+
+        # families whose newest token has expired: nothing left to refresh
+        deleted_families = 0
+        while max_batches is None or batches < max_batches:
+            expired = list(TokenFamily.objects.filter(expires_at__lte=now).values_list('pk', flat=True)[:batch_size])
+            if not expired:
+                break
+            deleted, _ = TokenFamily.objects.filter(pk__in=expired).delete()
+            deleted_families += deleted
+            batches += 1
+            if sleep:
+                time.sleep(sleep)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {deleted_outstanding} outstanding and {deleted_blacklisted} blacklisted "
+            f"tokens and {deleted_families} token families in {batches} batches."
+        ))
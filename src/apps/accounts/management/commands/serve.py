@@ -0,0 +1,33 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from config import serve
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the production server (config.serve): gunicorn workers forked from a master that "
+        "loaded and warmed up the app, recycled after --max-requests. Options override SERVE."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=serve.MODES)
+        parser.add_argument('--bind')
+        parser.add_argument('--workers', type=int)
+        parser.add_argument('--threads', type=int, help='per wsgi worker')
+        parser.add_argument('--max-requests', type=int, help='recycle a worker after this many (0: never)')
+        parser.add_argument('--max-requests-jitter', type=int)
+        parser.add_argument('--timeout', type=int)
+        parser.add_argument('--no-warmup', action='store_true', help='skip config.warmup')
+
+    def handle(self, *args, no_warmup, **options):
+        config = serve.get_config()
+        for key in ('mode', 'bind', 'workers', 'threads', 'max_requests', 'max_requests_jitter', 'timeout'):
+            if options[key] is not None:
+                config[key.upper()] = options[key]
+        if no_warmup:
+            config['WARMUP'] = False
+        try:
+            serve.run(config)
+        except ImproperlyConfigured as exc:
+            raise CommandError(exc)
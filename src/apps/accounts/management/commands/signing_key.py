@@ -0,0 +1,58 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.accounts import signing
+
+
+class Command(BaseCommand):
+    help = (
+        "Write a new token signing key <kid>.pem to JWT_SIGNING['KEYS_DIR'] (apps.accounts.signing). "
+        "It is published at /.well-known/jwks.json after the next restart and signs once it is the "
+        "active key; with --retire, replace a key's private half by its public one."
+    )
+
+    # the missing key is what the checks would complain about
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('kid', help="key id, e.g. the month: 2026-10 (sorts after the older ones)")
+        parser.add_argument('--algorithm', choices=signing.ALGORITHMS,
+                            help="default: JWT_SIGNING['ALGORITHM'], else EdDSA")
+        parser.add_argument('--retire', action='store_true',
+                            help='keep only the public key of <kid>: it verifies but no longer signs')
+
+    def handle(self, *args, kid, algorithm, retire, **options):
+        if os.sep in kid or kid.startswith('.'):
+            raise CommandError(f'invalid kid {kid!r}')
+        config = signing.get_config()
+        directory = config['KEYS_DIR']
+        private_path = os.path.join(directory, f'{kid}.pem')
+
+        if retire:
+            if not os.path.exists(private_path):
+                raise CommandError(f'{private_path} does not exist')
+            private = sorted(name[:-4] for name in os.listdir(directory) if name.endswith('.pem'))
+            if kid == (config['ACTIVE_KID'] or private[-1]):
+                raise CommandError(f'{kid} is the key that signs, activate another one first')
+            from cryptography.hazmat.primitives import serialization
+
+            with open(private_path, 'rb') as f:
+                key = serialization.load_pem_private_key(f.read(), password=None)
+            public = key.public_key().public_bytes(serialization.Encoding.PEM,
+                                                   serialization.PublicFormat.SubjectPublicKeyInfo)
+            with open(os.path.join(directory, f'{kid}.pub'), 'wb') as f:
+                f.write(public)
+            os.unlink(private_path)
+            self.stdout.write(self.style.SUCCESS(f'{kid}: private key removed, {kid}.pub verifies its tokens'))
+            return
+
+        if os.path.exists(private_path) or os.path.exists(os.path.join(directory, f'{kid}.pub')):
+            raise CommandError(f'a key {kid} already exists in {directory}')
+        algorithm = algorithm or (config['ALGORITHM'] if config['ALGORITHM'] in signing.ALGORITHMS else 'EdDSA')
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        # owner-only from the start, the key never sits world-readable
+        fd = os.open(private_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(signing.generate_key(algorithm))
+        self.stdout.write(self.style.SUCCESS(f'{private_path}: new {algorithm} key {kid}'))
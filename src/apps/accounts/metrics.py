@@ -0,0 +1,60 @@
+"""
+Cumulative per-process counters of the accounts caches, exported on /metrics
+(registered in AccountsConfig.ready).
+"""
+from .authentication import verified_tokens
+from .availability import availability_index
+from .blacklist import blacklist_index
+from .user_cache import user_cache
+from . import families, hashing, throttling, verification
+
+HELP = {
+    'artq_token_cache_hits_total': 'Verified-token cache hits.',
+    'artq_token_cache_misses_total': 'Verified-token cache misses.',
+    'artq_token_cache_evictions_total': 'Verified-token cache LRU evictions.',
+    'artq_jti_blacklist_hits_total': 'Blacklist index lookups that found the JTI.',
+    'artq_jti_blacklist_misses_total': 'Blacklist index lookups answered "not blacklisted".',
+    'artq_user_cache_hits_total': 'Authenticated requests whose user came from the user cache.',
+    'artq_user_cache_misses_total': 'Authenticated requests that loaded the user from the database.',
+    'artq_user_cache_invalidations_total': 'User cache version bumps (user saved or deleted).',
+    'artq_availability_filtered_total': 'Availability checks answered by the bloom filter alone.',
+    'artq_availability_queries_total': 'Availability checks that needed a database query.',
+    'artq_password_hash_rejected_total': 'Hashes rejected because the hashing pool queue was full.',
+    'artq_throttle_backend_errors_total': 'Throttle checks let through because Redis failed.',
+    'artq_token_bookkeeping_written_total': 'Outstanding / blacklisted token rows written behind.',
+    'artq_token_bookkeeping_dropped_total': 'Token bookkeeping rows dropped (queue full or write failed).',
+    'artq_verification_queued_total': 'Verification messages queued for the Celery dispatcher.',
+    'artq_verification_dropped_total': 'Verification messages dropped because the dispatch queue was full.',
+    'artq_verification_publish_errors_total': 'Verification batches that could not be sent to the broker.',
+}
+
+
+def collect():
+    values = {
+        ('artq_token_cache_hits_total', ()): verified_tokens.hits,
+        ('artq_token_cache_misses_total', ()): verified_tokens.misses,
+        ('artq_token_cache_evictions_total', ()): verified_tokens.evictions,
+        ('artq_jti_blacklist_hits_total', ()): blacklist_index.hits,
+        ('artq_jti_blacklist_misses_total', ()): blacklist_index.misses,
+        ('artq_user_cache_hits_total', ()): user_cache.hits,
+        ('artq_user_cache_misses_total', ()): user_cache.misses,
+        ('artq_user_cache_invalidations_total', ()): user_cache.invalidations,
+        ('artq_availability_filtered_total', ()): availability_index.filtered,
+        ('artq_availability_queries_total', ()): availability_index.queries,
+    }
+    pool = hashing._pool
+    if pool is not None:
+        values[('artq_password_hash_rejected_total', ())] = pool.rejected
+    buckets = throttling._buckets
+    if isinstance(buckets, throttling.RedisBuckets):
+        values[('artq_throttle_backend_errors_total', ())] = buckets.errors
+    bookkeeper = families._bookkeeper
+    if bookkeeper is not None:
+        values[('artq_token_bookkeeping_written_total', ())] = bookkeeper.written
+        values[('artq_token_bookkeeping_dropped_total', ())] = bookkeeper.dropped
+    dispatcher = verification._dispatcher
+    if dispatcher is not None:
+        values[('artq_verification_queued_total', ())] = dispatcher.submitted
+        values[('artq_verification_dropped_total', ())] = dispatcher.dropped
+        values[('artq_verification_publish_errors_total', ())] = dispatcher.errors
+    return values
@@ -0,0 +1,66 @@
+"""
+Indexes for the admin user search and keyset pages.
+
+The expression / trigram indexes only exist on PostgreSQL, in the schema
+and in the migration state alike (as in User.Meta.indexes, decided by the
+vendor of the default database), so later migrations of the user table
+don't try to create them elsewhere. On PostgreSQL every index is built with
+CREATE INDEX CONCURRENTLY, so the user table stays writable while they build
+(hence atomic = False); user_joined_idx is a plain index everywhere else,
+and django.contrib.postgres (psycopg) isn't imported there.
+pg_trgm is a trusted extension from PostgreSQL 13, so the database owner can
+create it.
+"""
+import django.db.models.functions.comparison
+import django.db.models.functions.text
+from django.db import DEFAULT_DB_ALIAS, connections, migrations, models
+
+
+def upper_text(field):
+    return django.db.models.functions.text.Upper(
+        django.db.models.functions.comparison.Cast(field, models.TextField())
+    )
+
+
+def joined_index():
+    return models.Index(fields=['date_joined', 'id'], name='user_joined_idx')
+
+
+def postgres_operations():
+    from django.contrib.postgres.indexes import GinIndex, OpClass
+    from django.contrib.postgres.operations import AddIndexConcurrently, TrigramExtension
+
+    return [
+        TrigramExtension(),
+        AddIndexConcurrently(
+            model_name='user',
+            index=models.Index(OpClass(upper_text('username'), name='text_pattern_ops'), name='user_username_prefix_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='user',
+            index=models.Index(OpClass(upper_text('phone'), name='text_pattern_ops'), name='user_phone_prefix_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='user',
+            index=GinIndex(OpClass(upper_text('email'), name='gin_trgm_ops'), name='user_email_trgm_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='user',
+            index=GinIndex(OpClass(upper_text('nickname'), name='gin_trgm_ops'), name='user_nickname_trgm_idx'),
+        ),
+        AddIndexConcurrently(model_name='user', index=joined_index()),
+    ]
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('accounts', '0002_alter_user_managers_remove_user_prefs_and_more'),
+    ]
+
+    if connections[DEFAULT_DB_ALIAS].vendor == 'postgresql':
+        operations = postgres_operations()
+    else:
+        operations = [migrations.AddIndex(model_name='user', index=joined_index())]
@@ -0,0 +1,32 @@
+"""
+New users and token families get time-ordered (version 7) UUIDs, see
+apps.accounts.ids. The default is applied by Django, not the database, and
+existing version 4 ids stay as they are, so only the migration state
+changes.
+"""
+import apps.accounts.ids
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_token_family'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='tokenfamily',
+                    name='id',
+                    field=models.UUIDField(default=apps.accounts.ids.uuid7, editable=False, primary_key=True, serialize=False),
+                ),
+                migrations.AlterField(
+                    model_name='user',
+                    name='id',
+                    field=models.UUIDField(default=apps.accounts.ids.uuid7, editable=False, primary_key=True, serialize=False),
+                ),
+            ],
+        ),
+    ]
@@ -1,7 +1,9 @@
+from django.conf import settings
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.core.validators import RegexValidator
-from django.db import models
-import uuid
+from django.db import DEFAULT_DB_ALIAS, connections, models
+from django.db.models.functions import Cast, Upper
+from . import hashing, ids
 
 phone_validator = RegexValidator(
     regex=r"^\+?[0-9]{9,15}$",
@@ -15,7 +17,7 @@ class UserManager(BaseUserManager):
         # clean empty strings to None
         return value or None
 
-    def create_user(self, first_name, last_name, username, password, nickname, email=None, phone=None, **extra_fields):
+    def _build_user(self, first_name, last_name, username, password, nickname, email=None, phone=None, **extra_fields):
         if not first_name:
             raise ValueError("first_name field is necessary.")
         if not last_name:
@@ -27,7 +29,8 @@ class UserManager(BaseUserManager):
         if not nickname:
             raise ValueError("nickname field is necessary.")
 
-        email = self.normalize_email(self._clean_optional(email))
+        # normalize_email(None) returns "", which would collide on the unique column
+        email = self._clean_optional(self.normalize_email(email))
         phone = self._clean_optional(phone)
 
         user = self.model(
@@ -39,10 +42,20 @@ class UserManager(BaseUserManager):
             phone=phone,
             **extra_fields,
         )
+        return user
+
+    def create_user(self, first_name, last_name, username, password, nickname, email=None, phone=None, **extra_fields):
+        user = self._build_user(first_name, last_name, username, password, nickname, email, phone, **extra_fields)
         user.set_password(password)
         user.save(using=self._db)
         return user
 
+    async def acreate_user(self, first_name, last_name, username, password, nickname, email=None, phone=None, **extra_fields):
+        user = self._build_user(first_name, last_name, username, password, nickname, email, phone, **extra_fields)
+        await user.aset_password(password)
+        await user.asave(using=self._db)
+        return user
+
     def create_superuser(self, first_name, last_name, username, password, nickname, email=None, phone=None, **extra_fields):
         extra_fields.setdefault("is_staff", True)
         extra_fields.setdefault("is_superuser", True)
@@ -64,9 +77,32 @@ class UserManager(BaseUserManager):
             **extra_fields,
         )
 
+def admin_search_indexes():
+    """
+    Indexes for the admin search (UserAdmin.search_fields), on PostgreSQL only:
+    istartswith / icontains compare UPPER(column::text), so they are on that
+    expression. Other databases have them neither in the schema nor in the
+    migration state (0003), so migrations don't try to rebuild them there.
+    """
+    if connections[DEFAULT_DB_ALIAS].vendor != 'postgresql':
+        return []
+    from django.contrib.postgres.indexes import GinIndex, OpClass
+
+    return [
+        models.Index(OpClass(Upper(Cast('username', models.TextField())), name='text_pattern_ops'),
+                     name='user_username_prefix_idx'),
+        models.Index(OpClass(Upper(Cast('phone', models.TextField())), name='text_pattern_ops'),
+                     name='user_phone_prefix_idx'),
+        GinIndex(OpClass(Upper(Cast('email', models.TextField())), name='gin_trgm_ops'),
+                 name='user_email_trgm_idx'),
+        GinIndex(OpClass(Upper(Cast('nickname', models.TextField())), name='gin_trgm_ops'),
+                 name='user_nickname_trgm_idx'),
+    ]
+
+
 class User(AbstractUser):
     # user UUID as basic Public Key
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id = models.UUIDField(primary_key=True, default=ids.uuid7, editable=False)
     nickname = models.CharField(max_length=30)
     
     email = models.EmailField(unique=True, null=True, blank=True)
@@ -81,6 +117,62 @@ class User(AbstractUser):
     objects = UserManager()
 
     REQUIRED_FIELDS = ['first_name', 'last_name', 'nickname']
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            *admin_search_indexes(),
+            # admin keyset pages (newest first) and the availability index sync
+            models.Index(fields=['date_joined', 'id'], name='user_joined_idx'),
+        ]
     
     def __str__(self):
         return self.nickname or self.username
+
+    # password hashing goes through apps.accounts.hashing, which runs it in
+    # the hashing process pool when PASSWORD_HASHING_POOL is enabled
+    def set_password(self, raw_password):
+        self.password = hashing.make_password(raw_password)
+        self._password = raw_password
+
+    async def aset_password(self, raw_password):
+        self.password = await hashing.amake_password(raw_password)
+        self._password = raw_password
+
+    def check_password(self, raw_password):
+        def setter(raw_password):
+            self.set_password(raw_password)
+            # Password hash upgrades shouldn't be considered password changes.
+            self._password = None
+            self.save(update_fields=["password"])
+
+        return hashing.check_password(raw_password, self.password, setter)
+
+    async def acheck_password(self, raw_password):
+        async def setter(raw_password):
+            await self.aset_password(raw_password)
+            self._password = None
+            await self.asave(update_fields=["password"])
+
+        return await hashing.acheck_password(raw_password, self.password, setter)
+
+
+class TokenFamily(models.Model):
+    """
+    The refresh tokens rotated from one login. Tokens carry the family id and
+    their generation; rotating is a compare-and-swap on `generation`, see
+    apps.accounts.families.
+    """
+    id = models.UUIDField(primary_key=True, default=ids.uuid7, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='token_families')
+    generation = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    rotated_at = models.DateTimeField(null=True, blank=True)
+    revoked_at = models.DateTimeField(null=True, blank=True)
+    # of the newest token, for purge_tokens
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        verbose_name_plural = 'token families'
+
+    def __str__(self):
+        return f'{self.user_id} / {self.pk}'
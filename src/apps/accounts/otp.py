@@ -0,0 +1,215 @@
+"""
+One-time codes for email / phone verification, kept outside the database.
+
+A code is stored under its identifier ("<channel>:<destination>") as an HMAC
+digest with an attempt counter and a TTL, so issuing and checking are one
+O(1) operation each, expired codes simply disappear (no cleanup job), and a
+dump of the store doesn't reveal live codes.
+
+- issue() replaces any previous code for the identifier; identifiers may get
+  at most ISSUE_RATE codes per period (fixed window), which also caps how
+  often a fresh attempt counter can be had.
+- check() compares and consumes in one step: a match deletes the code, a
+  miss counts an attempt, and after MAX_ATTEMPTS the code is locked until it
+  expires.
+
+Backends (OTP['BACKEND']):
+- "memory": per process, bounded; for tests and eager Celery only, since the
+  worker that issues codes and the web process that checks them must share it.
+- "redis": one EVALSHA per issue / check. Any client with redis-py's
+  register_script() works.
+"""
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.crypto import salted_hmac
+from .throttling import PERIODS
+
+DEFAULTS = {
+    'BACKEND': 'memory',
+    'REDIS_URL': None,
+    'KEY_PREFIX': 'otp:',
+    'CODE_LENGTH': 6,
+    'TTL': 600,
+    'MAX_ATTEMPTS': 5,
+    'ISSUE_RATE': '5/hour',
+    'MAX_KEYS': 100_000,
+}
+
+# check() results
+VALID = 'valid'
+INVALID = 'invalid'
+EXPIRED = 'expired'  # or never issued
+LOCKED = 'locked'
+
+RESULTS = {1: VALID, 0: EXPIRED, -1: LOCKED, -2: INVALID}
+
+
+class RateLimited(Exception):
+    def __init__(self, wait):
+        super().__init__(f'retry in {wait:.0f}s')
+        self.wait = wait
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'OTP', {})}
+
+
+def parse_rate(rate):
+    """'5/hour' -> (5, 3600)."""
+    count, period = rate.split('/')
+    return int(count), PERIODS[period]
+
+
+def digest(identifier, code):
+    return salted_hmac('accounts.otp', f'{identifier}:{code}').hexdigest()
+
+
+ISSUE_SCRIPT = """
+local count = redis.call('INCR', KEYS[2])
+if count == 1 then
+  redis.call('PEXPIRE', KEYS[2], ARGV[4])
+end
+if count > tonumber(ARGV[3]) then
+  return {0, redis.call('PTTL', KEYS[2])}
+end
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], 'd', ARGV[1], 'a', 0)
+redis.call('PEXPIRE', KEYS[1], ARGV[2])
+return {1, 0}
+"""
+
+CHECK_SCRIPT = """
+local state = redis.call('HMGET', KEYS[1], 'd', 'a')
+if not state[1] then
+  return 0
+end
+if tonumber(state[2]) >= tonumber(ARGV[2]) then
+  return -1
+end
+if state[1] == ARGV[1] then
+  redis.call('DEL', KEYS[1])
+  return 1
+end
+redis.call('HINCRBY', KEYS[1], 'a', 1)
+return -2
+"""
+
+
+class MemoryCodes:
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self._codes = OrderedDict()    # key -> [digest, attempts, expires]
+        self._windows = OrderedDict()  # rate key -> [count, window end]
+        self._lock = threading.Lock()
+
+    def _evict(self, entries, now):
+        while entries and (len(entries) > self.max_keys or next(iter(entries.values()))[-1] <= now):
+            entries.popitem(last=False)
+
+    def issue(self, key, rate_key, value, ttl, limit, period):
+        """(issued, wait seconds)"""
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(rate_key)
+            if window is None or window[1] <= now:
+                window = self._windows[rate_key] = [0, now + period]
+                self._windows.move_to_end(rate_key)
+            window[0] += 1
+            if window[0] > limit:
+                return False, window[1] - now
+            self._codes.pop(key, None)
+            self._codes[key] = [value, 0, now + ttl]
+            # entries are kept in insertion order with equal TTLs, so the oldest expire first
+            self._evict(self._codes, now)
+            self._evict(self._windows, now)
+        return True, 0.0
+
+    def check(self, key, value, max_attempts):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._codes.get(key)
+            if entry is None or entry[2] <= now:
+                self._codes.pop(key, None)
+                return EXPIRED
+            if entry[1] >= max_attempts:
+                return LOCKED
+            if secrets.compare_digest(entry[0], value):
+                del self._codes[key]
+                return VALID
+            entry[1] += 1
+            return INVALID
+
+
+class RedisCodes:
+    def __init__(self, client):
+        self.client = client
+        self._issue = client.register_script(ISSUE_SCRIPT)
+        self._check = client.register_script(CHECK_SCRIPT)
+
+    def issue(self, key, rate_key, value, ttl, limit, period):
+        issued, wait_ms = self._issue(keys=[key, rate_key], args=[value, int(ttl * 1000), limit, int(period * 1000)])
+        return bool(int(issued)), max(int(wait_ms), 0) / 1000
+
+    def check(self, key, value, max_attempts):
+        return RESULTS[int(self._check(keys=[key], args=[value, max_attempts]))]
+
+
+class OTPStore:
+    def __init__(self, backend, config=None):
+        self.backend = backend
+        self.config = config or get_config()
+
+    def _key(self, identifier):
+        return f"{self.config['KEY_PREFIX']}{identifier}"
+
+    def issue(self, identifier):
+        """New code for identifier, replacing the previous one. Raises RateLimited."""
+        config = self.config
+        code = f"{secrets.randbelow(10 ** config['CODE_LENGTH']):0{config['CODE_LENGTH']}d}"
+        limit, period = parse_rate(config['ISSUE_RATE'])
+        issued, wait = self.backend.issue(
+            self._key(identifier), self._key(f'rate:{identifier}'), digest(identifier, code),
+            config['TTL'], limit, period,
+        )
+        if not issued:
+            raise RateLimited(wait)
+        return code
+
+    def check(self, identifier, code):
+        """VALID (and consumed), INVALID, EXPIRED or LOCKED."""
+        return self.backend.check(self._key(identifier), digest(identifier, code), self.config['MAX_ATTEMPTS'])
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                config = get_config()
+                if config['BACKEND'] == 'redis':
+                    import redis
+                    _store = OTPStore(RedisCodes(redis.Redis.from_url(config['REDIS_URL'])), config)
+                else:
+                    _store = OTPStore(MemoryCodes(config['MAX_KEYS']), config)
+    return _store
+
+
+def set_store(store):
+    global _store
+    _store = store
+
+
+@receiver(setting_changed)
+def _reset_on_setting_change(*, setting, **kwargs):
+    if setting == 'OTP':
+        set_store(None)
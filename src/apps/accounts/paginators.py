@@ -0,0 +1,146 @@
+"""
+Admin changelist paging that stays fast on a large user table.
+
+The stock changelist runs COUNT(*) twice per page (filtered and full) and
+pages with OFFSET, so late pages read and throw away every row before them.
+
+- EstimatedCountPaginator: an unfiltered changelist takes the planner's row
+  estimate from pg_class on PostgreSQL; filtered or searched ones count at
+  most MAX_COUNT rows, so the count is exact up to that and "MAX_COUNT+" above.
+- KeysetChangeList: in the default order (newest first) pages continue from
+  the last row shown, ?after=<date_joined>,<pk> / ?before=..., which the
+  (date_joined, id) index answers without an OFFSET. Sorting by another column
+  falls back to numbered OFFSET pages.
+"""
+from datetime import datetime
+
+from django.contrib.admin.views.main import ChangeList
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+AFTER_VAR = 'after'
+BEFORE_VAR = 'before'
+KEYSET_VARS = (AFTER_VAR, BEFORE_VAR)
+
+
+class EstimatedCountPaginator(Paginator):
+    MAX_COUNT = 10000
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.estimated = False  # planner estimate
+        self.capped = False     # at least MAX_COUNT
+
+    def _table_estimate(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql' or queryset.query.where:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                [connection.ops.quote_name(queryset.model._meta.db_table)],
+            )
+            row = cursor.fetchone()
+        # -1 until the table has been analyzed
+        return row[0] if row and row[0] >= 0 else None
+
+    @cached_property
+    def count(self):
+        estimate = self._table_estimate()
+        if estimate is not None and estimate > self.MAX_COUNT:
+            self.estimated = True
+            return estimate
+        # COUNT(*) over a LIMIT subquery: stops after MAX_COUNT + 1 rows
+        count = self.object_list[:self.MAX_COUNT + 1].count()
+        if count > self.MAX_COUNT:
+            self.capped = True
+            return self.MAX_COUNT
+        return count
+
+
+class KeysetChangeList(ChangeList):
+    # the (date_joined, id) index, see User.Meta.indexes
+    keyset_ordering = ['-date_joined', '-id']
+
+    def __init__(self, request, *args, **kwargs):
+        self.keyset = None
+        self.next_link = self.prev_link = self.first_link = None
+        super().__init__(request, *args, **kwargs)
+        # not filters: keep them out of the search form and filter links
+        for name in KEYSET_VARS:
+            self.params.pop(name, None)
+            self.filter_params.pop(name, None)
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        for name in KEYSET_VARS:
+            lookup_params.pop(name, None)
+        return lookup_params
+
+    def get_query_string(self, new_params=None, remove=None):
+        # sorting or filtering starts again from the first page
+        new_params = new_params or {}
+        remove = [*(remove or ()), *(name for name in KEYSET_VARS if name not in new_params)]
+        return super().get_query_string(new_params, remove)
+
+    @staticmethod
+    def encode_cursor(user):
+        return f'{user.date_joined.isoformat()},{user.pk}'
+
+    @staticmethod
+    def decode_cursor(value):
+        try:
+            joined, pk = value.rsplit(',', 1)
+            return datetime.fromisoformat(joined), pk
+        except (AttributeError, ValueError):
+            return None
+
+    def get_results(self, request):
+        # ChangeList.get_ordering() appends the queryset's ordering, which is the default one again
+        ordering = list(dict.fromkeys(self.queryset.query.order_by))
+        if ordering != self.keyset_ordering or self.show_all:
+            return super().get_results(request)
+
+        paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        per_page = self.list_per_page
+        after = self.decode_cursor(request.GET.get(AFTER_VAR))
+        before = self.decode_cursor(request.GET.get(BEFORE_VAR))
+
+        if before:
+            joined, pk = before
+            queryset = (
+                self.queryset
+                .filter(Q(date_joined__gt=joined) | Q(date_joined=joined, pk__gt=pk))
+                .order_by('date_joined', 'pk')
+            )
+            rows = list(queryset[:per_page + 1])
+            has_prev, has_next = len(rows) > per_page, True
+            rows = rows[:per_page][::-1]
+        else:
+            queryset = self.queryset
+            if after:
+                joined, pk = after
+                queryset = queryset.filter(Q(date_joined__lt=joined) | Q(date_joined=joined, pk__lt=pk))
+            rows = list(queryset[:per_page + 1])
+            has_prev, has_next = after is not None, len(rows) > per_page
+            rows = rows[:per_page]
+
+        if has_next and rows:
+            self.next_link = self.get_query_string({AFTER_VAR: self.encode_cursor(rows[-1])}, remove=[BEFORE_VAR])
+        if has_prev and rows:
+            self.prev_link = self.get_query_string({BEFORE_VAR: self.encode_cursor(rows[0])}, remove=[AFTER_VAR])
+        if has_prev:
+            self.first_link = self.get_query_string()
+
+        self.keyset = True
+        self.result_count = paginator.count
+        self.show_full_result_count = self.model_admin.show_full_result_count
+        self.full_result_count = self.root_queryset.count() if self.show_full_result_count else None
+        self.show_admin_actions = not self.show_full_result_count or bool(self.full_result_count)
+        self.result_list = rows
+        self.can_show_all = False
+        self.multi_page = has_prev or has_next
+        self.paginator = paginator
@@ -0,0 +1,56 @@
+"""
+drf-spectacular extensions for the accounts subclasses of simplejwt classes
+(extensions match exact classes only), and the generator documenting the
+async views. Imported by config.schema.generate, so API workers never load
+drf-spectacular's extension machinery.
+"""
+from django.urls import URLPattern
+from drf_spectacular import generators
+from drf_spectacular.contrib.rest_framework_simplejwt import (
+    SimpleJWTScheme,
+    TokenRefreshSerializerExtension,
+    TokenVerifySerializerExtension,
+)
+from rest_framework_simplejwt.views import TokenRefreshView, TokenVerifyView
+from . import async_views, views
+
+# async view: the sync view with the same payloads, documented in its place
+SYNC_VIEWS = {
+    async_views.AsyncRegistrationView: views.RegistrationView,
+    async_views.AsyncAvailabilityView: views.AvailabilityView,
+    async_views.AsyncLoginView: views.LoginView,
+    async_views.AsyncLogoutView: views.LogoutView,
+    async_views.AsyncTokenRefreshView: TokenRefreshView,
+    async_views.AsyncTokenVerifyView: TokenVerifyView,
+}
+
+
+class CachedJWTScheme(SimpleJWTScheme):
+    target_class = 'apps.accounts.authentication.CachedJWTAuthentication'
+
+
+class IndexedTokenRefreshSerializerExtension(TokenRefreshSerializerExtension):
+    target_class = 'apps.accounts.serializers.IndexedTokenRefreshSerializer'
+
+
+class CachedTokenVerifySerializerExtension(TokenVerifySerializerExtension):
+    target_class = 'apps.accounts.serializers.CachedTokenVerifySerializer'
+
+
+class EndpointEnumerator(generators.EndpointEnumerator):
+    """Lists the async views (not DRF views, so skipped otherwise) as their sync counterparts."""
+
+    def _get_api_endpoints(self, patterns, prefix):
+        if patterns is None:
+            patterns = self.patterns
+        return super()._get_api_endpoints([self._documented(pattern) for pattern in patterns], prefix)
+
+    def _documented(self, pattern):
+        view_class = getattr(getattr(pattern, 'callback', None), 'view_class', None)
+        if isinstance(pattern, URLPattern) and view_class in SYNC_VIEWS:
+            return URLPattern(pattern.pattern, SYNC_VIEWS[view_class].as_view(), pattern.default_args, pattern.name)
+        return pattern
+
+
+class SchemaGenerator(generators.SchemaGenerator):
+    endpoint_inspector_cls = EndpointEnumerator
@@ -3,6 +3,11 @@ from django.db.models import Q
 from rest_framework import serializers
 from rest_framework.exceptions import AuthenticationFailed
 from rest_framework_simplejwt import serializers as jwt_serializers 
+from rest_framework_simplejwt.settings import api_settings
+from .authentication import verify_untyped
+from .blacklist import blacklist_index
+from . import families
+from .tokens import DeferredBlacklistRefreshToken, FamilyRefreshToken, IndexedRefreshToken
 
 User = get_user_model()
 
@@ -37,6 +42,24 @@ class RegistrationSerializer(serializers.Serializer):
             phone=(validated_data.get('phone') or None),
             birth_date=validated_data.get('birth_date'),
         )
+
+    async def acreate(self, validated_data):
+        return await User.objects.acreate_user(
+            first_name=validated_data.get('first_name'),
+            last_name=validated_data.get('last_name'),
+            username=validated_data.get('username'),
+            password=validated_data.get('password'),
+            nickname=validated_data.get('nickname'),
+            email=(validated_data.get('email') or None),
+            phone=(validated_data.get('phone') or None),
+            birth_date=validated_data.get('birth_date'),
+        )
+
+    async def asave(self):
+        # async counterpart of save(), used by the ASGI views
+        assert hasattr(self, '_validated_data'), 'You must call `.is_valid()` before calling `.asave()`.'
+        self.instance = await self.acreate(self.validated_data)
+        return self.instance
         
         
 class LoginSerializer(jwt_serializers.TokenObtainPairSerializer):
@@ -59,4 +82,53 @@ class LoginSerializer(jwt_serializers.TokenObtainPairSerializer):
 
 
 class LogoutSerializer(serializers.Serializer):
-    refresh = serializers.CharField()
\ No newline at end of file
+    refresh = serializers.CharField()
+
+
+class VerificationCodeSerializer(serializers.Serializer):
+    code = serializers.RegexField(r'^\d{4,10}$')
+
+
+class FamilyTokenObtainPairSerializer(jwt_serializers.TokenObtainPairSerializer):
+    """
+    Login serializer opening a refresh-token family per login (wired in through
+    SIMPLE_JWT['TOKEN_OBTAIN_SERIALIZER'], see apps.accounts.families).
+    """
+
+    @classmethod
+    def get_token(cls, user):
+        if families.get_config()['ENABLED']:
+            return FamilyRefreshToken.for_user(user)
+        return super().get_token(user)
+
+
+class IndexedTokenRefreshSerializer(jwt_serializers.TokenRefreshSerializer):
+    """
+    TokenRefreshSerializer checking the blacklist through the in-memory JTI
+    index, and rotating family tokens with one compare-and-swap (wired in
+    through SIMPLE_JWT['TOKEN_REFRESH_SERIALIZER']).
+    """
+    token_class = IndexedRefreshToken
+
+    def validate(self, attrs):
+        refresh = DeferredBlacklistRefreshToken(attrs["refresh"])
+        if families.is_family_token(refresh):
+            # rotated tokens end up in the blacklist too, the CAS has to see them to detect reuse
+            return families.rotate(refresh)
+        return super().validate(attrs)
+
+
+class CachedTokenVerifySerializer(jwt_serializers.TokenVerifySerializer):
+    """
+    TokenVerifySerializer that skips the signature check for tokens already
+    in the verified-token cache and checks the blacklist through the JTI index
+    (wired in through SIMPLE_JWT['TOKEN_VERIFY_SERIALIZER']).
+    """
+    def validate(self, attrs):
+        token = verify_untyped(attrs['token'])
+
+        if api_settings.BLACKLIST_AFTER_ROTATION:
+            if blacklist_index.contains(token.get(api_settings.JTI_CLAIM)):
+                raise serializers.ValidationError("Token is blacklisted")
+
+        return {}
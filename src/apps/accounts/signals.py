@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from .availability import availability_index
+from .blacklist import blacklist_index
+from .user_cache import user_changed
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def index_blacklisted_token(sender, instance, created, **kwargs):
+    if created:
+        blacklist_index.add(instance.token.jti, instance.token.expires_at.timestamp())
+
+
+# no post_delete receiver: it would turn purge_tokens' bulk deletes into one
+# query per row. Deleted rows are expired ones, which the index prunes itself.
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def index_user(sender, instance, using, update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return  # every login (update_last_login): nothing the caches or the filter depend on
+    # on updates too: a changed email or phone is taken from now on
+    availability_index.add_user(instance)
+    user_changed(str(getattr(instance, api_settings.USER_ID_FIELD)), using)
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def unindex_user(sender, instance, using, **kwargs):
+    availability_index.user_deleted()
+    user_changed(str(getattr(instance, api_settings.USER_ID_FIELD)), using)
@@ -0,0 +1,273 @@
+"""
+Public-key token signing, so other services verify tokens without calling
+/v1/auth/verify/.
+
+With JWT_SIGNING['ALGORITHM'] set to EdDSA (Ed25519) or ES256 (P-256),
+KeySetTokenBackend signs tokens with the private key ACTIVE_KID and puts its
+id in the `kid` header. Tokens are verified against every key of the key
+set, picked by `kid`, and the public halves are served at
+/.well-known/jwks.json with a long Cache-Control, for local verification
+(PyJWKClient, jose, ...).
+
+Keys are PEM files in KEYS_DIR named after their kid: `<kid>.pem` holds a
+private key (signs when it is the active one, verifies), `<kid>.pub` only a
+public key (a retired key, kept until the last token it signed expires).
+`manage.py signing_key <kid>` writes a new private key. Without ACTIVE_KID
+the private key whose kid sorts last signs, so date-like kids (2026-10)
+rotate by themselves. Rotating:
+
+  1. add the new key, restart: it is published but doesn't sign yet
+     (give it an ACTIVE_KID that still names the old key);
+  2. after JWKS_MAX_AGE every verifier has it: make it the active key;
+  3. after REFRESH_TOKEN_LIFETIME replace the old `.pem` with its `.pub`
+     (or delete it once no token it signed is left).
+
+Keys are loaded once per process. With ACCEPT_HS256, tokens without a `kid`
+signed by SIMPLE_JWT's SIGNING_KEY (the tokens issued before the switch) are
+still accepted here; downstream services can't verify those. It is off by
+default: turn it on for the switch and off again after REFRESH_TOKEN_LIFETIME,
+or anyone holding SECRET_KEY keeps minting tokens.
+"""
+import hashlib
+import json
+import os
+from functools import wraps
+
+import jwt
+from django.conf import settings
+from django.core import checks
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import Http404, HttpResponse
+from django.utils.translation import gettext_lazy as _
+from django.views.decorators.http import condition, require_safe
+from jwt import InvalidAlgorithmError, InvalidTokenError
+from rest_framework_simplejwt.backends import TokenBackend
+from rest_framework_simplejwt.exceptions import TokenBackendError
+from rest_framework_simplejwt.settings import api_settings
+
+DEFAULTS = {
+    'ALGORITHM': 'HS256',       # HS256 keeps simplejwt's shared-secret backend
+    'KEYS_DIR': 'keys',
+    'ACTIVE_KID': None,
+    'ACCEPT_HS256': False,      # only while tokens from before the switch are alive
+    'JWKS_MAX_AGE': 3600,
+}
+
+ALGORITHMS = ('EdDSA', 'ES256')
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'JWT_SIGNING', {})}
+
+
+def enabled():
+    return get_config()['ALGORITHM'] != 'HS256'
+
+
+def algorithm_of(key):
+    from cryptography.hazmat.primitives.asymmetric import ec, ed25519
+
+    if isinstance(key, (ed25519.Ed25519PrivateKey, ed25519.Ed25519PublicKey)):
+        return 'EdDSA'
+    if isinstance(key, (ec.EllipticCurvePrivateKey, ec.EllipticCurvePublicKey)) and key.curve.name == 'secp256r1':
+        return 'ES256'
+    return None
+
+
+def generate_key(algorithm):
+    """A new private key for `algorithm`, as PEM bytes."""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, ed25519
+
+    if algorithm == 'EdDSA':
+        key = ed25519.Ed25519PrivateKey.generate()
+    elif algorithm == 'ES256':
+        key = ec.generate_private_key(ec.SECP256R1())
+    else:
+        raise ValueError(f'unsupported algorithm {algorithm!r}, use one of {", ".join(ALGORITHMS)}')
+    return key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                             serialization.NoEncryption())
+
+
+class SigningKey:
+    __slots__ = ('kid', 'algorithm', 'private_key', 'public_key')
+
+    def __init__(self, kid, private_key=None, public_key=None):
+        self.kid = kid
+        self.private_key = private_key
+        self.public_key = public_key or private_key.public_key()
+        self.algorithm = algorithm_of(self.public_key)
+
+    def jwk(self):
+        from jwt.algorithms import ECAlgorithm, OKPAlgorithm
+
+        to_jwk = OKPAlgorithm.to_jwk if self.algorithm == 'EdDSA' else ECAlgorithm.to_jwk
+        return {**to_jwk(self.public_key, as_dict=True), 'kid': self.kid, 'alg': self.algorithm, 'use': 'sig'}
+
+
+class KeySet:
+    """The keys of KEYS_DIR and the active one, with the JWKS document rendered once."""
+
+    def __init__(self, keys, active):
+        self.keys = {key.kid: key for key in keys}
+        self.active = active
+        self.jwks = json.dumps({'keys': [key.jwk() for key in keys]}, separators=(',', ':')).encode()
+        self.etag = '"%s"' % hashlib.sha256(self.jwks).hexdigest()[:32]
+
+    @classmethod
+    def load(cls, config):
+        from cryptography.hazmat.primitives import serialization
+
+        directory = config['KEYS_DIR']
+        keys = []
+        names = sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+        for name in names:
+            kid, ext = os.path.splitext(name)
+            if ext not in ('.pem', '.pub'):
+                continue
+            with open(os.path.join(directory, name), 'rb') as f:
+                data = f.read()
+            if ext == '.pem':
+                key = SigningKey(kid, private_key=serialization.load_pem_private_key(data, password=None))
+            else:
+                key = SigningKey(kid, public_key=serialization.load_pem_public_key(data))
+            if key.algorithm is None:
+                raise ImproperlyConfigured(f'{name}: only Ed25519 and P-256 keys are supported.')
+            keys.append(key)
+
+        private = [key for key in keys if key.private_key is not None]
+        kid = config['ACTIVE_KID'] or (private[-1].kid if private else None)
+        active = next((key for key in private if key.kid == kid), None)
+        if active is None:
+            raise ImproperlyConfigured(
+                f"JWT_SIGNING: no private key {kid + '.pem ' if kid else ''}in {directory} to sign with."
+            )
+        if active.algorithm != config['ALGORITHM']:
+            raise ImproperlyConfigured(
+                f"JWT_SIGNING: key {kid} is an {active.algorithm} key, ALGORITHM is {config['ALGORITHM']}."
+            )
+        return cls(keys, active)
+
+
+_keyset = None
+
+
+def get_keyset():
+    global _keyset
+    if _keyset is None:
+        _keyset = KeySet.load(get_config())
+    return _keyset
+
+
+@receiver(setting_changed)
+def _reset_on_setting_change(*, setting, **kwargs):
+    global _keyset
+    if setting == 'JWT_SIGNING':
+        _keyset = None
+
+
+@checks.register(checks.Tags.security)
+def check_keys(app_configs, **kwargs):
+    """A missing or mismatched signing key fails `check`, runserver and serve, not the first login."""
+    if not enabled():
+        return []
+    try:
+        get_keyset()
+    except (ImproperlyConfigured, OSError, ValueError) as exc:
+        return [checks.Error(str(exc), hint='Create one with `manage.py signing_key <kid>`.', id='accounts.E001')]
+    return []
+
+
+class KeySetTokenBackend(TokenBackend):
+    """TokenBackend signing with the active key of the key set and verifying by `kid`."""
+
+    def __init__(self, algorithm, audience=None, issuer=None, leeway=None, json_encoder=None, hs256_key=None):
+        super().__init__(algorithm, None, '', audience, issuer, None, leeway, json_encoder)
+        self.hs256_key = hs256_key
+
+    def _validate_algorithm(self, algorithm):
+        # simplejwt 5.3 doesn't know EdDSA
+        if algorithm not in ALGORITHMS:
+            raise TokenBackendError(f"JWT_SIGNING['ALGORITHM'] must be HS256, {' or '.join(ALGORITHMS)}.")
+
+    @classmethod
+    def from_settings(cls):
+        config = get_config()
+        return cls(
+            config['ALGORITHM'], api_settings.AUDIENCE, api_settings.ISSUER, api_settings.LEEWAY,
+            api_settings.JSON_ENCODER, api_settings.SIGNING_KEY if config['ACCEPT_HS256'] else None,
+        )
+
+    def encode(self, payload):
+        jwt_payload = payload.copy()
+        if self.audience is not None:
+            jwt_payload['aud'] = self.audience
+        if self.issuer is not None:
+            jwt_payload['iss'] = self.issuer
+        key = get_keyset().active
+        return jwt.encode(jwt_payload, key.private_key, algorithm=key.algorithm,
+                          headers={'kid': key.kid}, json_encoder=self.json_encoder)
+
+    def _verifying_key(self, token):
+        try:
+            header = jwt.get_unverified_header(token)
+        except InvalidTokenError as ex:
+            raise TokenBackendError(_('Token is invalid or expired')) from ex
+        kid = header.get('kid')
+        if kid is None:
+            if self.hs256_key is not None:
+                return self.hs256_key, 'HS256'
+        else:
+            key = get_keyset().keys.get(kid)
+            if key is not None:
+                return key.public_key, key.algorithm
+        raise TokenBackendError(_('Token is invalid or expired'))
+
+    def decode(self, token, verify=True):
+        key, algorithm = self._verifying_key(token)
+        try:
+            return jwt.decode(
+                token,
+                key,
+                algorithms=[algorithm],
+                audience=self.audience,
+                issuer=self.issuer,
+                leeway=self.get_leeway(),
+                options={
+                    'verify_aud': self.audience is not None,
+                    'verify_signature': verify,
+                },
+            )
+        except InvalidAlgorithmError as ex:
+            raise TokenBackendError(_('Invalid algorithm specified')) from ex
+        except InvalidTokenError as ex:
+            raise TokenBackendError(_('Token is invalid or expired')) from ex
+
+
+def _jwks_etag(request):
+    return get_keyset().etag if enabled() else None
+
+
+def _jwks_cache_control(view):
+    """Cache-Control on the 304s of `condition` too, or a revalidated copy goes stale at once."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            max_age = get_config()['JWKS_MAX_AGE']
+            # a verifier meeting an unknown kid refetches, meanwhile a stale copy may serve
+            response['Cache-Control'] = f'public, max-age={max_age}, stale-while-revalidate={max_age}'
+        return response
+    return wrapper
+
+
+@require_safe
+@_jwks_cache_control
+@condition(etag_func=_jwks_etag)
+def jwks_view(request):
+    """The public keys as a JWK set, cached by clients and proxies for JWKS_MAX_AGE."""
+    if not enabled():
+        raise Http404('Tokens are signed with a shared secret.')
+    return HttpResponse(get_keyset().jwks, content_type='application/json')
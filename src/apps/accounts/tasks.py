@@ -0,0 +1,17 @@
+from celery.utils.time import get_exponential_backoff_interval
+
+from config.celery import app
+from . import verification
+
+
+@app.task(bind=True, name='accounts.send_verifications', acks_late=True, ignore_result=True)
+def send_verifications(self, channel, user_ids):
+    """One batch of verification messages for a channel; retries the failed ones with backoff."""
+    config = verification.get_config()
+    failed = verification.deliver(channel, user_ids, owner=self.request.id, config=config)
+    if failed:
+        countdown = get_exponential_backoff_interval(
+            config['RETRY_BACKOFF'], self.request.retries, config['RETRY_BACKOFF_MAX'], full_jitter=True,
+        )
+        # same task id on retry, so the failed users' dedup claims still match
+        raise self.retry(args=(channel, failed), countdown=countdown, max_retries=config['MAX_RETRIES'])
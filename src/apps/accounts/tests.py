@@ -1,3 +1,849 @@
-from django.test import TestCase
+import importlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connections
+from django.http import HttpResponse
+from django.urls import clear_url_caches
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework_simplejwt.backends import TokenBackend
+from rest_framework_simplejwt.exceptions import TokenBackendError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+
+import config.urls
+from config import fastjson, metrics, schema, serve
+from config.budgets import assert_budget
+from config.db import routers
+from config.middleware import BrowserMiddleware
+from config.request_log import RotatingJsonLinesFile, mask
+
+from . import availability, blacklist, families, otp, signing, throttling, urls, verification
+from .availability import AvailabilityIndex, availability_index
+from .blacklist import BlacklistIndex, blacklist_index
+from .user_cache import user_cache
+from .models import TokenFamily, User
+
+PASSWORD = 'test-Passw0rd!'
+
+
+def reload_urlconf():
+    """Re-import the URLconf, which picks the views of AUTH_VIEW_MODE."""
+    importlib.reload(urls)
+    importlib.reload(config.urls)
+    clear_url_caches()
+
+
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    TOKEN_FAMILIES={**settings.TOKEN_FAMILIES, 'WRITE_BEHIND': False},
+    THROTTLING={**settings.THROTTLING, 'RATES': {}},
+    # a sync thread would not see the rows of TestCase's transaction
+    AVAILABILITY={**settings.AVAILABILITY, 'BACKGROUND_SYNC': False},
+    JTI_BLACKLIST={**settings.JTI_BLACKLIST, 'BACKGROUND_SYNC': False},
+)
+class AuthTestCase(TestCase):
+    """Registers `self.user` and logs it in through the API."""
+
+    def setUp(self):
+        throttling.set_buckets(None)  # full buckets for every test
+        self.user = User.objects.create_user(
+            username='alice', password=PASSWORD, first_name='Alice', last_name='Kim',
+            nickname='alice', email='alice@example.com',
+        )
+
+    def post(self, path, data):
+        return self.client.post(path, data, content_type='application/json')
+
+    def login(self, username='alice'):
+        response = self.post('/v1/auth/login/', {'username': username, 'password': PASSWORD})
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def refresh(self, token):
+        return self.post('/v1/auth/refresh/', {'refresh': token})
+
+
+class TokenFamilyTests(AuthTestCase):
+
+    def test_rotation_advances_the_family(self):
+        tokens = self.login()
+        response = self.refresh(tokens['refresh'])
+        self.assertEqual(response.status_code, 200, response.content)
+        rotated = RefreshToken(response.json()['refresh'], verify=False)
+        family = TokenFamily.objects.get(user=self.user)
+        self.assertEqual(rotated[families.FAMILY_CLAIM], str(family.pk))
+        self.assertEqual((rotated[families.GENERATION_CLAIM], family.generation), (1, 1))
+        self.assertIsNotNone(family.rotated_at)
+
+        # the next rotation takes the new token, not the old one
+        self.assertEqual(self.refresh(response.json()['refresh']).status_code, 200)
+
+    def test_rotation_writes_the_bookkeeping_rows(self):
+        tokens = self.login()
+        second = self.refresh(tokens['refresh']).json()['refresh']
+        third = self.refresh(second).json()['refresh']
+
+        jtis = [RefreshToken(raw, verify=False)[api_settings.JTI_CLAIM] for raw in (tokens['refresh'], second, third)]
+        rows = {row.jti: row for row in OutstandingToken.objects.all()}
+        self.assertEqual(set(rows), set(jtis))
+        self.assertTrue(all(row.user_id == self.user.pk for row in rows.values()))
+        self.assertEqual(
+            set(BlacklistedToken.objects.values_list('token__jti', flat=True)),
+            set(jtis[:2]),
+        )
+
+    @override_settings(TOKEN_FAMILIES={**settings.TOKEN_FAMILIES, 'WRITE_BEHIND': False, 'REUSE_GRACE': 0})
+    def test_reuse_revokes_the_family(self):
+        tokens = self.login()
+        rotated = self.refresh(tokens['refresh']).json()['refresh']
+
+        response = self.refresh(tokens['refresh'])
+        self.assertEqual(response.status_code, 401)
+        self.assertIsNotNone(TokenFamily.objects.get(user=self.user).revoked_at)
+        # the token the attacker or the client holds is dead too
+        self.assertEqual(self.refresh(rotated).status_code, 401)
+
+    def test_retry_within_grace_does_not_revoke(self):
+        tokens = self.login()
+        rotated = self.refresh(tokens['refresh']).json()['refresh']
+
+        response = self.refresh(tokens['refresh'])
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()['error']['code'], 'auth_failed')
+        self.assertIsNone(TokenFamily.objects.get(user=self.user).revoked_at)
+        self.assertEqual(self.refresh(rotated).status_code, 200)
+
+    def test_failed_rotation_writes_no_rows(self):
+        tokens = self.login()
+        self.refresh(tokens['refresh'])
+        before = OutstandingToken.objects.count(), BlacklistedToken.objects.count()
+        self.refresh(tokens['refresh'])
+        self.assertEqual((OutstandingToken.objects.count(), BlacklistedToken.objects.count()), before)
+
+    def test_logout_revokes_the_family(self):
+        tokens = self.login()
+        response = self.post('/v1/auth/logout/', {'refresh': tokens['refresh']})
+        self.assertEqual(response.status_code, 205)
+        self.assertIsNotNone(TokenFamily.objects.get(user=self.user).revoked_at)
+        self.assertEqual(self.refresh(tokens['refresh']).status_code, 401)
+        row = BlacklistedToken.objects.select_related('token').get()
+        self.assertEqual(row.token.user_id, self.user.pk)
+
+
+class BatchRegistrationTests(AuthTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user.is_staff = True
+        self.user.save()
+        self.client.defaults['HTTP_AUTHORIZATION'] = f"Bearer {self.login()['access']}"
+
+    def row(self, username, **extra):
+        return {
+            'username': username, 'password': PASSWORD, 'first_name': 'Bo', 'last_name': 'Lee',
+            'nickname': username, 'email': f'{username}@example.com', **extra,
+        }
+
+    def test_creates_valid_rows_and_reports_the_rest(self):
+        response = self.post('/v1/auth/registration/batch/', {'users': [self.row('bo'), self.row('alice')]})
+        self.assertEqual(response.status_code, 201, response.content)
+        body = response.json()
+        self.assertEqual(body['created'], 1)
+        self.assertEqual([(e['index'], e['status']) for e in body['errors']], [(1, 'conflict')])
+        self.assertTrue(User.objects.get(username='bo').check_password(PASSWORD))
+
+    def test_nothing_created_is_a_bad_request(self):
+        response = self.post('/v1/auth/registration/batch/', {'users': [self.row('alice'), {'username': 'x'}]})
+        self.assertEqual(response.status_code, 400)
+        body = response.json()
+        self.assertEqual((body['ok'], body['created'], len(body['errors'])), (False, 0, 2))
+
+    def test_request_log_masks_nested_passwords(self):
+        body = {'users': [self.row('bo'), {'profile': {'token': 't', 'name': 'n'}}]}
+        masked = mask(body)
+        self.assertEqual(masked['users'][0]['password'], '***')
+        self.assertEqual(masked['users'][0]['username'], 'bo')
+        self.assertEqual(masked['users'][1]['profile'], {'token': '***', 'name': 'n'})
+        self.assertEqual(body['users'][0]['password'], PASSWORD)
+
+
+class PurgeTokensTests(AuthTestCase):
+
+    def expire_tokens(self, count):
+        for _ in range(count):
+            self.post('/v1/auth/logout/', {'refresh': self.login()['refresh']})
+        OutstandingToken.objects.update(expires_at=timezone.now() - timedelta(days=1))
+
+    def test_deletes_expired_rows_in_bulk(self):
+        self.expire_tokens(3)
+        # a fixed number of queries per batch, whatever the number of rows in it
+        with self.assertNumQueries(9):
+            call_command('purge_tokens', stdout=StringIO())
+        self.assertFalse(OutstandingToken.objects.exists())
+        self.assertFalse(BlacklistedToken.objects.exists())
+
+
+class ServeTests(TestCase):
+
+    @override_settings(
+        REQUEST_LOG={**settings.REQUEST_LOG, 'PATH': '/var/log/artq/requests.jsonl'},
+        TRACING={**settings.TRACING, 'PATH': 'traces-{pid}.jsonl'},
+        METRICS={**settings.METRICS, 'MULTIPROCESS_DIR': None},
+    )
+    def test_workers_get_their_own_files(self):
+        directory = serve.configure_workers()
+        self.addCleanup(os.rmdir, directory)
+        self.assertEqual(settings.REQUEST_LOG['PATH'], '/var/log/artq/requests-{pid}.jsonl')
+        self.assertEqual(settings.TRACING['PATH'], 'traces-{pid}.jsonl')
+        self.assertEqual(settings.METRICS['MULTIPROCESS_DIR'], directory)
+        self.assertTrue(os.path.isdir(directory))
+
+
+class HeldBookkeeper(families.Bookkeeper):
+    """Write-behind without the thread: rows wait for `drain()`, outside the measured request."""
+
+    inline = False
+
+    def drain(self):
+        batch = []
+        while not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        self._write(batch, close=False)
+
+
+@override_settings(
+    AVAILABILITY={**settings.AVAILABILITY, 'EXPECTED_USERS': 1000, 'SYNC_INTERVAL': None, 'BACKGROUND_SYNC': False},
+    JTI_BLACKLIST={**settings.JTI_BLACKLIST, 'SYNC_INTERVAL': None, 'BACKGROUND_SYNC': False},
+)
+class BudgetTests(AuthTestCase):
+    """Each auth endpoint within its BUDGETS query count (and latency, with BUDGETS['CHECK_LATENCY'])."""
+
+    def setUp(self):
+        super().setUp()
+        bookkeeper = HeldBookkeeper(families.get_config())
+        patcher = mock.patch.object(families, '_bookkeeper', bookkeeper)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.bookkeeper = bookkeeper
+        # loaded once per process in production, not by the request measured
+        availability_index.sync()
+        blacklist_index.sync()
+
+    def call(self, endpoint, method, path, data, expected):
+        kwargs = {} if method == 'get' else {'content_type': 'application/json'}
+        # TestCase's transaction sends every read to the primary
+        with assert_budget(endpoint, using='default'):
+            response = getattr(self.client, method)(path, data, **kwargs)
+        self.assertEqual(response.status_code, expected, response.content)
+        self.bookkeeper.drain()
+        return response.json() if response.content else None
+
+    def tokens(self):
+        return self.call('login', 'post', '/v1/auth/login/', {'username': 'alice', 'password': PASSWORD}, 200)
+
+    def test_registration(self):
+        user = {'first_name': 'Bo', 'last_name': 'Lee', 'username': 'bo', 'password': PASSWORD,
+                'nickname': 'bo', 'email': 'bo@example.com'}
+        self.call('registration', 'post', '/v1/auth/registration/', user, 201)
+
+    def test_availability(self):
+        self.call('availability', 'get', '/v1/auth/availability/', {'username': 'alice'}, 200)
+
+    def test_login(self):
+        self.tokens()
+
+    def test_refresh(self):
+        self.call('refresh', 'post', '/v1/auth/refresh/', {'refresh': self.tokens()['refresh']}, 200)
+
+    def test_verify(self):
+        self.call('verify', 'post', '/v1/auth/verify/', {'token': self.tokens()['access']}, 200)
+
+    def test_logout(self):
+        self.call('logout', 'post', '/v1/auth/logout/', {'refresh': self.tokens()['refresh']}, 205)
+
+
+@override_settings(AUTH_VIEW_MODE='async')
+class AsyncBudgetTests(BudgetTests):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        reload_urlconf()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        reload_urlconf()
+
+
+class LocalRedis:
+    """
+    In-process stand-in for the Redis client used by RedisBuckets: implements
+    register_script() for TAKE_SCRIPT with the same algorithm in Python.
+    """
+
+    def __init__(self):
+        self.hashes = {}
+        self.calls = 0
+
+    def register_script(self, script):
+        if script != throttling.TAKE_SCRIPT:
+            raise NotImplementedError("LocalRedis only runs the token-bucket script")
+
+        def run(keys, args):
+            self.calls += 1
+            capacity, refill, now, cost = (float(a) for a in args)
+            tokens, updated = self.hashes.get(keys[0], (None, None))
+            allowed, tokens, wait = throttling.take(tokens, updated, capacity, refill, now, cost)
+            self.hashes[keys[0]] = (tokens, now)
+            # redis returns the script's numbers as integers and strings
+            return [int(allowed), str(wait)]
+
+        return run
+
+
+class BrokenRedis:
+    def register_script(self, script):
+        def run(keys, args):
+            raise ConnectionError('redis is down')
+
+        return run
+
+
+class TokenBucketTests(TestCase):
+
+    def test_take_spends_and_refills(self):
+        self.assertEqual(throttling.take(None, None, 2, 1.0, now=100), (True, 1, 0.0))
+        self.assertEqual(throttling.take(1, 100, 2, 1.0, now=100), (True, 0, 0.0))
+        self.assertEqual(throttling.take(0, 100, 2, 1.0, now=100.25), (False, 0.25, 0.75))
+        # never above capacity, however long the bucket sat
+        self.assertEqual(throttling.take(0, 100, 2, 1.0, now=1000), (True, 1, 0.0))
+
+    def test_parse_rate(self):
+        self.assertEqual(throttling.parse_rate('30/min'), (30, 0.5))
+        self.assertEqual(throttling.parse_rate('10/s'), (10, 10.0))
+
+    def test_memory_buckets(self):
+        buckets = throttling.MemoryBuckets(max_keys=2)
+        self.assertEqual([buckets.take('a', 2, 1 / 60)[0] for _ in range(3)], [True, True, False])
+        self.assertAlmostEqual(buckets.take('a', 2, 1 / 60)[1], 60, delta=1)
+        buckets.take('b', 2, 1 / 60)
+        buckets.take('c', 2, 1 / 60)
+        # 'a' was the least recently used bucket: dropped, so full again
+        self.assertTrue(buckets.take('a', 2, 1 / 60)[0])
+
+    def test_redis_buckets_fail_open(self):
+        buckets = throttling.RedisBuckets(BrokenRedis())
+        with self.assertLogs('apps.accounts.throttling', 'WARNING'):
+            self.assertEqual(buckets.take('a', 1, 1.0), (True, 0.0))
+        self.assertEqual(buckets.errors, 1)
+
+
+@override_settings(THROTTLING={**settings.THROTTLING, 'BACKEND': 'memory', 'RATES': {'login_ip': '2/min'}})
+class LoginThrottleTests(AuthTestCase):
+
+    def attempts(self, count):
+        credentials = {'username': 'alice', 'password': 'wrong'}
+        return [self.post('/v1/auth/login/', credentials) for _ in range(count)]
+
+    def assert_throttled_third(self):
+        responses = self.attempts(3)
+        self.assertEqual([r.status_code for r in responses], [401, 401, 429])
+        self.assertEqual(responses[2].json()['error']['code'], 'throttled')
+        # one token every 30 seconds
+        self.assertIn(int(responses[2]['Retry-After']), (29, 30))
+
+    def test_memory_backend(self):
+        self.assert_throttled_third()
+
+    def test_redis_script_path(self):
+        client = LocalRedis()
+        throttling.set_buckets(throttling.RedisBuckets(client))
+        self.addCleanup(throttling.set_buckets, None)
+        self.assert_throttled_third()
+        self.assertEqual(client.calls, 3)
+        self.assertEqual(list(client.hashes), ['tb:login_ip:127.0.0.1'])
+
+    @override_settings(THROTTLING={**settings.THROTTLING, 'BACKEND': 'memory', 'RATES': {'login_username': '1/min'}})
+    def test_username_bucket_ignores_case(self):
+        first, second = (self.post('/v1/auth/login/', {'username': name, 'password': 'wrong'}) for name in ('alice', ' ALICE'))
+        self.assertEqual((first.status_code, second.status_code), (401, 429))
+
+
+class ClientKeyTests(TestCase):
+
+    def test_keys_of_an_api_client(self):
+        config = routers.get_config()
+        token = RefreshToken()
+        token[api_settings.USER_ID_CLAIM] = '01a14efb-7be5-76b3-adae-4c1b5d27d26a'
+        refresh = str(token)
+        request = RequestFactory().post(
+            '/v1/auth/refresh/', {'refresh': refresh, 'username': ' Bo '}, content_type='application/json',
+            HTTP_AUTHORIZATION='Bearer not-a-jwt',
+        )
+        self.assertEqual(routers.client_keys(request, config), [
+            'dbpin:username:bo', 'dbpin:user:01a14efb-7be5-76b3-adae-4c1b5d27d26a',
+        ])
+
+    def test_body_is_decoded_once(self):
+        config = routers.get_config()
+        request = RequestFactory().post('/v1/auth/login/', {'username': 'bo'}, content_type='application/json')
+        with mock.patch('config.fastjson.loads', wraps=fastjson.loads) as loads:
+            routers.client_keys(request, config)
+            routers.client_keys(request, config)
+            request.parsed_json = {'username': 'al'}  # set by the view's parser
+            self.assertEqual(routers.client_keys(request, config), ['dbpin:username:al'])
+        self.assertEqual(loads.call_count, 1)
+
+
+@skipUnless('replica1' in settings.DATABASES, 'set SQLITE_REPLICA_PATH to run the replica tests')
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    TOKEN_FAMILIES={**settings.TOKEN_FAMILIES, 'WRITE_BEHIND': False},
+    THROTTLING={**settings.THROTTLING, 'RATES': {}},
+)
+class ReplicaRoutingTests(TransactionTestCase):
+    """
+    replica1 mirrors default (TEST['MIRROR']): both see the same rows, so
+    these tests check where the queries went. Outside TestCase's transaction,
+    which would send every read to the primary.
+    """
+    databases = '__all__'
+    user = {'first_name': 'Bo', 'last_name': 'Lee', 'username': 'bo', 'password': PASSWORD,
+            'nickname': 'bo', 'email': 'bo@example.com'}
+
+    def setUp(self):
+        caches[routers.get_config()['PIN_CACHE']].clear()
+
+    def post(self, path, data, **extra):
+        response = self.client.post(path, data, content_type='application/json', **extra)
+        # an API client: no cookie jar
+        self.client.cookies.clear()
+        return response
+
+    def login(self):
+        with CaptureQueriesContext(connections['replica1']) as replica:
+            response = self.post('/v1/auth/login/', {'username': 'bo', 'password': PASSWORD})
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json(), [query['sql'] for query in replica.captured_queries]
+
+    def test_register_then_login_reads_the_primary(self):
+        response = self.post('/v1/auth/registration/', self.user)
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertIn('dbpin', response.cookies)
+        _, replica_queries = self.login()
+        self.assertEqual(replica_queries, [])
+
+    def test_reads_go_to_the_replica_once_the_pin_expired(self):
+        self.post('/v1/auth/registration/', self.user)
+        caches[routers.get_config()['PIN_CACHE']].clear()
+        _, replica_queries = self.login()
+        self.assertTrue(any('accounts_user' in sql for sql in replica_queries))
+
+    def test_login_pins_the_user_of_its_tokens(self):
+        user = User.objects.create_user(**self.user)
+        self.login()
+        # the refresh and bearer tokens it handed out carry the user id
+        self.assertTrue(caches[routers.get_config()['PIN_CACHE']].get(f'dbpin:user:{user.pk}'))
+
+
+class OTPStoreTests(TestCase):
+
+    def setUp(self):
+        self.store = self.new_store()
+
+    def new_store(self, **config):
+        config = {**otp.DEFAULTS, 'MAX_ATTEMPTS': 2, 'ISSUE_RATE': '3/hour', **config}
+        return otp.OTPStore(otp.MemoryCodes(config['MAX_KEYS']), config)
+
+    def test_a_code_is_valid_once(self):
+        code = self.store.issue('email:bo@example.com')
+        self.assertEqual(len(code), 6)
+        self.assertEqual(self.store.check('email:bo@example.com', code), otp.VALID)
+        self.assertEqual(self.store.check('email:bo@example.com', code), otp.EXPIRED)
+
+    def test_only_digests_are_stored(self):
+        code = self.store.issue('email:bo@example.com')
+        stored = [entry[0] for entry in self.store.backend._codes.values()]
+        self.assertEqual(stored, [otp.digest('email:bo@example.com', code)])
+
+    def test_wrong_codes_lock_the_code(self):
+        code = self.store.issue('phone:+821012345678')
+        wrong = str((int(code) + 1) % 10 ** 6).zfill(6)
+        self.assertEqual(self.store.check('phone:+821012345678', wrong), otp.INVALID)
+        self.assertEqual(self.store.check('phone:+821012345678', wrong), otp.INVALID)
+        self.assertEqual(self.store.check('phone:+821012345678', code), otp.LOCKED)
+
+    def test_a_new_code_replaces_the_old_one(self):
+        first = self.store.issue('email:bo@example.com')
+        second = self.store.issue('email:bo@example.com')
+        if first != second:
+            self.assertEqual(self.store.check('email:bo@example.com', first), otp.INVALID)
+        self.assertEqual(self.store.check('email:bo@example.com', second), otp.VALID)
+
+    def test_issue_rate(self):
+        for _ in range(3):
+            self.store.issue('email:bo@example.com')
+        with self.assertRaises(otp.RateLimited) as raised:
+            self.store.issue('email:bo@example.com')
+        self.assertGreater(raised.exception.wait, 3500)
+        # other destinations have their own window
+        self.store.issue('email:al@example.com')
+
+    def test_expired_codes(self):
+        store = self.new_store(TTL=0)
+        code = store.issue('email:bo@example.com')
+        self.assertEqual(store.check('email:bo@example.com', code), otp.EXPIRED)
+        self.assertEqual(store.check('email:never@example.com', code), otp.EXPIRED)
+
+
+@override_settings(OTP={**settings.OTP, 'BACKEND': 'memory'})
+class UserCacheTests(AuthTestCase):
+
+    def setUp(self):
+        super().setUp()
+        otp.set_store(None)
+        self.addCleanup(otp.set_store, None)
+        user_cache.reset()
+        self.authenticate()
+
+    def authenticate(self):
+        self.client.defaults['HTTP_AUTHORIZATION'] = f"Bearer {self.login()['access']}"
+
+    def status(self):
+        # authenticated, then a 400 for the wrong code
+        return self.post('/v1/auth/verification/email/confirm/', {'code': '000000'}).status_code
+
+    def test_cached_user(self):
+        self.assertEqual([self.status(), self.status()], [400, 400])
+        self.assertEqual((user_cache.misses, user_cache.hits), (1, 1))
+
+    def test_deactivation_rejects_the_next_request(self):
+        self.assertEqual(self.status(), 400)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.status(), 401)
+
+    def test_password_change_rejects_the_next_request(self):
+        # simplejwt's setting_changed receiver replaces api_settings, modules keep the old one
+        with mock.patch.object(api_settings, 'CHECK_REVOKE_TOKEN', True):
+            self.authenticate()  # a token with the password hash claim
+            self.assertEqual(self.status(), 400)
+            self.user.set_password('an0ther-Passw0rd!')
+            self.user.save()
+            self.assertEqual(self.status(), 401)
+
+    def test_login_keeps_the_cached_user(self):
+        self.status()
+        invalidations = user_cache.invalidations
+        with mock.patch.object(api_settings, 'UPDATE_LAST_LOGIN', True):
+            self.login()
+        self.user.refresh_from_db()
+        self.assertIsNotNone(self.user.last_login)
+        self.assertEqual(user_cache.invalidations, invalidations)
+        self.status()
+        self.assertEqual(user_cache.hits, 1)
+
+
+@override_settings(OTP={**settings.OTP, 'BACKEND': 'memory'})
+class VerificationViewTests(AuthTestCase):
+
+    def setUp(self):
+        super().setUp()
+        otp.set_store(None)
+        self.addCleanup(otp.set_store, None)
+        self.client.defaults['HTTP_AUTHORIZATION'] = f"Bearer {self.login()['access']}"
+
+    @override_settings(VERIFICATION={**settings.VERIFICATION, 'ENABLED': False})
+    def test_send_when_disabled(self):
+        with self.assertLogs('django.request', 'ERROR'):
+            response = self.post('/v1/auth/verification/email/send/', {})
+        self.assertEqual(response.status_code, 503)
+
+    @override_settings(VERIFICATION={**settings.VERIFICATION, 'ENABLED': True})
+    def test_send_queues_the_message(self):
+        with mock.patch.object(verification, 'get_dispatcher') as dispatcher:
+            response = self.post('/v1/auth/verification/email/send/', {})
+        self.assertEqual(response.status_code, 202)
+        dispatcher.return_value.submit.assert_called_once_with('email', str(self.user.pk))
+
+    def test_confirm(self):
+        code = otp.get_store().issue(verification.identifier('email', self.user.email))
+        wrong = str((int(code) + 1) % 10 ** 6).zfill(6)
+        self.assertEqual(self.post('/v1/auth/verification/email/confirm/', {'code': wrong}).status_code, 400)
+        self.assertEqual(self.post('/v1/auth/verification/email/confirm/', {'code': code}).status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.email_verified)
+
+    def test_request_log_masks_the_code(self):
+        self.assertEqual(mask({'code': '123456'}), {'code': '***'})
+
+
+@override_settings(THROTTLING={**settings.THROTTLING, 'BACKEND': 'memory', 'RATES': {'availability_ip': '2/min'}})
+class AvailabilityThrottleTests(AuthTestCase):
+
+    def checks(self):
+        return [self.client.get('/v1/auth/availability/', {'email': f'{n}@example.com'}).status_code for n in range(3)]
+
+    def test_sync_view(self):
+        self.assertEqual(self.checks(), [200, 200, 429])
+
+    @override_settings(AUTH_VIEW_MODE='async')
+    def test_async_view(self):
+        reload_urlconf()
+        self.addCleanup(reload_urlconf)
+        self.assertEqual(self.checks(), [200, 200, 429])
+
+
+class AvailabilityIndexTests(TransactionTestCase):
+    """Outside TestCase's transaction, which the sync thread would not see."""
+    databases = '__all__'  # reads go to the replica, when there is one
+
+    def setUp(self):
+        User.objects.create_user(username='bo', password=PASSWORD, first_name='Bo', last_name='Lee',
+                                 nickname='bo', email='bo@example.com')
+        self.index = AvailabilityIndex({**availability.get_config(), 'EXPECTED_USERS': 1000})
+
+    def wait_for_sync(self):
+        with self.index._sync_lock:
+            pass
+
+    def test_requests_never_load_the_filter_themselves(self):
+        with mock.patch.object(self.index, 'sync', wraps=self.index.sync) as sync:
+            # answered by the database while the filter loads in the background
+            self.assertEqual(self.index.check(username='bo', email='new@example.com'),
+                             {'username': False, 'email': True})
+            self.wait_for_sync()
+            self.assertEqual(self.index.check(username='new'), {'username': True})
+        self.assertEqual(sync.call_count, 1)
+        self.assertEqual((self.index.queries, self.index.filtered), (1, 1))
+
+    def test_failed_sync_waits_before_retrying(self):
+        with mock.patch.object(self.index, 'sync', side_effect=RuntimeError('db down')) as sync:
+            with self.assertLogs('apps.accounts.availability', 'WARNING'):
+                self.index.check(username='bo')
+                self.wait_for_sync()
+            self.index.check(username='bo')
+        self.assertEqual(sync.call_count, 1)
+
+
+class BlacklistIndexTests(TransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        token = RefreshToken()
+        token['user_id'] = 'x'  # no OutstandingToken row for a missing user
+        outstanding = OutstandingToken.objects.create(
+            jti=token['jti'], token=str(token), expires_at=timezone.now() + timedelta(days=1))
+        BlacklistedToken.objects.create(token=outstanding)
+        self.jti = token['jti']
+        self.index = BlacklistIndex({**blacklist.get_config(), 'SHARED_CACHE': None})
+
+    def test_requests_never_load_the_index_themselves(self):
+        sync, threads = self.index.sync, []
+        self.index.sync = lambda: (threads.append(threading.current_thread().name), sync())
+        # checked in the database until the background load is done
+        self.assertTrue(self.index.contains(self.jti))
+        with self.index._sync_lock:
+            pass
+        self.assertEqual(threads, ['blacklist-sync'])
+        with self.assertNumQueries(0, using='default'):
+            self.assertTrue(self.index.contains(self.jti))
+            self.assertFalse(self.index.contains('unknown'))
+
+
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    TOKEN_FAMILIES={**settings.TOKEN_FAMILIES, 'WRITE_BEHIND': False},
+    AVAILABILITY={**settings.AVAILABILITY, 'BACKGROUND_SYNC': False},
+)
+class BrowserMiddlewareTests(TestCase):
+    """The session / CSRF / auth stack runs for the admin, not for /v1/."""
+
+    def setUp(self):
+        User.objects.create_superuser(
+            first_name='Ad', last_name='Min', username='admin', password=PASSWORD, nickname='admin',
+        )
+        self.client = self.client_class(enforce_csrf_checks=True)
+
+    def admin_login(self, **data):
+        return self.client.post('/admin/login/?next=/admin/', {'username': 'admin', 'password': PASSWORD, **data})
+
+    def test_admin_enforces_csrf(self):
+        with self.assertLogs('django.security.csrf', 'WARNING'):
+            self.assertEqual(self.admin_login().status_code, 403)
+        self.client.get('/admin/login/')
+        response = self.admin_login(csrfmiddlewaretoken=self.client.cookies['csrftoken'].value)
+        self.assertRedirects(response, '/admin/', fetch_redirect_response=False)
+        self.assertIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        # the session authenticates the next request
+        response = self.client.get('/admin/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.wsgi_request.user.username, 'admin')
+
+    def test_csrf_check_runs_outside_the_api(self):
+        # for views without their own csrf_protect, unlike the admin's
+        middleware = BrowserMiddleware(lambda request: HttpResponse())
+        view = lambda request: HttpResponse()  # noqa: E731
+        request = RequestFactory().post('/form/')
+        with self.assertLogs('django.security.csrf', 'WARNING'):
+            middleware(request)
+            self.assertEqual(middleware.process_view(request, view, (), {}).status_code, 403)
+        request = RequestFactory().post('/v1/form/')
+        middleware(request)
+        self.assertIsNone(middleware.process_view(request, view, (), {}))
+
+    def test_api_responses_carry_no_session(self):
+        response = self.client.post('/v1/auth/login/', {'username': 'admin', 'password': PASSWORD},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)  # no CSRF check either
+        self.assertEqual(set(response.cookies) & {settings.SESSION_COOKIE_NAME, settings.CSRF_COOKIE_NAME}, set())
+        self.assertNotIn('cookie', response.get('Vary', '').lower())
+        self.assertFalse(hasattr(response.wsgi_request, 'session'))
+
+    @override_settings(
+        MIDDLEWARE_TIMING=True,
+        MIDDLEWARE=[path for layer in settings.MIDDLEWARE for path in ('config.middleware.LayerTimingMiddleware', layer)]
+        + ['config.middleware.LayerTimingMiddleware'],
+    )
+    def test_layer_timing(self):
+        def layers(response):
+            return [part.split(';')[0] for part in response['Server-Timing'].split(', ')]
+
+        api = layers(self.client.get('/v1/auth/availability/', {'username': 'bo'}))
+        self.assertEqual((api[0], api[-1]), ('MetricsMiddleware', 'view'))
+        self.assertIn('BrowserMiddleware', api)
+        self.assertNotIn('SessionMiddleware', api)
+        admin = layers(self.client.get('/admin/login/'))
+        self.assertIn('CsrfViewMiddleware', admin)
+        self.assertIn('SessionMiddleware', admin)
+
+
+class SigningTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with open(os.path.join(directory, 'k1.pem'), 'wb') as f:
+            f.write(signing.generate_key('EdDSA'))
+        self.config = {'ALGORITHM': 'EdDSA', 'KEYS_DIR': directory}
+        override = self.settings(JWT_SIGNING=self.config)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_hs256_tokens_are_refused_by_default(self):
+        payload = {'user_id': '1', 'token_type': 'access'}
+        legacy = TokenBackend('HS256', api_settings.SIGNING_KEY).encode(payload)
+        backend = signing.KeySetTokenBackend.from_settings()
+        self.assertEqual(backend.decode(backend.encode(payload))['user_id'], '1')
+        with self.assertRaises(TokenBackendError):
+            backend.decode(legacy)
+        with self.settings(JWT_SIGNING={**self.config, 'ACCEPT_HS256': True}):
+            self.assertEqual(signing.KeySetTokenBackend.from_settings().decode(legacy)['user_id'], '1')
+
+    def test_not_modified_jwks_keeps_cache_control(self):
+        response = self.client.get('/.well-known/jwks.json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['keys'][0]['kid'], 'k1')
+        cache_control = response['Cache-Control']
+        response = self.client.get('/.well-known/jwks.json', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['Cache-Control'], cache_control)
+
+
+class SchemaTests(TestCase):
+
+    @override_settings(AUTH_VIEW_MODE='async')
+    def test_async_views_are_documented(self):
+        sync = schema.generate()['json']
+        reload_urlconf()
+        self.addCleanup(reload_urlconf)
+        paths = json.loads(schema.generate()['json'])['paths']
+        self.assertIn('/v1/auth/login/', paths)
+        self.assertIn('/v1/auth/refresh/', paths)
+        self.assertEqual(schema.generate()['json'], sync)
+
+    def test_code_version_hashes_the_app_sources_only(self):
+        files = {str(path.relative_to(settings.BASE_DIR)) for path in schema._source_files()}
+        self.assertIn(os.path.join('apps', 'accounts', 'views.py'), files)
+        self.assertIn(os.path.join('config', 'urls.py'), files)
+        self.assertFalse([
+            name for name in files
+            if name.startswith('benchmarks') or name.endswith('tests.py') or 'migrations' in name
+        ])
+
+
+class RequestLogFileTests(TestCase):
+
+    def test_rotation_counts_bytes(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'requests.jsonl')
+        log_file = RotatingJsonLinesFile(path, max_bytes=100, backup_count=1)
+        self.addCleanup(log_file.close)
+        log_file.write_lines(['\u00e9' * 30 + '\n'])  # 31 characters, 61 bytes
+        log_file.write_lines(['\u00e9' * 30 + '\n'])
+        self.assertTrue(os.path.exists(path + '.1'))
+        self.assertEqual(os.path.getsize(path + '.1'), 122)
+
+
+class MetricsViewTests(TestCase):
+
+    def scrape(self, **extra):
+        return metrics.metrics_view(RequestFactory().get('/metrics', **extra)).status_code
+
+    def test_only_allowed_networks_scrape(self):
+        self.assertEqual(self.scrape(), 200)  # 127.0.0.1
+        self.assertEqual(self.scrape(REMOTE_ADDR='203.0.113.5'), 403)
+        self.assertEqual(self.scrape(REMOTE_ADDR='203.0.113.5', HTTP_X_FORWARDED_FOR='127.0.0.1'), 403)
+        with override_settings(METRICS={**settings.METRICS, 'ALLOWED_NETWORKS': ['203.0.113.0/24']}):
+            self.assertEqual(self.scrape(REMOTE_ADDR='203.0.113.5'), 200)
+
+    @override_settings(METRICS={**settings.METRICS, 'ALLOWED_NETWORKS': [], 'TOKEN': 's3cret'})
+    def test_bearer_token(self):
+        self.assertEqual(self.scrape(), 403)
+        self.assertEqual(self.scrape(HTTP_AUTHORIZATION='Bearer wrong'), 403)
+        self.assertEqual(self.scrape(HTTP_AUTHORIZATION='Bearer s3cret'), 200)
+
+
+class MetricsSnapshotTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, requests):
+        with open(os.path.join(self.directory, f'metrics-{name}.json'), 'w') as f:
+            json.dump({'counters': [['artq_http_requests_total', [['route', 'login']], requests]], 'histograms': []}, f)
+
+    def total(self):
+        counters, _ = metrics._merge(metrics.read_snapshots(self.directory))
+        return counters.get(('artq_http_requests_total', (('route', 'login'),)), 0)
+
+    def test_exited_workers_are_folded_into_one_file(self):
+        dead = subprocess.Popen(['true'])
+        dead.wait()
+        own = self.total()
+        self.write('exited', 3)
+        self.write(dead.pid, 5)
+        self.write(os.getppid(), 7)  # alive
+        self.assertEqual(self.total(), own + 15)
+        self.assertEqual(sorted(os.listdir(self.directory)), [
+            '.compact.lock', f'metrics-{os.getppid()}.json', 'metrics-exited.json',
+        ])
+        # compacting again changes nothing
+        self.assertEqual(self.total(), own + 15)
@@ -0,0 +1,234 @@
+"""
+Token-bucket throttles for the endpoints that hash passwords, and for the
+availability check.
+
+DRF runs throttles in APIView.initial(), before the handler, so a rejected
+login or registration never reaches PBKDF2. Buckets are keyed by client IP
+(same X-Forwarded-For rule as the request log) and, for login, by username,
+which still holds when an attacker rotates addresses. The availability
+check is cheap but tells whether an account exists: its per-IP bucket keeps
+anyone from walking a list of emails or phone numbers through it.
+
+Rates use DRF's "<tokens>/<period>" syntax: the bucket holds <tokens> and
+refills at <tokens> per <period>, so bursts up to the full rate are allowed.
+
+Backends (THROTTLING['BACKEND']):
+- "memory": per process, bounded LRU of buckets.
+- "redis": shared by every worker; one EVALSHA per check. Any client with
+  redis-py's register_script() works (the tests use an in-process one).
+  Redis errors let the request through (and are counted).
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from rest_framework.throttling import BaseThrottle
+from config.metrics import registry
+from config.middleware import client_ip
+
+log = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BACKEND': 'memory',
+    'REDIS_URL': None,
+    'KEY_PREFIX': 'tb:',
+    'MAX_KEYS': 100_000,
+    'RATES': {},
+}
+
+PERIODS = {'s': 1, 'sec': 1, 'm': 60, 'min': 60, 'h': 3600, 'hour': 3600, 'd': 86400, 'day': 86400}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'THROTTLING', {})}
+
+
+def parse_rate(rate):
+    """'10/min' -> (capacity 10, refill 10/60 tokens per second)."""
+    count, period = rate.split('/')
+    return int(count), int(count) / PERIODS[period]
+
+
+def take(tokens, updated, capacity, refill, now, cost=1):
+    """
+    One bucket step: returns (allowed, tokens, wait) given the stored token
+    count and update time (None for a new bucket). Mirrored by TAKE_SCRIPT.
+    """
+    if tokens is None:
+        tokens = capacity
+    else:
+        tokens = min(capacity, tokens + max(0.0, now - updated) * refill)
+    if tokens >= cost:
+        return True, tokens - cost, 0.0
+    return False, tokens, (cost - tokens) / refill
+
+
+TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local refill = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 't', 'ts')
+local tokens = tonumber(state[1])
+if tokens == nil then
+  tokens = capacity
+else
+  tokens = math.min(capacity, tokens + math.max(0, now - tonumber(state[2])) * refill)
+end
+local allowed = 0
+local wait = 0
+if tokens >= cost then
+  tokens = tokens - cost
+  allowed = 1
+else
+  wait = (cost - tokens) / refill
+end
+redis.call('HSET', KEYS[1], 't', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / refill * 1000) + 1000)
+return {allowed, tostring(wait)}
+"""
+
+
+class MemoryBuckets:
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, refill, cost=1):
+        now = time.time()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (None, None))
+            allowed, tokens, wait = take(tokens, updated, capacity, refill, now, cost)
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                # least recently used buckets are the ones most likely full again
+                self._buckets.popitem(last=False)
+        return allowed, wait
+
+    async def atake(self, key, capacity, refill, cost=1):
+        return self.take(key, capacity, refill, cost)
+
+
+class RedisBuckets:
+    def __init__(self, client):
+        self.client = client
+        self._script = client.register_script(TAKE_SCRIPT)
+        self.errors = 0
+
+    def take(self, key, capacity, refill, cost=1):
+        try:
+            allowed, wait = self._script(keys=[key], args=[capacity, refill, time.time(), cost])
+        except Exception:
+            # fail open: a Redis outage must not lock everybody out
+            self.errors += 1
+            log.warning("throttle backend unavailable, allowing request", exc_info=True)
+            return True, 0.0
+        return bool(int(allowed)), float(wait)
+
+    async def atake(self, key, capacity, refill, cost=1):
+        return await sync_to_async(self.take, thread_sensitive=False)(key, capacity, refill, cost)
+
+
+_buckets = None
+_buckets_lock = threading.Lock()
+
+
+def get_buckets():
+    global _buckets
+    if _buckets is None:
+        with _buckets_lock:
+            if _buckets is None:
+                config = get_config()
+                if config['BACKEND'] == 'redis':
+                    import redis
+                    _buckets = RedisBuckets(redis.Redis.from_url(config['REDIS_URL']))
+                else:
+                    _buckets = MemoryBuckets(config['MAX_KEYS'])
+    return _buckets
+
+
+def set_buckets(buckets):
+    """Swap the backend, e.g. RedisBuckets around a stand-in client in tests."""
+    global _buckets
+    _buckets = buckets
+
+
+@receiver(setting_changed)
+def _reset_on_setting_change(*, setting, **kwargs):
+    if setting == 'THROTTLING':
+        set_buckets(None)
+
+
+class TokenBucketThrottle(BaseThrottle):
+    scope = None
+
+    def get_ident_key(self, request):
+        """The bucket key for this request, or None to skip the check."""
+        raise NotImplementedError
+
+    def _bucket(self, request):
+        rate = get_config()['RATES'].get(self.scope)
+        ident = self.get_ident_key(request)
+        if not rate or ident is None:
+            return None
+        return f"{get_config()['KEY_PREFIX']}{self.scope}:{ident}", parse_rate(rate)
+
+    def _done(self, allowed, wait):
+        self._wait = wait
+        if not allowed:
+            registry.inc('artq_throttled_total', (('scope', self.scope),))
+        return allowed
+
+    def allow_request(self, request, view):
+        bucket = self._bucket(request)
+        if bucket is None:
+            return True
+        key, (capacity, refill) = bucket
+        return self._done(*get_buckets().take(key, capacity, refill))
+
+    async def aallow_request(self, request, view):
+        bucket = self._bucket(request)
+        if bucket is None:
+            return True
+        key, (capacity, refill) = bucket
+        return self._done(*await get_buckets().atake(key, capacity, refill))
+
+    def wait(self):
+        return getattr(self, '_wait', None)
+
+
+class LoginIPThrottle(TokenBucketThrottle):
+    scope = 'login_ip'
+
+    def get_ident_key(self, request):
+        return client_ip(request)
+
+
+class LoginUsernameThrottle(TokenBucketThrottle):
+    scope = 'login_username'
+
+    def get_ident_key(self, request):
+        username = request.data.get('username') if hasattr(request.data, 'get') else None
+        if not isinstance(username, str) or not username:
+            return None
+        return username.strip().lower()
+
+
+class RegistrationIPThrottle(TokenBucketThrottle):
+    scope = 'registration_ip'
+
+    def get_ident_key(self, request):
+        return client_ip(request)
+
+
+class AvailabilityIPThrottle(TokenBucketThrottle):
+    scope = 'availability_ip'
+
+    def get_ident_key(self, request):
+        return client_ip(request)
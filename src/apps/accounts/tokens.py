@@ -0,0 +1,202 @@
+"""
+Token classes and async token operations used by the auth views.
+
+simplejwt talks to the token_blacklist tables through the sync ORM inside
+``RefreshToken.for_user`` / ``verify`` / ``blacklist``. Under ASGI each of
+those calls costs a thread hop, so the async views use the helpers below
+instead.
+"""
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import update_last_login
+from rest_framework.exceptions import ValidationError
+from rest_framework.settings import api_settings as drf_settings
+from rest_framework_simplejwt.backends import TokenBackend
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import BlacklistMixin, RefreshToken
+from rest_framework_simplejwt.utils import datetime_from_epoch
+from config import tracing
+from config.tracing import span
+from .authentication import verify_untyped
+from . import families, signing
+from .blacklist import blacklist_index
+
+User = get_user_model()
+
+
+class TracingMixin:
+    """jwt.encode / jwt.decode spans (config.tracing) around a TokenBackend."""
+
+    def encode(self, payload):
+        with span('jwt.encode', alg=self.algorithm):
+            return super().encode(payload)
+
+    def decode(self, token, verify=True):
+        with span('jwt.decode', alg=self.algorithm):
+            return super().decode(token, verify)
+
+
+class TracedTokenBackend(TracingMixin, TokenBackend):
+
+    @classmethod
+    def from_settings(cls):
+        # same arguments as rest_framework_simplejwt.state.token_backend
+        return cls(
+            api_settings.ALGORITHM, api_settings.SIGNING_KEY, api_settings.VERIFYING_KEY,
+            api_settings.AUDIENCE, api_settings.ISSUER, api_settings.JWK_URL,
+            api_settings.LEEWAY, api_settings.JSON_ENCODER,
+        )
+
+
+class TracedKeySetTokenBackend(TracingMixin, signing.KeySetTokenBackend):
+    pass
+
+
+def build_token_backend():
+    """The backend for Token._token_backend, or None to keep simplejwt's shared one."""
+    traced = tracing.get_config()['ENABLED']
+    if signing.enabled():
+        return (TracedKeySetTokenBackend if traced else signing.KeySetTokenBackend).from_settings()
+    if traced:
+        return TracedTokenBackend.from_settings()
+    return None
+
+
+class IndexedRefreshToken(RefreshToken):
+    """
+    RefreshToken whose blacklist check is answered by the in-memory JTI index
+    instead of a query on BlacklistedToken. Rows are still written by
+    blacklist(); the index picks them up through post_save.
+    """
+    # family claims stay on the refresh token
+    no_copy_claims = (*RefreshToken.no_copy_claims, families.FAMILY_CLAIM, families.GENERATION_CLAIM)
+
+    def check_blacklist(self):
+        if blacklist_index.contains(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError("Token is blacklisted")
+
+
+class FamilyRefreshToken(IndexedRefreshToken):
+    """Refresh token opening a TokenFamily, rotated by apps.accounts.families."""
+
+    @classmethod
+    def for_user(cls, user):
+        # skip BlacklistMixin.for_user, the outstanding row is written behind
+        return families.start(super(BlacklistMixin, cls).for_user(user), user)
+
+    @classmethod
+    async def afor_user(cls, user):
+        return await families.astart(super(BlacklistMixin, cls).for_user(user), user)
+
+
+class DeferredBlacklistRefreshToken(IndexedRefreshToken):
+    """
+    RefreshToken that only verifies signature / exp / type on construction.
+    The blacklist lookup is left to ``acheck_blacklist``.
+    """
+
+    def check_blacklist(self):
+        pass
+
+
+async def aauthenticate(username, password):
+    """
+    Async version of ModelBackend.authenticate + USER_AUTHENTICATION_RULE.
+    Returns the user or None.
+    """
+    try:
+        user = await User._default_manager.aget(**{User.USERNAME_FIELD: username})
+    except User.DoesNotExist:
+        # run the hasher anyway to reduce the timing difference between
+        # existing and nonexistent users (same as ModelBackend)
+        await User().aset_password(password)
+        return None
+
+    if not await user.acheck_password(password):
+        return None
+    if not api_settings.USER_AUTHENTICATION_RULE(user):
+        return None
+    return user
+
+
+async def aissue_token_pair(user):
+    if families.get_config()['ENABLED']:
+        refresh = await FamilyRefreshToken.afor_user(user)
+    else:
+        # skip BlacklistMixin.for_user, the outstanding row is written below
+        refresh = super(BlacklistMixin, RefreshToken).for_user(user)
+        await OutstandingToken.objects.acreate(
+            user=user,
+            jti=refresh[api_settings.JTI_CLAIM],
+            token=str(refresh),
+            created_at=refresh.current_time,
+            expires_at=datetime_from_epoch(refresh["exp"]),
+        )
+
+    if api_settings.UPDATE_LAST_LOGIN:
+        await sync_to_async(update_last_login)(None, user)
+
+    return {"refresh": str(refresh), "access": str(refresh.access_token)}
+
+
+async def acheck_blacklist(token):
+    if await blacklist_index.acontains(token.payload[api_settings.JTI_CLAIM]):
+        raise TokenError("Token is blacklisted")
+
+
+async def ablacklist(token):
+    jti = token.payload[api_settings.JTI_CLAIM]
+    outstanding, _ = await OutstandingToken.objects.aget_or_create(
+        jti=jti,
+        defaults={
+            "token": str(token),
+            "expires_at": datetime_from_epoch(token.payload["exp"]),
+        },
+    )
+    return await BlacklistedToken.objects.aget_or_create(token=outstanding)
+
+
+async def arotate(raw_refresh):
+    """
+    Same result as TokenRefreshSerializer.validate, with async ORM calls.
+    """
+    refresh = DeferredBlacklistRefreshToken(raw_refresh)
+    if families.is_family_token(refresh):
+        # no blacklist check, the CAS detects reuse of rotated tokens
+        return await families.arotate(refresh)
+    await acheck_blacklist(refresh)
+
+    data = {"access": str(refresh.access_token)}
+
+    if api_settings.ROTATE_REFRESH_TOKENS:
+        if api_settings.BLACKLIST_AFTER_ROTATION:
+            await ablacklist(refresh)
+
+        refresh.set_jti()
+        refresh.set_exp()
+        refresh.set_iat()
+
+        data["refresh"] = str(refresh)
+
+    return data
+
+
+async def alogout(raw_refresh):
+    refresh = DeferredBlacklistRefreshToken(raw_refresh)
+    await acheck_blacklist(refresh)
+    if families.is_family_token(refresh):
+        await families.arevoke(refresh)
+    else:
+        await ablacklist(refresh)
+
+
+async def averify(raw_token):
+    """
+    Same checks as CachedTokenVerifySerializer.validate.
+    """
+    token = verify_untyped(raw_token)
+    if api_settings.BLACKLIST_AFTER_ROTATION:
+        if await blacklist_index.acontains(token.get(api_settings.JTI_CLAIM)):
+            raise ValidationError({drf_settings.NON_FIELD_ERRORS_KEY: ["Token is blacklisted"]})
@@ -1,9 +1,46 @@
+from django.conf import settings
 from django.urls import path
-from .views import RegistrationView, LoginView, LogoutView
+from rest_framework_simplejwt.views import TokenRefreshView, TokenVerifyView
+from .views import (
+    RegistrationView,
+    AvailabilityView,
+    BatchRegistrationView,
+    LoginView,
+    LogoutView,
+    VerificationConfirmView,
+    VerificationSendView,
+)
+from .async_views import (
+    AsyncRegistrationView,
+    AsyncAvailabilityView,
+    AsyncLoginView,
+    AsyncLogoutView,
+    AsyncTokenRefreshView,
+    AsyncTokenVerifyView,
+)
 
 
-urlpatterns = [
-    path('registration/', RegistrationView.as_view(), name='registration'),
-    path('login/', LoginView.as_view(), name='login'),
-    path('logout/', LogoutView.as_view(), name='logout'),  # Placeholder for logout view
-]
\ No newline at end of file
+if settings.AUTH_VIEW_MODE == 'async':
+    urlpatterns = [
+        path('registration/', AsyncRegistrationView.as_view(), name='registration'),
+        path('registration/batch/', BatchRegistrationView.as_view(), name='registration_batch'),
+        path('availability/', AsyncAvailabilityView.as_view(), name='availability'),
+        path('login/', AsyncLoginView.as_view(), name='login'),
+        path('logout/', AsyncLogoutView.as_view(), name='logout'),
+        path('refresh/', AsyncTokenRefreshView.as_view(), name='token_refresh'),
+        path('verify/', AsyncTokenVerifyView.as_view(), name='token_verify'),
+        path('verification/<str:channel>/send/', VerificationSendView.as_view(), name='verification_send'),
+        path('verification/<str:channel>/confirm/', VerificationConfirmView.as_view(), name='verification_confirm'),
+    ]
+else:
+    urlpatterns = [
+        path('registration/', RegistrationView.as_view(), name='registration'),
+        path('registration/batch/', BatchRegistrationView.as_view(), name='registration_batch'),
+        path('availability/', AvailabilityView.as_view(), name='availability'),
+        path('login/', LoginView.as_view(), name='login'),
+        path('logout/', LogoutView.as_view(), name='logout'),  # Placeholder for logout view
+        path('refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+        path('verify/', TokenVerifyView.as_view(), name='token_verify'),
+        path('verification/<str:channel>/send/', VerificationSendView.as_view(), name='verification_send'),
+        path('verification/<str:channel>/confirm/', VerificationConfirmView.as_view(), name='verification_confirm'),
+    ]
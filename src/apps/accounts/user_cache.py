@@ -0,0 +1,164 @@
+"""
+Process-local cache of the users behind authenticated requests.
+
+JWTAuthentication.get_user loads the user by primary key on every request.
+The cache keeps pk -> (version, loaded at, user) in a bounded LRU, so an
+authenticated request normally costs no query.
+
+Each user has a version counter, bumped by post_save / post_delete on the
+user model (apps.accounts.signals), so deactivation, password changes and
+deletes invalidate the entry right away:
+
+- With USER_CACHE['SHARED_CACHE'] set (a CACHES alias, normally redis), the
+  counters live there and every hit compares the entry's version with the
+  shared one, one cache GET, so a save in any worker process is seen by all.
+- Without it the counters are per process: saves in this process invalidate
+  immediately, those in other processes after MAX_AGE seconds at most.
+
+Writes that bypass signals (QuerySet.update(), raw SQL) are also only picked
+up after MAX_AGE, and so is a row loaded from a read replica that had not
+caught up with the save yet (config.db.routers). Callers get a copy of the cached instance, never the shared one.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+
+DEFAULTS = {
+    'MAX_ENTRIES': 10000,
+    'MAX_AGE': 60,
+    'SHARED_CACHE': None,
+    'KEY_PREFIX': 'user-ver:',
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'USER_CACHE', {})}
+
+
+class UserCache:
+    def __init__(self, config=None):
+        self.config = config or get_config()
+        self._entries = OrderedDict()  # pk -> (version, loaded_at, user)
+        self._versions = {}            # pk -> version, without a shared cache
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def shared(self):
+        alias = self.config['SHARED_CACHE']
+        return caches[alias] if alias else None
+
+    def _key(self, pk):
+        return f"{self.config['KEY_PREFIX']}{pk}"
+
+    # -- versions -------------------------------------------------------
+
+    def version(self, pk):
+        if self.shared is not None:
+            return self.shared.get(self._key(pk))
+        return self._versions.get(pk)
+
+    def bump(self, pk):
+        """Invalidate pk here and, with a shared cache, in every process."""
+        with self._lock:
+            self._entries.pop(pk, None)
+            self.invalidations += 1
+            if self.shared is None:
+                self._versions[pk] = self._versions.get(pk, 0) + 1
+        if self.shared is not None:
+            key = self._key(pk)
+            # the counter must outlive any entry that may have seen "no version"
+            timeout = max(self.config['MAX_AGE'] * 2, 3600)
+            if not self.shared.add(key, 1, timeout=timeout):
+                try:
+                    self.shared.incr(key)
+                except ValueError:
+                    # expired between add() and incr()
+                    self.shared.set(key, 1, timeout=timeout)
+
+    # -- reads ----------------------------------------------------------
+
+    def _lookup(self, pk, version):
+        with self._lock:
+            entry = self._entries.get(pk)
+            if entry is not None:
+                entry_version, loaded_at, user = entry
+                if entry_version == version and time.time() - loaded_at < self.config['MAX_AGE']:
+                    self._entries.move_to_end(pk)
+                    self.hits += 1
+                    return copy.copy(user)
+                del self._entries[pk]
+            self.misses += 1
+            return None
+
+    def _store(self, pk, version, user):
+        if self.config['MAX_ENTRIES'] <= 0:
+            return
+        with self._lock:
+            self._entries[pk] = (version, time.time(), copy.copy(user))
+            self._entries.move_to_end(pk)
+            while len(self._entries) > self.config['MAX_ENTRIES']:
+                self._entries.popitem(last=False)
+
+    def get(self, pk, load):
+        """
+        The user with this pk: cached, or load() (which may raise DoesNotExist,
+        misses are not cached).
+        """
+        # read the version before loading: a save racing with the load then
+        # leaves a stale version behind, never stale data under a current one
+        version = self.version(pk)
+        user = self._lookup(pk, version)
+        if user is None:
+            user = load()
+            self._store(pk, version, user)
+        return user
+
+    # -- maintenance ----------------------------------------------------
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+            self.hits = self.misses = self.invalidations = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+            'shared_cache': self.config['SHARED_CACHE'],
+        }
+
+
+user_cache = UserCache()
+
+
+def user_changed(pk, using=None):
+    """
+    Called from post_save / post_delete. Bumps now and, inside a transaction,
+    again on commit: between the two, another process may have cached the
+    old committed row under the first bump.
+    """
+    user_cache.bump(pk)
+    if transaction.get_connection(using).in_atomic_block:
+        transaction.on_commit(lambda: user_cache.bump(pk), using=using)
+
+
+@receiver(setting_changed)
+def _reset_on_setting_change(*, setting, **kwargs):
+    if setting in ('USER_CACHE', 'CACHES'):
+        user_cache.config = get_config()
+        user_cache.reset()
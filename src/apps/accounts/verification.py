@@ -0,0 +1,339 @@
+"""
+Verification messages (email / SMS) sent outside the request.
+
+Registration only calls `request_verification(user)`, which hands
+(channel, user pk) to a process-wide dispatcher on commit: a queue put, the
+request never waits on Celery, the broker or a provider. A daemon thread
+collects what arrives within FLUSH_INTERVAL (up to BATCH_SIZE), drops
+duplicates, and publishes one `accounts.send_verifications` task per channel
+(apps.accounts.tasks). When the queue is full the message is dropped and
+counted, like the request log.
+
+The task issues a one-time code per user (apps.accounts.otp), sends the
+whole batch over one provider connection, skips users who are verified
+already or were sent a message within DEDUP_TTL (a claim per user and
+channel in DEDUP_CACHE, so concurrent tasks and workers don't both send),
+and retries only the failed messages, with exponential backoff.
+
+SMS goes through SMS_BACKEND, a class with send_messages(messages) like
+Django's email backends; the console and locmem backends below are for
+development and tests.
+"""
+import atexit
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework_simplejwt.settings import api_settings
+from config.db.routers import primary
+from config.metrics import registry
+from . import otp
+from .user_cache import user_changed
+
+log = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': False,
+    'QUEUE_SIZE': 10000,
+    'BATCH_SIZE': 100,
+    'FLUSH_INTERVAL': 0.5,
+    'DEDUP_CACHE': 'default',
+    'DEDUP_TTL': 60,
+    'MAX_RETRIES': 5,
+    'RETRY_BACKOFF': 10,       # seconds, doubled per retry
+    'RETRY_BACKOFF_MAX': 600,
+    'SMS_BACKEND': 'apps.accounts.verification.ConsoleSMSBackend',
+    'FROM_EMAIL': None,        # DEFAULT_FROM_EMAIL
+}
+
+# channel -> (destination field, verified flag) on the user model
+CHANNELS = {
+    'email': ('email', 'email_verified'),
+    'phone': ('phone', 'phone_verified'),
+}
+
+Message = namedtuple('Message', 'user_id channel to subject body')
+
+
+class VerificationDisabled(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Verification messages are not enabled.'
+    default_code = 'verification_disabled'
+
+_STOP = object()
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'VERIFICATION', {})}
+
+
+def pending_channels(user):
+    """Channels the user has a destination for and hasn't verified yet."""
+    return [
+        channel for channel, (field, flag) in CHANNELS.items()
+        if getattr(user, field, None) and not getattr(user, flag, False)
+    ]
+
+
+def identifier(channel, to):
+    """OTP store key of a destination."""
+    return f'{channel}:{to.strip().lower()}'
+
+
+def compose(user, channel):
+    """The user's message with a fresh code, or None when the destination is rate limited."""
+    to = getattr(user, CHANNELS[channel][0])
+    try:
+        code = otp.get_store().issue(identifier(channel, to))
+    except otp.RateLimited:
+        log.info('verification code for user %s not sent, %s rate limited', user.pk, channel)
+        return None
+    minutes = otp.get_config()['TTL'] // 60
+    if channel == 'email':
+        return Message(str(user.pk), channel, to, 'Verify your email address',
+                       f'Your verification code is {code}. It expires in {minutes} minutes.')
+    return Message(str(user.pk), channel, to, '', f'Verification code: {code} (valid {minutes} min)')
+
+
+def confirm(user, channel, code):
+    """
+    Check a code against the user's current destination and mark it verified.
+    Returns the otp check result; the flag is set by one conditional UPDATE,
+    so a destination changed since the code was sent stays unverified.
+    """
+    field, flag = CHANNELS[channel]
+    to = getattr(user, field)
+    if not to:
+        return otp.EXPIRED
+    result = otp.get_store().check(identifier(channel, to), code)
+    registry.inc('artq_otp_checks_total', (('channel', channel), ('result', result)))
+    if result == otp.VALID:
+        queryset = get_user_model()._default_manager.filter(pk=user.pk, **{field: to, flag: False})
+        if queryset.update(**{flag: True}):
+            # update() sends no post_save
+            user_changed(str(getattr(user, api_settings.USER_ID_FIELD)), queryset.db)
+        setattr(user, flag, True)
+    return result
+
+
+# providers
+
+class BaseSMSBackend:
+    def __init__(self, fail_silently=False, **kwargs):
+        self.fail_silently = fail_silently
+
+    def send_messages(self, messages):
+        """Send Message tuples, return the ones that failed."""
+        raise NotImplementedError
+
+
+class ConsoleSMSBackend(BaseSMSBackend):
+    def send_messages(self, messages):
+        for message in messages:
+            sys.stdout.write(f'SMS to {message.to}: {message.body}\n')
+        sys.stdout.flush()
+        return []
+
+
+class LocmemSMSBackend(BaseSMSBackend):
+    """Keeps messages in `outbox`, like django.core.mail.outbox."""
+    outbox = []
+
+    def send_messages(self, messages):
+        LocmemSMSBackend.outbox.extend(messages)
+        return []
+
+
+def send_email(messages, config):
+    failed = []
+    # one connection (SMTP session) for the batch; one message per call, so a
+    # failure doesn't resend the ones before it
+    with mail.get_connection() as connection:
+        for message in messages:
+            email = mail.EmailMessage(
+                message.subject, message.body, config['FROM_EMAIL'], [message.to], connection=connection,
+            )
+            try:
+                email.send()
+            except Exception:
+                log.warning('verification email to user %s failed', message.user_id, exc_info=True)
+                failed.append(message)
+    return failed
+
+
+def send_sms(messages, config):
+    try:
+        return list(import_string(config['SMS_BACKEND'])().send_messages(messages))
+    except Exception:
+        log.warning('SMS batch of %d failed', len(messages), exc_info=True)
+        return list(messages)
+
+
+SENDERS = {'email': send_email, 'phone': send_sms}
+
+
+def claim(cache, key, owner, ttl):
+    """True for the first owner of key within ttl, and for the same owner again (task retries)."""
+    return cache.add(key, owner, ttl) or cache.get(key) == owner
+
+
+def deliver(channel, user_ids, owner=None, config=None):
+    """Send the channel's message to each user that still needs one, return the pks that failed."""
+    config = config or get_config()
+    owner = owner or uuid.uuid4().hex
+    field, flag = CHANNELS[channel]
+    cache = caches[config['DEDUP_CACHE']]
+    # from the primary: the task is queued right after registration commits
+    with primary():
+        users = list(
+            get_user_model()._default_manager
+            .filter(pk__in=user_ids, is_active=True, **{flag: False})
+            .exclude(**{f'{field}__isnull': True})
+            .exclude(**{field: ''})
+            .only('pk', field)
+        )
+    messages = [
+        message for message in (
+            compose(user, channel) for user in users
+            if claim(cache, f'verification-sent:{channel}:{user.pk}', owner, config['DEDUP_TTL'])
+        )
+        if message is not None
+    ]
+    if not messages:
+        return []
+    failed = SENDERS[channel](messages, config)
+    # failed messages keep their claim: retries of the same task may send them,
+    # nothing else until DEDUP_TTL has passed
+    return [message.user_id for message in failed]
+
+
+# dispatcher
+
+class VerificationDispatcher:
+    def __init__(self, config):
+        self.config = config
+        self.queue = queue.Queue(maxsize=config['QUEUE_SIZE'])
+        self.submitted = 0
+        self.dropped = 0
+        self.published = 0
+        self.errors = 0
+        self._drop_lock = threading.Lock()
+        self.pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='verification-dispatcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, channel, user_id):
+        try:
+            self.queue.put_nowait((channel, user_id))
+            self.submitted += 1
+        except queue.Full:
+            with self._drop_lock:
+                self.dropped += 1
+
+    def _run(self):
+        batch_size = self.config['BATCH_SIZE']
+        interval = self.config['FLUSH_INTERVAL']
+        while True:
+            batch = [self.queue.get()]
+            # wait up to FLUSH_INTERVAL for more, one task carries the lot
+            deadline = time.monotonic() + interval
+            while len(batch) < batch_size and batch[-1] is not _STOP:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            stop = batch[-1] is _STOP
+            self._publish([item for item in batch if item is not _STOP])
+            if stop:
+                return
+
+    def _publish(self, batch):
+        by_channel = {}  # channel -> {user pk: None}, duplicates dropped in order
+        for channel, user_id in batch:
+            by_channel.setdefault(channel, {})[user_id] = None
+        if not by_channel:
+            return
+        from .tasks import send_verifications  # imports celery, ~200 ms: not at startup
+
+        for channel, user_ids in by_channel.items():
+            try:
+                send_verifications.delay(channel, list(user_ids))
+                self.published += 1
+            except Exception:
+                # broker unreachable: the users can ask for a new message
+                self.errors += 1
+                log.exception('could not queue %d %s verification messages', len(user_ids), channel)
+
+    def close(self, timeout=5):
+        try:
+            self.queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def stats(self):
+        return {
+            'submitted': self.submitted,
+            'published': self.published,
+            'dropped': self.dropped,
+            'errors': self.errors,
+            'queued': self.queue.qsize(),
+        }
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """Process-wide dispatcher, started on first use (and again after fork)."""
+    global _dispatcher
+    if _dispatcher is None or _dispatcher.pid != os.getpid():
+        with _dispatcher_lock:
+            if _dispatcher is None or _dispatcher.pid != os.getpid():
+                _dispatcher = VerificationDispatcher(get_config())
+                atexit.register(_dispatcher.close)
+    return _dispatcher
+
+
+def enqueue(user, channels=None):
+    """Queue the user's pending verification messages, without waiting on anything."""
+    if not get_config()['ENABLED']:
+        return
+    channels = [channel for channel in pending_channels(user) if channels is None or channel in channels]
+    if channels:
+        dispatcher = get_dispatcher()
+        for channel in channels:
+            dispatcher.submit(channel, str(user.pk))
+
+
+def request_verification(user, using=None):
+    """enqueue() once the transaction creating the user has committed."""
+    if get_config()['ENABLED']:
+        transaction.on_commit(lambda: enqueue(user), using=using)
+
+
+@receiver(setting_changed)
+def _reset(setting, **kwargs):
+    global _dispatcher
+    if setting == 'VERIFICATION' and _dispatcher is not None:
+        _dispatcher.close()
+        _dispatcher = None
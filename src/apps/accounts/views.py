@@ -1,14 +1,28 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework import status
-from rest_framework.exceptions import ValidationError
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework_simplejwt.views import TokenObtainPairView
-from rest_framework_simplejwt.tokens import RefreshToken
-from drf_spectacular.utils import extend_schema, OpenApiResponse, OpenApiExample
-from .serializers import RegistrationSerializer, LoginSerializer, LogoutSerializer
+from drf_spectacular.types import OpenApiTypes
+from django.conf import settings
+from drf_spectacular.utils import extend_schema, OpenApiResponse, OpenApiExample, OpenApiParameter
+from .serializers import RegistrationSerializer, LoginSerializer, LogoutSerializer, VerificationCodeSerializer
+from .tokens import IndexedRefreshToken
+from . import bulk, families, hashing, otp, verification
+from .availability import FIELDS as AVAILABILITY_FIELDS, availability_index, ensure_available
+from .throttling import AvailabilityIPThrottle, LoginIPThrottle, LoginUsernameThrottle, RegistrationIPThrottle
+from .verification import request_verification
+
+CODE_ERRORS = {
+    otp.INVALID: "Invalid code.",
+    otp.EXPIRED: "The code has expired, request a new one.",
+    otp.LOCKED: "Too many attempts, request a new code.",
+}
 
 class RegistrationView(APIView):
+    throttle_classes = [RegistrationIPThrottle]
+
     @extend_schema(
         tags=["auth"],
         operation_id="registration",
@@ -52,11 +66,79 @@ class RegistrationView(APIView):
     def post(self, request):
         serializer = RegistrationSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)   # if fail, DRF throw ValidationError
-        serializer.save()
+        ensure_available(serializer.validated_data)  # before any hashing work
+        user = serializer.save()
+        request_verification(user)
         return Response({"ok": True}, status=status.HTTP_201_CREATED)
 
 
+class AvailabilityView(APIView):
+    throttle_classes = [AvailabilityIPThrottle]
+
+    @extend_schema(
+        tags=["auth"],
+        operation_id="availability",
+        description=(
+            "Check whether a username, email and/or phone number is still free. "
+            "Only the identifiers given in the query string are checked."
+        ),
+        parameters=[
+            OpenApiParameter(field, OpenApiTypes.STR, OpenApiParameter.QUERY, required=False)
+            for field in AVAILABILITY_FIELDS
+        ],
+        responses={
+            200: OpenApiResponse(description='{"ok": true, "available": {"username": true, ...}}'),
+            400: OpenApiResponse(description="No identifier given."),
+            429: OpenApiResponse(description="Too many checks from this address, see Retry-After."),
+        },
+    )
+    def get(self, request):
+        values = {field: request.query_params.get(field) for field in AVAILABILITY_FIELDS if request.query_params.get(field)}
+        if not values:
+            raise ValidationError("Provide at least one of username, email or phone.")
+        return Response({"ok": True, "available": availability_index.check(**values)}, status=status.HTTP_200_OK)
+
+
+class BatchRegistrationView(APIView):
+    permission_classes = [IsAdminUser]
+
+    @extend_schema(
+        tags=["auth"],
+        operation_id="registration_batch",
+        description=(
+            "Create up to BULK_REGISTRATION['MAX_ROWS'] user accounts at once (admin only). "
+            "Each item takes the same fields as registration. Invalid items and items whose "
+            "username, email or phone is already taken are reported by index; the others are created. "
+            "Passwords are hashed in a process pool."
+        ),
+        request=RegistrationSerializer(many=True),
+        responses={
+            201: OpenApiResponse(description="Batch processed, returns created count and per-item errors."),
+            400: OpenApiResponse(description="Bad Request, or no item was created (per-item errors as for 201)."),
+        },
+    )
+    def post(self, request):
+        users = request.data.get("users") if isinstance(request.data, dict) else None
+        if not isinstance(users, list) or not users:
+            raise ValidationError({"users": "A non-empty list of users is required."})
+        max_rows = settings.BULK_REGISTRATION['MAX_ROWS']
+        if len(users) > max_rows:
+            raise ValidationError({"users": f"At most {max_rows} users per request."})
+
+        created, errors = 0, []
+        for index, result, detail in bulk.import_chunk(list(enumerate(users)), pool=hashing.get_pool(bulk=True)):
+            if result == bulk.CREATED:
+                created += 1
+            else:
+                errors.append({"index": index, "status": result, "errors": detail})
+        if not created:
+            return Response({"ok": False, "created": 0, "errors": errors}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"ok": True, "created": created, "errors": errors}, status=status.HTTP_201_CREATED)
+
+
 class LoginView(TokenObtainPairView):
+    throttle_classes = [LoginIPThrottle, LoginUsernameThrottle]
+
     @extend_schema(
         tags=["auth"],
         operation_id="login",
@@ -104,9 +186,62 @@ class LogoutView(APIView):
         if not refresh:
             raise ValidationError({"refresh": "Refresh token is required."})
         try: 
-            token = RefreshToken(refresh)
-            token.blacklist()
+            token = IndexedRefreshToken(refresh)
+            if families.is_family_token(token):
+                families.revoke(token)
+            else:
+                token.blacklist()
         except Exception:
             raise ValidationError({"refresh": "Invalid refresh token."})
         
-        return Response({"ok": True}, status=status.HTTP_205_RESET_CONTENT)
\ No newline at end of file
+        return Response({"ok": True}, status=status.HTTP_205_RESET_CONTENT)
+
+
+class VerificationSendView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        tags=["auth"],
+        operation_id="verification_send",
+        description=(
+            "Send a verification code to the user's email or phone (channel: email / phone). "
+            "The message is sent in the background; repeated requests within a minute send one message."
+        ),
+        request=None,
+        responses={
+            202: OpenApiResponse(description="Queued (nothing is sent when the channel is already verified)."),
+            503: OpenApiResponse(description="Verification messages are not enabled (VERIFICATION['ENABLED'])."),
+        },
+    )
+    def post(self, request, channel):
+        if channel not in verification.CHANNELS:
+            raise NotFound()
+        if not verification.get_config()['ENABLED']:
+            raise verification.VerificationDisabled()
+        verification.enqueue(request.user, channels=[channel])
+        return Response({"ok": True}, status=status.HTTP_202_ACCEPTED)
+
+
+class VerificationConfirmView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        tags=["auth"],
+        operation_id="verification_confirm",
+        description="Confirm the code sent to the user's email or phone (channel: email / phone).",
+        request=VerificationCodeSerializer,
+        responses={
+            200: OpenApiResponse(description="Verified."),
+            400: OpenApiResponse(description="Invalid, expired or locked code."),
+        },
+        examples=[OpenApiExample("Request example", value={'code': '123456'})],
+    )
+    def post(self, request, channel):
+        if channel not in verification.CHANNELS:
+            raise NotFound()
+        serializer = VerificationCodeSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        result = verification.confirm(request.user, channel, serializer.validated_data['code'])
+        if result != otp.VALID:
+            raise ValidationError({"code": CODE_ERRORS[result]})
+        return Response({"ok": True}, status=status.HTTP_200_OK)
@@ -0,0 +1,91 @@
+"""
+Compare the v1/auth/ flow served as ASGI-async, ASGI-sync and WSGI.
+
+    cd src && python -m benchmarks.auth_modes --workers 8 --iterations 200
+
+Each iteration registers a user, logs in, refreshes, verifies and logs out.
+`--workers` is the number of concurrent in-flight requests in every mode:
+threads for WSGI, event loop tasks for ASGI.
+"""
+import argparse
+import json
+import uuid
+
+from . import harness
+
+PASSWORD = 'bench-Passw0rd!'
+
+
+def _user(index, run):
+    name = f'b{run}{index}'
+    return {
+        'first_name': 'Bench',
+        'last_name': 'User',
+        'username': name,
+        'password': PASSWORD,
+        'nickname': name,
+        'email': f'{name}@bench.example.com',
+    }
+
+
+def sync_flow(run):
+    def flow(call, index, state):
+        user = _user(index, run)
+        call('registration', 'POST', '/v1/auth/registration/', user, expect=(201,))
+        _, tokens = call('login', 'POST', '/v1/auth/login/',
+                         {'username': user['username'], 'password': PASSWORD})
+        _, rotated = call('refresh', 'POST', '/v1/auth/refresh/', {'refresh': tokens['refresh']})
+        call('verify', 'POST', '/v1/auth/verify/', {'token': rotated['access']})
+        call('logout', 'POST', '/v1/auth/logout/', {'refresh': rotated['refresh']}, expect=(205,))
+    return flow
+
+
+def async_flow(run):
+    async def flow(call, index, state):
+        user = _user(index, run)
+        await call('registration', 'POST', '/v1/auth/registration/', user, expect=(201,))
+        _, tokens = await call('login', 'POST', '/v1/auth/login/',
+                               {'username': user['username'], 'password': PASSWORD})
+        _, rotated = await call('refresh', 'POST', '/v1/auth/refresh/', {'refresh': tokens['refresh']})
+        await call('verify', 'POST', '/v1/auth/verify/', {'token': rotated['access']})
+        await call('logout', 'POST', '/v1/auth/logout/', {'refresh': rotated['refresh']}, expect=(205,))
+    return flow
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--modes', default='asgi-async,asgi-sync,wsgi')
+    parser.add_argument('--real-hasher', action='store_true',
+                        help='keep PASSWORD_HASHERS (PBKDF2) instead of MD5; hashing then dominates every mode')
+    parser.add_argument('--json', help='write the summaries to this file')
+    args = parser.parse_args(argv)
+
+    teardown = harness.setup_django(fast_hasher=not args.real_hasher)
+    from django.conf import settings
+
+    summaries = []
+    try:
+        for mode in args.modes.split(','):
+            settings.AUTH_VIEW_MODE = 'async' if mode == 'asgi-async' else 'sync'
+            harness.reload_urlconf()
+            run = uuid.uuid4().hex[:6]
+            if mode == 'wsgi':
+                result = harness.run_threads(mode, harness.WSGIClient(), sync_flow(run),
+                                             args.workers, args.iterations)
+            else:
+                result = harness.run_asyncio(mode, harness.ASGIClient(), async_flow(run),
+                                             args.workers, args.iterations)
+            summaries.append(result.summary())
+    finally:
+        teardown()
+
+    harness.print_table(summaries)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summaries, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Check the auth endpoints against their query / latency budgets (config.budgets).
+
+    cd src && python -m benchmarks.budgets
+    cd src && python -m benchmarks.budgets --view-modes sync --repeat 50
+    cd src && BUDGET_LATENCY_FACTOR=3 python -m benchmarks.budgets   # slow CI runner
+
+Every endpoint of the flow (registration, availability, login, refresh,
+verify, logout) is called --repeat times per AUTH_VIEW_MODE through the sync
+test client, after a warm-up. The largest query count and the median latency
+are compared with BUDGETS['ENDPOINTS']; the exit status is 1 when any budget
+is exceeded, with the offending statements printed, so CI fails on an N+1.
+The test suite holds each endpoint to its query count already; this adds the
+latencies, which depend on the machine.
+"""
+import argparse
+import statistics
+import sys
+
+from . import harness
+
+PASSWORD = 'bench-Passw0rd!'
+
+VIEW_MODES = ('sync', 'async')
+
+
+def flow(client, name):
+    """(endpoint, method, path, data, expected status) of one pass; tokens come from earlier steps."""
+    user = {'first_name': 'Budget', 'last_name': 'User', 'username': name, 'password': PASSWORD,
+            'nickname': name, 'email': f'{name}@budget.example.com'}
+    yield 'registration', 'post', '/v1/auth/registration/', user, 201
+    yield 'availability', 'get', '/v1/auth/availability/', {'username': name}, 200
+    tokens = yield 'login', 'post', '/v1/auth/login/', {'username': name, 'password': PASSWORD}, 200
+    tokens = yield 'refresh', 'post', '/v1/auth/refresh/', {'refresh': tokens['refresh']}, 200
+    yield 'verify', 'post', '/v1/auth/verify/', {'token': tokens['access']}, 200
+    yield 'logout', 'post', '/v1/auth/logout/', {'refresh': tokens['refresh']}, 205
+
+
+def run(view_mode, repeat, warmup):
+    from django.conf import settings
+    from django.test import Client
+    from config.budgets import measure
+
+    settings.AUTH_VIEW_MODE = view_mode
+    # every pass logs in from the same address
+    settings.THROTTLING = {**settings.THROTTLING, 'RATES': {}}
+    harness.reload_urlconf()
+    client = Client()
+    measurements = {}  # endpoint -> [Measurement]
+    for n in range(warmup + repeat):
+        steps = flow(client, f'budget{view_mode}{n}')
+        body = None
+        try:
+            while True:
+                endpoint, method, path, data, expected = steps.send(body)
+                kwargs = {} if method == 'get' else {'content_type': 'application/json'}
+                with measure() as measurement:
+                    response = getattr(client, method)(path, data, **kwargs)
+                if response.status_code != expected:
+                    raise SystemExit(f'{view_mode} {endpoint}: {response.status_code} {response.content[:200]!r}')
+                body = response.json() if response.content else None
+                if n >= warmup:
+                    measurements.setdefault(endpoint, []).append(measurement)
+        except StopIteration:
+            pass
+    return measurements
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--view-modes', default=','.join(VIEW_MODES))
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--database-url', help='Postgres; default is a temporary SQLite file')
+    args = parser.parse_args(argv)
+
+    teardown = harness.setup_django(fast_hasher=True, database_url=args.database_url)
+    try:
+        from config.budgets import get_config
+
+        config = get_config()
+        failures = []
+        print(f"{'mode':6} {'endpoint':13} {'queries':>7} {'budget':>6} {'p50 ms':>8} {'budget':>7}")
+        for view_mode in args.view_modes.split(','):
+            for endpoint, measurements in run(view_mode, args.repeat, args.warmup).items():
+                budget = config['ENDPOINTS'].get(endpoint, {})
+                # the worst query count (an N+1 may depend on the data), the typical latency
+                worst = max(measurements, key=lambda m: len(m.queries))
+                worst.seconds = statistics.median(m.seconds for m in measurements)
+                print(f"{view_mode:6} {endpoint:13} {len(worst.queries):>7} {budget.get('queries', '-'):>6} "
+                      f"{worst.ms:>8.2f} {budget.get('ms', '-'):>7}")
+                problems = worst.violations(budget.get('queries'), budget.get('ms'), config['LATENCY_FACTOR'])
+                failures += [f'{view_mode} {endpoint}: {problem}' for problem in problems]
+        for failure in failures:
+            print(f'\nOVER BUDGET {failure}', file=sys.stderr)
+        return 1 if failures else 0
+    finally:
+        from apps.accounts import families
+
+        families.flush()  # the write-behind thread, before its database goes away
+        teardown()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""
+Logins/sec per core for different password hasher settings.
+
+    cd src && python -m benchmarks.hashers --seconds 3
+    cd src && python -m benchmarks.hashers --candidates pbkdf2:720000,pbkdf2:260000,scrypt
+
+A login costs one hasher.verify(), so verifies/sec of a single busy process
+is the login ceiling of one core. One process per core runs the same loop to
+show how it scales; argon2 / bcrypt rows are skipped if their libraries are
+not installed.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import time
+
+# algorithm -> (hasher class, work factor attribute)
+HASHERS = {
+    'pbkdf2': ('django.contrib.auth.hashers.PBKDF2PasswordHasher', 'iterations'),
+    'pbkdf2_sha1': ('django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher', 'iterations'),
+    'argon2': ('django.contrib.auth.hashers.Argon2PasswordHasher', 'time_cost'),
+    'bcrypt': ('django.contrib.auth.hashers.BCryptSHA256PasswordHasher', 'rounds'),
+    'scrypt': ('django.contrib.auth.hashers.ScryptPasswordHasher', 'work_factor'),
+}
+DEFAULT_CANDIDATES = 'pbkdf2,pbkdf2:390000,pbkdf2:260000,argon2,bcrypt,scrypt'
+
+
+def _hasher(candidate):
+    from django.conf import settings
+    from django.utils.module_loading import import_string
+
+    if not settings.configured:
+        settings.configure()
+    name, _, factor = candidate.partition(':')
+    path, attr = HASHERS[name]
+    hasher = import_string(path)()
+    if factor:
+        setattr(hasher, attr, int(factor))
+    return hasher, attr
+
+
+def _verify_loop(candidate, seconds):
+    hasher, _ = _hasher(candidate)
+    encoded = hasher.encode('bench-Passw0rd!', hasher.salt())
+    count = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        hasher.verify('bench-Passw0rd!', encoded)
+        count += 1
+    return count
+
+
+def measure(candidate, seconds, processes):
+    try:
+        hasher, attr = _hasher(candidate)
+        hasher.encode('probe', hasher.salt())
+    except (ValueError, ImportError) as exc:
+        return {'candidate': candidate, 'skipped': str(exc)}
+
+    start = time.perf_counter()
+    encoded = hasher.encode('bench-Passw0rd!', hasher.salt())
+    single_ms = (time.perf_counter() - start) * 1000
+
+    one_core = _verify_loop(candidate, seconds) / seconds
+
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(processes) as pool:
+        counts = pool.starmap(_verify_loop, [(candidate, seconds)] * processes)
+    all_cores = sum(counts) / seconds
+
+    return {
+        'candidate': candidate,
+        'algorithm': hasher.algorithm,
+        'work_factor': f'{attr}={getattr(hasher, attr)}',
+        'encoded_prefix': encoded.rsplit('$', 2)[0],
+        'hash_ms': round(single_ms, 1),
+        'logins_per_sec_one_core': round(one_core, 1),
+        'logins_per_sec_all_cores': round(all_cores, 1),
+        'logins_per_sec_per_core': round(all_cores / processes, 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--candidates', default=DEFAULT_CANDIDATES,
+                        help='comma separated algorithm[:work_factor], algorithms: ' + ', '.join(HASHERS))
+    parser.add_argument('--seconds', type=float, default=2.0)
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args(argv)
+
+    results = [measure(c, args.seconds, args.processes) for c in args.candidates.split(',')]
+
+    print(f"{'candidate':<20}{'work factor':<24}{'hash ms':>9}{'1 core/s':>10}{'per core/s':>12}{'total/s':>10}")
+    for r in results:
+        if 'skipped' in r:
+            print(f"{r['candidate']:<20}skipped: {r['skipped']}")
+            continue
+        print(f"{r['candidate']:<20}{r['work_factor']:<24}{r['hash_ms']:>9}"
+              f"{r['logins_per_sec_one_core']:>10}{r['logins_per_sec_per_core']:>12}{r['logins_per_sec_all_cores']:>10}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
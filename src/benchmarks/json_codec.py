@@ -0,0 +1,131 @@
+"""
+DRF's JSONRenderer / JSONParser vs config.fastjson on the API's own payloads.
+
+    cd src && python -m benchmarks.json_codec
+    cd src && python -m benchmarks.json_codec --seconds 1 --json json_codec.json
+
+Every rendered payload is first checked to be byte for byte what JSONRenderer
+produces. Times are microseconds per call, best of --repeat runs.
+"""
+import argparse
+import datetime
+import io
+import json
+import os
+import sys
+import timeit
+import uuid
+
+from .harness import SRC_DIR
+
+
+def setup():
+    if str(SRC_DIR) not in sys.path:
+        sys.path.insert(0, str(SRC_DIR))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    import django
+    django.setup()
+
+
+def payloads():
+    """name -> response data, as the views hand it to the renderer."""
+    from rest_framework.exceptions import ValidationError
+    from rest_framework_simplejwt.tokens import RefreshToken
+    from config.exceptions import api_exception_handler
+    from apps.accounts.serializers import RegistrationSerializer
+
+    refresh = RefreshToken()
+    refresh['user_id'] = str(uuid.uuid4())
+    serializer = RegistrationSerializer(data={'username': 'x' * 200, 'email': 'not-an-email', 'nickname': '홍길동'})
+    serializer.is_valid()
+    validation = api_exception_handler(ValidationError(serializer.errors), {}).data
+
+    batch_errors = [
+        {'index': i, 'status': 'conflict', 'errors': {'username': ['A user with that username already exists.']}}
+        for i in range(0, 200, 2)
+    ]
+    return {
+        'token pair': {'refresh': str(refresh), 'access': str(refresh.access_token)},
+        'ok': {'ok': True},
+        'validation error': validation,
+        'availability': {'ok': True, 'available': {'username': False, 'email': True, 'phone': True}},
+        'batch registration (200 rows)': {'ok': True, 'created': 100, 'errors': batch_errors},
+        'user with dates': {
+            'id': uuid.uuid4(), 'username': 'loginID', 'nickname': '홍길동',
+            'date_joined': datetime.datetime.now(datetime.timezone.utc),
+            'birth_date': datetime.date(1990, 1, 1), 'email_verified': False,
+        },
+    }
+
+
+def request_bodies():
+    return {
+        'registration': {
+            'first_name': 'Gildong', 'last_name': 'Hong', 'username': 'loginID', 'password': 'loginPW',
+            'nickname': '홍길동', 'email': 'honggildong@example.com', 'birth_date': '1990-01-01',
+        },
+        'login': {'username': 'loginID', 'password': 'loginPW'},
+        'batch registration (200 rows)': {'users': [
+            {'first_name': 'F', 'last_name': 'L', 'username': f'user{i}', 'password': 'Passw0rd!',
+             'nickname': f'닉네임{i}', 'email': f'user{i}@example.com'}
+            for i in range(200)
+        ]},
+    }
+
+
+def best_us(fn, seconds, repeat):
+    number = max(1, int(seconds / max(timeit.timeit(fn, number=1), 1e-7) / repeat))
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number * 1e6
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=0.5, help='per measurement')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args(argv)
+
+    setup()
+    from rest_framework.parsers import JSONParser
+    from rest_framework.renderers import JSONRenderer
+    from config import fastjson
+
+    if fastjson.orjson is None:
+        sys.exit('orjson is not installed, FastJSONRenderer would only measure JSONRenderer')
+
+    results = []
+    drf_renderer, fast_renderer = JSONRenderer(), fastjson.FastJSONRenderer()
+    for name, data in payloads().items():
+        expected = drf_renderer.render(data)
+        if fast_renderer.render(data) != expected:
+            sys.exit(f'render mismatch for {name!r}')
+        results.append({
+            'op': 'render', 'payload': name, 'bytes': len(expected),
+            'drf_us': best_us(lambda: drf_renderer.render(data), args.seconds, args.repeat),
+            'fast_us': best_us(lambda: fast_renderer.render(data), args.seconds, args.repeat),
+        })
+
+    drf_parser, fast_parser = JSONParser(), fastjson.FastJSONParser()
+    for name, data in request_bodies().items():
+        body = json.dumps(data, ensure_ascii=False).encode()
+        if fast_parser.parse(io.BytesIO(body)) != drf_parser.parse(io.BytesIO(body)):
+            sys.exit(f'parse mismatch for {name!r}')
+        results.append({
+            'op': 'parse', 'payload': name, 'bytes': len(body),
+            'drf_us': best_us(lambda: drf_parser.parse(io.BytesIO(body)), args.seconds, args.repeat),
+            'fast_us': best_us(lambda: fast_parser.parse(io.BytesIO(body)), args.seconds, args.repeat),
+        })
+
+    print(f"{'op':<8}{'payload':<32}{'bytes':>7}{'drf us':>10}{'fast us':>10}{'speedup':>9}")
+    for r in results:
+        r['drf_us'], r['fast_us'] = round(r['drf_us'], 2), round(r['fast_us'], 2)
+        r['speedup'] = round(r['drf_us'] / r['fast_us'], 1)
+        print(f"{r['op']:<8}{r['payload']:<32}{r['bytes']:>7}{r['drf_us']:>10}{r['fast_us']:>10}{r['speedup']:>8}x")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
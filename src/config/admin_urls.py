@@ -0,0 +1,11 @@
+"""
+Admin site URLs, included lazily from config.urls.
+
+With BOOT_PROFILE=api the admin app is installed without autodiscovery, so
+ModelAdmin registrations are loaded here, on the first /admin/ request.
+"""
+from django.contrib import admin
+
+admin.autodiscover()
+
+urlpatterns = admin.site.get_urls()
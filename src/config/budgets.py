@@ -0,0 +1,114 @@
+"""
+Query-count and latency budgets per endpoint, for tests and CI.
+
+    from config.budgets import assert_budget
+
+    with assert_budget('login'):
+        client.post('/v1/auth/login/', credentials, content_type='application/json')
+
+The block's queries are captured on every database (or `using`) and compared
+with the endpoint's budget from BUDGETS['ENDPOINTS'], or the queries / ms
+given explicitly. Going over raises BudgetExceeded (an AssertionError) that
+lists the statements, with repeated ones counted, so an N+1 regression shows
+the query that multiplied. Wall time depends on the machine, so the
+endpoints' latency budgets are only checked with BUDGETS['CHECK_LATENCY']
+(multiplied by BUDGETS['LATENCY_FACTOR'] for slower machines); an `ms`
+given explicitly always is.
+
+Queries are captured per thread, like assertNumQueries: use the sync test
+client (async views run their ORM calls on the calling thread there).
+apps/accounts/tests.py holds every auth endpoint to its query budget;
+benchmarks/budgets.py runs the auth flows against the configured budgets,
+latencies included.
+"""
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+
+DEFAULTS = {
+    'CHECK_LATENCY': False,
+    'LATENCY_FACTOR': 1.0,
+    'ENDPOINTS': {},  # name -> {'queries': n, 'ms': n}
+}
+
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+class BudgetExceeded(AssertionError):
+    pass
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'BUDGETS', {})}
+
+
+def shape(sql):
+    """The statement with literals replaced by ?, so the N queries of an N+1 compare equal."""
+    return LITERALS.sub('?', sql)
+
+
+class Measurement:
+    __slots__ = ('queries', 'seconds')
+
+    def __init__(self):
+        self.queries = []  # [(alias, sql)]
+        self.seconds = 0.0
+
+    @property
+    def ms(self):
+        return self.seconds * 1000
+
+    def violations(self, queries=None, ms=None, latency_factor=1.0):
+        """Messages for each budget that was exceeded."""
+        out = []
+        if queries is not None and len(self.queries) > queries:
+            lines = [f'{len(self.queries)} queries, budget {queries}:']
+            repeated = Counter(shape(sql) for _, sql in self.queries)
+            for alias, sql in self.queries:
+                lines.append(f'  [{alias}] {sql}')
+            for statement, count in repeated.most_common():
+                if count > 1:
+                    lines.append(f'  repeated {count}x: {statement}')
+            out.append('\n'.join(lines))
+        if ms is not None and self.ms > ms * latency_factor:
+            out.append(f'{self.ms:.1f} ms, budget {ms * latency_factor:.1f} ms')
+        return out
+
+    def check(self, label, queries=None, ms=None):
+        """Raise BudgetExceeded against the given budget, or the endpoint's from BUDGETS."""
+        config = get_config()
+        budget = config['ENDPOINTS'].get(label, {})
+        queries = budget.get('queries') if queries is None else queries
+        if ms is None and config['CHECK_LATENCY']:
+            ms = budget.get('ms')
+        problems = self.violations(queries, ms, config['LATENCY_FACTOR'])
+        if problems:
+            raise BudgetExceeded(f'{label}: ' + '\n'.join(problems))
+
+
+@contextmanager
+def measure(using=None):
+    """Capture the queries and wall time of the block into the yielded Measurement."""
+    aliases = [using] if using else list(connections)
+    measurement = Measurement()
+    with ExitStack() as stack:
+        captured = [(alias, stack.enter_context(CaptureQueriesContext(connections[alias]))) for alias in aliases]
+        start = time.perf_counter()
+        try:
+            yield measurement
+        finally:
+            measurement.seconds = time.perf_counter() - start
+    measurement.queries = [(alias, query['sql']) for alias, context in captured for query in context.captured_queries]
+
+
+@contextmanager
+def assert_budget(label, queries=None, ms=None, using=None):
+    """measure() the block and check() it against the budget."""
+    with measure(using) as measurement:
+        yield measurement
+    measurement.check(label, queries, ms)
@@ -0,0 +1,18 @@
+"""
+Celery application for background work (apps.accounts.tasks).
+
+    cd src && celery -A config.celery worker -l info
+
+Configured from the CELERY_* settings. The web process doesn't import it at
+startup (celery takes ~200 ms to import); publishers import the task module
+when they first need it.
+"""
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+app = Celery('config')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
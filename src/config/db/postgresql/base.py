@@ -0,0 +1,144 @@
+"""
+PostgreSQL backend that takes connections from a psycopg_pool.ConnectionPool.
+
+Django 5.0 opens one connection per thread and either closes it after every
+request (CONN_MAX_AGE=0) or keeps it for that thread only. Under ASGI, and
+with threaded WSGI workers, that means either a new connection per request
+or one idle connection per thread ever used. With OPTIONS['pool'] set (True
+or a dict of ConnectionPool arguments: min_size, max_size, timeout,
+max_idle, max_lifetime, ...), every DatabaseWrapper of the process checks a
+connection out of one shared pool when it connects and hands it back when
+Django closes it at the end of the request.
+
+Follows the OPTIONS['pool'] support added in Django 5.1, so the setting can
+stay as is when ENGINE moves back to django.db.backends.postgresql.
+"""
+import threading
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.base.base import NO_DB_ALIAS
+from django.db.backends.postgresql import base
+from django.db.backends.postgresql.creation import DatabaseCreation as BaseDatabaseCreation
+
+
+class DatabaseCreation(BaseDatabaseCreation):
+    # pooled connections would keep the old database open (and block dropping it)
+    def create_test_db(self, *args, **kwargs):
+        self.connection.close_pool()
+        return super().create_test_db(*args, **kwargs)
+
+    def destroy_test_db(self, *args, **kwargs):
+        self.connection.close_pool()
+        return super().destroy_test_db(*args, **kwargs)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    # alias -> ConnectionPool, shared by the wrappers of every thread in the process
+    _connection_pools = {}
+    _pools_lock = threading.Lock()
+
+    @property
+    def pool(self):
+        pool_options = self.settings_dict['OPTIONS'].get('pool')
+        if self.alias == NO_DB_ALIAS or not pool_options:
+            return None
+        if self.alias not in self._connection_pools:
+            with self._pools_lock:
+                if self.alias not in self._connection_pools:
+                    self._connection_pools[self.alias] = self._create_pool(pool_options)
+        return self._connection_pools[self.alias]
+
+    def _create_pool(self, pool_options):
+        if not base.is_psycopg3:
+            raise ImproperlyConfigured("Database pooling requires psycopg >= 3")
+        if self.settings_dict['CONN_MAX_AGE'] != 0:
+            raise ImproperlyConfigured(
+                "Pooling doesn't support persistent connections; set CONN_MAX_AGE to 0, "
+                "connections are kept by the pool instead."
+            )
+        try:
+            from psycopg_pool import ConnectionPool
+        except ImportError as exc:
+            raise ImproperlyConfigured(
+                "Database pooling requires the psycopg_pool package (psycopg[pool])."
+            ) from exc
+
+        options = {} if pool_options is True else dict(pool_options)
+        if self.settings_dict['CONN_HEALTH_CHECKS']:
+            # checked on checkout, so a connection dropped by the server is replaced before use
+            options.setdefault('check', ConnectionPool.check_connection)
+        options.setdefault('name', f'django-{self.alias}')
+        pool = ConnectionPool(
+            kwargs=self.get_connection_params(),
+            configure=self._configure_connection,
+            open=False,
+            **options,
+        )
+        pool.open()
+        return pool
+
+    def close_pool(self):
+        """Close the pool of this alias; the next connect creates a new one."""
+        self.close()
+        with self._pools_lock:
+            pool = self._connection_pools.pop(self.alias, None)
+        if pool is not None:
+            pool.close()
+
+    @classmethod
+    def close_pools(cls):
+        """Close every pool of this process (tests, benchmarks, after fork)."""
+        with cls._pools_lock:
+            pools = list(cls._connection_pools.values())
+            cls._connection_pools.clear()
+        for pool in pools:
+            pool.close()
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop('pool', None)
+        return params
+
+    def _configure_connection(self, connection):
+        """Run once per new pooled connection; must leave it idle."""
+        timezone_name = self.timezone_name
+        if timezone_name and connection.info.parameter_status('TimeZone') != timezone_name:
+            with connection.cursor() as cursor:
+                cursor.execute(self.ops.set_time_zone_sql(), [timezone_name])
+        if role := self.settings_dict['OPTIONS'].get('assume_role'):
+            with connection.cursor() as cursor:
+                cursor.execute(self.ops.compose_sql('SET ROLE %s', [role]))
+        if not connection.autocommit:
+            connection.commit()
+
+    @base.async_unsafe
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        if pool is None:
+            return super().get_new_connection(conn_params)
+
+        # same isolation level handling as the base class
+        isolation_level = self.settings_dict['OPTIONS'].get('isolation_level')
+        try:
+            self.isolation_level = base.IsolationLevel(isolation_level) if isolation_level is not None \
+                else base.IsolationLevel.READ_COMMITTED
+        except ValueError:
+            raise ImproperlyConfigured(
+                f"Invalid transaction isolation level {isolation_level} "
+                f"specified. Use one of the psycopg.IsolationLevel values."
+            )
+        connection = pool.getconn()
+        if isolation_level is not None:
+            connection.isolation_level = self.isolation_level
+        return connection
+
+    def _close(self):
+        # psycopg_pool marks its connections with the pool they belong to
+        pool = getattr(self.connection, '_pool', None)
+        if pool is not None:
+            # back to the pool, which rolls back anything left open
+            with self.wrap_database_errors:
+                return pool.putconn(self.connection)
+        return super()._close()
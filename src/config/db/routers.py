@@ -0,0 +1,225 @@
+"""
+Read replicas for the account and token tables, with read-your-writes.
+
+ReplicaRouter sends reads of DATABASE_REPLICAS['MODELS'] (accounts.User, the
+token family and blacklist tables) to one of the REPLICAS aliases and every
+write to the primary (`default`). Other models stay on `default`.
+
+Reads go to the primary instead when:
+
+- the request already wrote to a routed model (any db_for_write call pins
+  the rest of the request);
+- the client wrote within STICKY_SECONDS (registering, then logging in
+  right away, finds the new user even when the replica lags). After a
+  write DatabasePinMiddleware remembers the client two ways: a cookie
+  holding the pin's expiry, for browsers, and entries in the PIN_CACHE cache
+  alias for API clients, which don't keep cookies. Those are keyed on what
+  such a client sends again: the user id claim of its JWT (bearer token or
+  `refresh` in the body, read without verifying it: a forged one can only
+  cost primary reads), the `username` it posted, and the users the request
+  wrote rows for. A PIN_CACHE shared by the workers (redis) pins across them;
+  the default local-memory cache only within one process;
+- the primary is inside a transaction (atomic blocks read their own writes).
+
+Outside a request (management commands, Celery tasks, the token bookkeeper
+thread) reads of routed models go to a replica too; use
+`Model.objects.using('default')` or `primary()` where that matters.
+
+Replicas are never migrated (allow_migrate is False for them). For local
+testing point a replica at a copy of the primary's SQLite file, and set
+TEST['MIRROR'] = 'default' so the test runner reuses the primary.
+"""
+import base64
+import contextvars
+import json
+import random
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+
+DEFAULTS = {
+    'REPLICAS': [],
+    'MODELS': [
+        'accounts.user',
+        'accounts.tokenfamily',
+        'token_blacklist.outstandingtoken',
+        'token_blacklist.blacklistedtoken',
+    ],
+    'STICKY_SECONDS': 5,
+    'COOKIE_NAME': 'dbpin',
+    'PIN_CACHE': None,          # cache alias for the pins of cookie-less clients
+    'PIN_KEY_PREFIX': 'dbpin:',
+    'MAX_BODY_BYTES': 4096,     # larger bodies aren't searched for a username
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'DATABASE_REPLICAS', {})}
+
+
+class Pin:
+    """Per-request routing state, shared with sync_to_async threads through the context."""
+    __slots__ = ('pinned', 'wrote', 'users')
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+        self.users = set()  # ids of the users whose rows were written
+
+
+current_pin = contextvars.ContextVar('db_current_pin', default=None)
+
+
+def pin_from_cookie(value, now, config):
+    """True when the cookie holds an unexpired pin no longer than STICKY_SECONDS."""
+    try:
+        expires = float(value)
+    except (TypeError, ValueError):
+        return False
+    # clients can't stretch the window by editing the cookie
+    return now < expires <= now + config['STICKY_SECONDS']
+
+
+def _token_user(raw):
+    """The user id claim of a JWT, unverified; None when it isn't one."""
+    try:
+        payload = raw.split('.')[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        user_id = claims[getattr(settings, 'SIMPLE_JWT', {}).get('USER_ID_CLAIM', 'user_id')]
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+        return None
+    return str(user_id)
+
+
+def _json_body(request, config):
+    """The decoded body: the view parser's (config.fastjson), else decoded once and kept on the request."""
+    if hasattr(request, 'parsed_json'):
+        body = request.parsed_json
+    elif hasattr(request, '_pin_body'):
+        body = request._pin_body
+    else:
+        body = request._pin_body = _decode_body(request, config)
+    return body if isinstance(body, dict) else {}
+
+
+def _decode_body(request, config):
+    from config.fastjson import loads
+
+    if request.content_type != 'application/json':
+        return None
+    try:
+        if int(request.META.get('CONTENT_LENGTH') or 0) > config['MAX_BODY_BYTES']:
+            return None
+        return loads(request.body)
+    except (ValueError, TypeError):
+        return None
+
+
+def client_keys(request, config):
+    """The PIN_CACHE keys of whoever sent `request`."""
+    prefix = config['PIN_KEY_PREFIX']
+    users = []
+    scheme, _, credentials = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    if scheme.lower() == 'bearer':
+        users.append(_token_user(credentials))
+    keys = []
+    if request.method == 'POST':
+        body = _json_body(request, config)
+        if isinstance(body.get('refresh'), str):
+            users.append(_token_user(body['refresh']))
+        if isinstance(body.get('username'), str) and body['username'].strip():
+            keys.append(f"{prefix}username:{body['username'].strip().lower()}")
+    keys += [f'{prefix}user:{user_id}' for user_id in users if user_id]
+    return keys
+
+
+def pin_user(user_id):
+    """Pin `user_id`'s API clients too, for writes the router sees without an instance (create())."""
+    pin = current_pin.get()
+    if pin is not None:
+        pin.users.add(str(user_id))
+
+
+@contextmanager
+def primary():
+    """Read routed models from the primary inside the block."""
+    token = current_pin.set(Pin(pinned=True))
+    try:
+        yield
+    finally:
+        current_pin.reset(token)
+
+
+class ReplicaRouter:
+    def __init__(self):
+        config = get_config()
+        self.replicas = list(config['REPLICAS'])
+        self.models = frozenset(label.lower() for label in config['MODELS'])
+
+    def _routed(self, model):
+        return model._meta.label_lower in self.models
+
+    def db_for_read(self, model, **hints):
+        if not self.replicas or not self._routed(model):
+            return None
+        pin = current_pin.get()
+        if pin is not None and (pin.pinned or pin.wrote):
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db == DEFAULT_DB_ALIAS:
+            # related objects of a row read from the primary come from there too
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(self.replicas)
+
+    def db_for_write(self, model, **hints):
+        if not self._routed(model):
+            return None
+        pin = current_pin.get()
+        if pin is not None:
+            pin.wrote = True
+            instance = hints.get('instance')
+            if instance is not None:
+                # the user itself, or the user a token row belongs to
+                user_id = instance.pk if model._meta.label == settings.AUTH_USER_MODEL else getattr(instance, 'user_id', None)
+                if user_id is not None:
+                    pin_user(user_id)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, *self.replicas}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in self.replicas:
+            return False
+        return None
+
+
+def start_request(request, config):
+    if pin_from_cookie(request.COOKIES.get(config['COOKIE_NAME']), time.time(), config):
+        return Pin(pinned=True)
+    keys = client_keys(request, config) if config['PIN_CACHE'] else []
+    return Pin(pinned=bool(keys and caches[config['PIN_CACHE']].get_many(keys)))
+
+
+def finish_request(pin, request, response, config):
+    """After a write, pin the client's reads to the primary for STICKY_SECONDS."""
+    if pin.wrote:
+        seconds = config['STICKY_SECONDS']
+        response.set_cookie(
+            config['COOKIE_NAME'], f'{time.time() + seconds:.3f}', max_age=seconds,
+            secure=request.is_secure(), httponly=True, samesite='Lax',
+        )
+        if config['PIN_CACHE']:
+            keys = client_keys(request, config)
+            keys += [f"{config['PIN_KEY_PREFIX']}user:{user_id}" for user_id in pin.users]
+            caches[config['PIN_CACHE']].set_many(dict.fromkeys(keys, 1), timeout=seconds)
+    return response
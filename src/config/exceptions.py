@@ -1,7 +1,7 @@
 from rest_framework.views import exception_handler
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.exceptions import ValidationError, AuthenticationFailed, NotAuthenticated, PermissionDenied
+from rest_framework.exceptions import ValidationError, AuthenticationFailed, NotAuthenticated, PermissionDenied, Throttled
 
 def api_exception_handler(exception, context):
     """
@@ -33,10 +33,16 @@ def api_exception_handler(exception, context):
         
         message = response.data if isinstance(response.data, str) else None
 
+        if isinstance(exception, Throttled):
+            # "Request was throttled. Expected available in N seconds."
+            code = "throttled"
+            message = str(exception.detail)
+
         data = {"ok": False, "error": {"code": code, "message": message}}
         if field_errors:
             data["error"]["field_errors"] = field_errors
-        return Response(data, status=response.status_code)
+        headers = {name: response[name] for name in ("Retry-After", "WWW-Authenticate") if response.has_header(name)}
+        return Response(data, status=response.status_code, headers=headers)
 
     # if DRF did not handle the exception, return a generic 500 error response
     return Response(
@@ -0,0 +1,96 @@
+"""
+orjson-backed JSON renderer and parser for DRF (REST_FRAMEWORK settings).
+
+FastJSONRenderer produces the same bytes as rest_framework's JSONRenderer
+with the default settings (compact separators, UTF-8 output, U+2028 / U+2029
+escaped). Types orjson does not handle the same way (dates and times, Decimal,
+lazy strings, querysets, ...) go through DRF's JSONEncoder.default, and
+anything orjson rejects (integers over 64 bits, lone surrogates, indent
+requested by the browsable API) is rendered by JSONRenderer itself. The one
+known difference: floats in exponent form are written as 1e-7, not 1e-07.
+
+FastJSONParser keeps the parsed body on the Django request as
+`parsed_json`, so RequestLogMiddleware logs it without decoding the body again.
+
+Without orjson installed both classes behave exactly like their DRF parents.
+"""
+import io
+import json
+
+from django.conf import settings
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils import encoders
+from . import tracing
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    # dates / times are left to DRF's encoder, it writes UTC as "Z"
+    DUMPS_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+_encoder_default = encoders.JSONEncoder().default
+
+
+def loads(data):
+    """bytes / str -> object, orjson when installed."""
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass  # e.g. integers over 64 bits, which json accepts
+    return json.loads(data)
+
+
+class FastJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with tracing.span('json.render'):
+            return self._render(data, accepted_media_type, renderer_context)
+
+    def _render(self, data, accepted_media_type, renderer_context):
+        if data is None:
+            return b''
+        if (
+            orjson is None or self.ensure_ascii or not self.compact
+            or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=_encoder_default, option=DUMPS_OPTIONS)
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # same strict javascript subset as JSONRenderer
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+class FastJSONParser(JSONParser):
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        with tracing.span('json.parse'):
+            return self._parse(stream, media_type, parser_context)
+
+    def _parse(self, stream, media_type, parser_context):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or not self.strict or encoding.lower().replace('-', '') != 'utf8':
+            data = super().parse(stream, media_type, parser_context)
+        else:
+            body = stream.read()
+            try:
+                data = orjson.loads(body)
+            except orjson.JSONDecodeError:
+                # same result, or the same ParseError, as JSONParser
+                data = super().parse(io.BytesIO(body), media_type, parser_context)
+
+        request = parser_context.get('request')
+        # DRF passes its Request, the async views the HttpRequest itself
+        request = getattr(request, '_request', request)
+        if request is not None:
+            request.parsed_json = data
+        return data
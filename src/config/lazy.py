@@ -0,0 +1,43 @@
+"""
+URL entries whose views are imported on first use, not when the URLconf loads.
+
+Workers that only serve /v1/ never pay for importing the admin site or the
+drf-spectacular documentation views.
+"""
+import threading
+
+from django.urls import URLResolver
+from django.urls.resolvers import RoutePattern
+from django.utils.module_loading import import_string
+
+
+class LazyView:
+    """A view given as an import path; imported (and as_view()'d) on the first request."""
+
+    def __init__(self, import_path, **initkwargs):
+        self.import_path = import_path
+        self.initkwargs = initkwargs
+        self._view = None
+        self._lock = threading.Lock()
+
+    def resolve(self):
+        if self._view is None:
+            with self._lock:
+                if self._view is None:
+                    view = import_string(self.import_path)
+                    if hasattr(view, 'as_view'):
+                        view = view.as_view(**self.initkwargs)
+                    self._view = view
+        return self._view
+
+    def __call__(self, request, *args, **kwargs):
+        return self.resolve()(request, *args, **kwargs)
+
+
+def lazy_include(route, urlconf_module, app_name=None, namespace=None):
+    """
+    Like path(route, include(urlconf_module)), but the module is imported when
+    a URL under `route` is first resolved (or reversed), not when the URLconf loads.
+    """
+    return URLResolver(RoutePattern(route, is_endpoint=False), urlconf_module,
+                       app_name=app_name, namespace=namespace or app_name)
@@ -0,0 +1,320 @@
+"""
+In-process metrics with a Prometheus text exposition view.
+
+Each worker process keeps its own counters and histograms in memory. Updating
+them is a dict update under a short lock. With METRICS['MULTIPROCESS_DIR'] set,
+a daemon thread writes a snapshot of the process to <dir>/metrics-<pid>.json
+every FLUSH_INTERVAL seconds, and /metrics sums the snapshots of all processes.
+Counters of exited workers stay in the sum, so totals never go backwards:
+their snapshots are folded into one metrics-exited.json.
+
+/metrics answers scrapers from ALLOWED_NETWORKS (the peer address, not
+X-Forwarded-For, which clients can set) or with `Authorization: Bearer
+<TOKEN>`; anyone else gets a 403.
+"""
+import contextvars
+import fcntl
+import glob
+import hmac
+import ipaddress
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseForbidden
+
+DEFAULTS = {
+    'ENABLED': True,
+    'MULTIPROCESS_DIR': None,
+    'FLUSH_INTERVAL': 5,
+    'ALLOWED_NETWORKS': ['127.0.0.1/32', '::1/128'],
+    'TOKEN': None,
+}
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LAYER_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025)
+HASH_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.2, 0.4, 0.8, 1.6, 3.2)
+
+METRICS = {
+    # name: (type, help, buckets)
+    'artq_http_requests_total': ('counter', 'HTTP requests by route, method and status class.', None),
+    'artq_http_request_duration_seconds': ('histogram', 'HTTP request latency.', LATENCY_BUCKETS),
+    'artq_db_queries_total': ('counter', 'Database queries issued while serving requests.', None),
+    'artq_db_query_duration_seconds_total': ('counter', 'Time spent in database queries while serving requests.', None),
+    'artq_password_hash_duration_seconds': ('histogram', 'Password hashing time (make / verify).', HASH_BUCKETS),
+    'artq_throttled_total': ('counter', 'Requests rejected by a token-bucket throttle, by scope.', None),
+    'artq_refresh_reuse_total': ('counter', 'Rotated refresh tokens presented again (family revoked).', None),
+    'artq_middleware_duration_seconds': ('histogram', 'Time spent in each middleware layer (MIDDLEWARE_TIMING only).', LAYER_BUCKETS),
+    'artq_trace_spans_dropped_total': ('counter', 'Spans not recorded because their trace hit TRACING MAX_SPANS.', None),
+    'artq_otp_checks_total': ('counter', 'Verification code checks by channel and result.', None),
+}
+
+# per-request query accounting, shared with sync_to_async threads through the context
+current_request = contextvars.ContextVar('metrics_current_request', default=None)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'METRICS', {})}
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}    # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [bucket counts..., +Inf count, sum]
+        self.collectors = []
+
+    def inc(self, name, labels, value=1):
+        key = (name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        key = (name, labels)
+        with self._lock:
+            series = self.histograms.get(key)
+            if series is None:
+                series = self.histograms[key] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            else:
+                series[len(buckets)] += 1
+            series[-1] += value
+
+    def register_collector(self, fn, help_texts):
+        """
+        fn() -> {(name, labels): value} of cumulative per-process counters,
+        read when a snapshot is taken. help_texts: {name: help}.
+        """
+        for name, text in help_texts.items():
+            METRICS.setdefault(name, ('counter', text, None))
+        self.collectors.append(fn)
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = {key: list(series) for key, series in self.histograms.items()}
+        for fn in self.collectors:
+            try:
+                counters.update(fn())
+            except Exception:
+                pass
+        return {
+            'counters': [[name, list(labels), value] for (name, labels), value in counters.items()],
+            'histograms': [[name, list(labels), series] for (name, labels), series in histograms.items()],
+        }
+
+
+registry = Registry()
+
+
+def _merge(snapshots):
+    counters, histograms = {}, {}
+    for snap in snapshots:
+        for name, labels, value in snap['counters']:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, series in snap['histograms']:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            merged = histograms.setdefault(key, [0] * len(series))
+            for i, v in enumerate(series):
+                merged[i] += v
+    return counters, histograms
+
+
+def _label_text(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    body = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs)
+    return '{' + body + '}'
+
+
+def render(snapshots):
+    counters, histograms = _merge(snapshots)
+    lines = []
+    for name, (kind, text, buckets) in METRICS.items():
+        series = [(k, v) for k, v in counters.items() if k[0] == name] if kind == 'counter' else \
+                 [(k, v) for k, v in histograms.items() if k[0] == name]
+        if not series:
+            continue
+        lines.append(f'# HELP {name} {text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for (_, labels), value in sorted(series):
+            if kind == 'counter':
+                lines.append(f'{name}{_label_text(labels)} {value}')
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets, value):
+                cumulative += count
+                lines.append(f'{name}_bucket{_label_text(labels, [("le", bound)])} {cumulative}')
+            cumulative += value[len(buckets)]
+            lines.append(f'{name}_bucket{_label_text(labels, [("le", "+Inf")])} {cumulative}')
+            lines.append(f'{name}_sum{_label_text(labels)} {value[-1]}')
+            lines.append(f'{name}_count{_label_text(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+# -- multi-process snapshots ------------------------------------------------
+
+def _snapshot_path(directory, pid):
+    return os.path.join(directory, f'metrics-{pid}.json')
+
+
+def write_snapshot(directory):
+    os.makedirs(directory, exist_ok=True)
+    path = _snapshot_path(directory, os.getpid())
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(registry.snapshot(), f)
+    os.replace(tmp, path)
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def compact_snapshots(directory):
+    """
+    Fold the snapshots of processes that have exited into metrics-exited.json
+    and delete them, so recycled workers don't leave a file each behind.
+    Counters and histograms only ever add up, so the sum is unchanged.
+    """
+    dead = []
+    for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+        pid = os.path.basename(path)[len('metrics-'):-len('.json')]
+        if pid.isdigit() and not _alive(int(pid)):
+            dead.append(path)
+    if not dead:
+        return
+    # one process at a time, or two scrapes would both add the same file
+    with open(os.path.join(directory, '.compact.lock'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        dead = [path for path in dead if os.path.exists(path)]
+        exited_path = _snapshot_path(directory, 'exited')
+        snapshots = [snap for snap in map(_read, [exited_path, *dead]) if snap is not None]
+        counters, histograms = _merge(snapshots)
+        tmp = exited_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({
+                'counters': [[name, list(labels), value] for (name, labels), value in counters.items()],
+                'histograms': [[name, list(labels), series] for (name, labels), series in histograms.items()],
+            }, f)
+        os.replace(tmp, exited_path)
+        for path in dead:
+            os.remove(path)
+
+
+def read_snapshots(directory):
+    compact_snapshots(directory)
+    snapshots = []
+    own = _snapshot_path(directory, os.getpid())
+    for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+        if path == own:
+            continue  # use the live registry for this process
+        snapshot = _read(path)
+        if snapshot is not None:
+            snapshots.append(snapshot)
+    snapshots.append(registry.snapshot())
+    return snapshots
+
+
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+
+def ensure_flusher():
+    """Start the snapshot thread of this process (once per pid)."""
+    global _flusher_pid
+    config = get_config()
+    directory = config['MULTIPROCESS_DIR']
+    if not directory or _flusher_pid == os.getpid():
+        return
+    with _flusher_lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+
+        def run():
+            while True:
+                time.sleep(config['FLUSH_INTERVAL'])
+                try:
+                    write_snapshot(directory)
+                except OSError:
+                    pass
+
+        threading.Thread(target=run, name='metrics-flusher', daemon=True).start()
+
+
+def scrape_allowed(request, config):
+    scheme, _, credentials = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    if config['TOKEN'] and scheme.lower() == 'bearer':
+        return hmac.compare_digest(credentials.encode(), str(config['TOKEN']).encode())
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network, strict=False) for network in config['ALLOWED_NETWORKS'])
+
+
+def metrics_view(request):
+    config = get_config()
+    if not scrape_allowed(request, config):
+        return HttpResponseForbidden()
+    directory = config['MULTIPROCESS_DIR']
+    snapshots = read_snapshots(directory) if directory else [registry.snapshot()]
+    return HttpResponse(render(snapshots), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# -- database query accounting ----------------------------------------------
+
+class RequestStats:
+    __slots__ = ('queries', 'query_time')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+
+
+def _count_query(execute, sql, params, many, context):
+    stats = current_request.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.query_time += time.perf_counter() - start
+
+
+@receiver(connection_created)
+def _install_query_counter(sender, connection, **kwargs):
+    # first in the list: execute_wrapper() context managers pop() from the end
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _count_query)
+
+
+def observe_password_hash(op, seconds):
+    registry.observe('artq_password_hash_duration_seconds', (('op', op),), seconds)
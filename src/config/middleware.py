@@ -1,55 +1,354 @@
-import time, json, logging
+import time, random
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.handlers.exception import convert_exception_to_response
 from django.utils.deprecation import MiddlewareMixin
+from django.utils.module_loading import import_string
+from . import metrics, tracing
+from .warmup import is_warmup
+from .db import routers
+from .request_log import get_config, get_writer
+
+
+def client_ip(request):
+    # first X-Forwarded-For hop, as set by the proxy in front of the app.
+    # clients can send their own header, so only trust this behind a proxy that overwrites it
+    xff = request.META.get("HTTP_X_FORWARDED_FOR")
+    if xff:
+        return xff.split(",")[0].strip()
+    return request.META.get("REMOTE_ADDR")
 
-log = logging.getLogger("request")
 
 class RequestLogMiddleware(MiddlewareMixin):
     """
     request/response logging + handling duration (ms)
-    sensitive data (password, token etc) are masked
+    records are written by the background writer in config.request_log,
+    sensitive data (password, token etc) are masked there
     """
-    SENSITIVE_KEYS = {"password", "refresh", "access"}
+    BODY_METHODS = ("POST", "PUT", "PATCH")
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.config = get_config()
+        # longest prefix first, so "/v1/auth/verify/" wins over "/v1/"
+        self.sample_rates = sorted(self.config["SAMPLE_RATES"].items(), key=lambda item: -len(item[0]))
 
     def process_request(self, request):
         request._start_time = time.perf_counter()
+        if not self.config["ENABLED"] or is_warmup(request):
+            return
+        request._log_sampled = self._sampled(request.path)
+
+        # read small JSON bodies now, so they are still available after the
+        # view (DRF consumes the raw stream otherwise)
+        if request._log_sampled and request.method in self.BODY_METHODS and request.content_type == "application/json":
+            try:
+                length = int(request.META.get("CONTENT_LENGTH") or 0)
+            except ValueError:
+                length = 0
+            if 0 < length <= self.config["MAX_BODY_BYTES"]:
+                try:
+                    request.body
+                except Exception:
+                    pass
 
     def process_response(self, request, response):
         try:
+            if not self.config["ENABLED"] or is_warmup(request):
+                return response
+            # errors are always kept, sampling only thins out successful requests
+            if response.status_code < 400 and not getattr(request, "_log_sampled", True):
+                return response
+
             duration_ms = None
             if hasattr(request, "_start_time"):
                 duration_ms = int((time.perf_counter() - request._start_time) * 1000)
 
-            meta = {
+            user_id = getattr(getattr(request, "user", None), "id", None)
+            record = {
+                "ts": time.time(),
                 "method": request.method,
                 "path": request.path,
                 "status": response.status_code,
                 "duration_ms": duration_ms,
-                "user": getattr(getattr(request, "user", None), "id", None),
-                "ip": self._client_ip(request),
+                "user": str(user_id) if user_id is not None else None,
+                "ip": client_ip(request),
             }
+            trace_id = getattr(request, "trace_id", None)
+            if trace_id:
+                record["trace_id"] = trace_id
+            raw_body = getattr(request, "_body", None)
+            if raw_body and len(raw_body) <= self.config["MAX_BODY_BYTES"]:
+                if hasattr(request, "parsed_json"):
+                    # the view's parser already decoded it
+                    record["parsed_body"] = request.parsed_json
+                else:
+                    record["raw_body"] = raw_body
 
-            # request body (JSON only, masking sensitive data)
-            if request.method in ("POST", "PUT", "PATCH"):
-                try:
-                    body = request.body.decode("utf-8")
-                    if body and body.strip().startswith("{"):
-                        data = json.loads(body)
-                        for k in list(data.keys()):
-                            if k.lower() in self.SENSITIVE_KEYS:
-                                data[k] = "***"
-                        meta["body"] = data
-                except Exception:
-                    pass
-
-            log.info(meta)
+            get_writer().submit(record)
         except Exception:
             # make error in logging not affect the main response flow
             pass
         return response
 
+    def _sampled(self, path):
+        for prefix, rate in self.sample_rates:
+            if path.startswith(prefix):
+                return rate >= 1 or random.random() < rate
+        return True
+
+
+class MetricsMiddleware:
+    """
+    per-route request count / latency histogram and DB query count / time,
+    see config.metrics. Should be first in MIDDLEWARE so the timing covers
+    the whole stack. Runs natively in both sync and async mode.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = metrics.get_config()["ENABLED"]
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.enabled or is_warmup(request):
+            return self.get_response(request)
+        stats = metrics.RequestStats()
+        token = metrics.current_request.set(stats)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.current_request.reset(token)
+        self._record(request, response, time.perf_counter() - start, stats)
+        return response
+
+    async def __acall__(self, request):
+        if not self.enabled or is_warmup(request):
+            return await self.get_response(request)
+        stats = metrics.RequestStats()
+        token = metrics.current_request.set(stats)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.current_request.reset(token)
+        self._record(request, response, time.perf_counter() - start, stats)
+        return response
+
+    @staticmethod
+    def _record(request, response, seconds, stats):
+        # cheap pid check; workers forked after startup start their own flusher
+        metrics.ensure_flusher()
+        match = getattr(request, "resolver_match", None)
+        route = (match.url_name or match.view_name) if match else "unmatched"
+        status_class = f"{response.status_code // 100}xx"
+        registry = metrics.registry
+        registry.inc("artq_http_requests_total", (("route", route), ("method", request.method), ("status", status_class)))
+        registry.observe("artq_http_request_duration_seconds", (("route", route), ("status", status_class)), seconds)
+        if stats.queries:
+            registry.inc("artq_db_queries_total", (("route", route),), stats.queries)
+            registry.inc("artq_db_query_duration_seconds_total", (("route", route),), stats.query_time)
+
+
+class TracingMiddleware:
+    """
+    Root span of a request for config.tracing (TRACING['ENABLED']); the spans
+    opened while handling it become its children. Place right after
+    MetricsMiddleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.config = tracing.get_config()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        root = tracing.start_request(request, self.config) if self.config["ENABLED"] and not is_warmup(request) else None
+        if root is None:
+            return self.get_response(request)
+        with root:
+            response = self.get_response(request)
+        tracing.finish_request(root, request, response)
+        return response
+
+    async def __acall__(self, request):
+        root = tracing.start_request(request, self.config) if self.config["ENABLED"] and not is_warmup(request) else None
+        if root is None:
+            return await self.get_response(request)
+        with root:
+            response = await self.get_response(request)
+        tracing.finish_request(root, request, response)
+        return response
+
+
+class DatabasePinMiddleware:
+    """
+    Read-your-writes for config.db.routers.ReplicaRouter: routing state per
+    request, and the pin cookie after a write. A pass-through without replicas.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.config = routers.get_config()
+        self.enabled = bool(self.config["REPLICAS"])
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+        pin = routers.start_request(request, self.config)
+        token = routers.current_pin.set(pin)
+        try:
+            response = self.get_response(request)
+        finally:
+            routers.current_pin.reset(token)
+        return routers.finish_request(pin, request, response, self.config)
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+        pin = routers.start_request(request, self.config)
+        token = routers.current_pin.set(pin)
+        try:
+            response = await self.get_response(request)
+        finally:
+            routers.current_pin.reset(token)
+        return routers.finish_request(pin, request, response, self.config)
+
+
+class BrowserMiddleware:
+    """
+    Runs BROWSER_MIDDLEWARE['MIDDLEWARE'] (session, CSRF, auth, messages,
+    X-Frame-Options) for every path except API_PREFIXES. The JWT-only /v1/
+    routes use none of them, so their requests go straight to the next layer;
+    the admin keeps the full stack. The inner middleware's process_view hooks
+    (CsrfViewMiddleware's check) are called from here for the same paths.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        config = settings.BROWSER_MIDDLEWARE
+        self.api_prefixes = tuple(config["API_PREFIXES"])
+        handler = get_response
+        view_hooks = []
+        for path in reversed(config["MIDDLEWARE"]):
+            instance = import_string(path)(handler)
+            if hasattr(instance, "process_view"):
+                view_hooks.insert(0, instance.process_view)
+            handler = convert_exception_to_response(instance)
+            if settings.MIDDLEWARE_TIMING:
+                handler = convert_exception_to_response(LayerTimingMiddleware(handler))
+        self.browser_chain = handler
+        self.view_hooks = view_hooks
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def is_api(self, request):
+        return request.path_info.startswith(self.api_prefixes)
+
+    def __call__(self, request):
+        # in async mode both chains return coroutines
+        if self.is_api(request):
+            return self.get_response(request)
+        return self.browser_chain(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if self.is_api(request):
+            return None
+        for hook in self.view_hooks:
+            response = hook(request, view_func, view_args, view_kwargs)
+            if response is not None:
+                return response
+        return None
+
+
+class LayerTimingMiddleware:
+    """
+    Debug instrumentation (MIDDLEWARE_TIMING=1): settings put one of these
+    around every middleware. Each marks when the request passes it on the way
+    in and out; the outermost one turns the marks into per-layer time (the
+    layer's own code, not what it wraps) and reports it in a Server-Timing
+    header and the artq_middleware_duration_seconds histogram.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # convert_exception_to_response() keeps the wrapped middleware as __wrapped__
+        inner = getattr(get_response, "__wrapped__", get_response)
+        if hasattr(inner, "__self__"):
+            self.layer = "view"  # BaseHandler._get_response: URL resolving, view, rendering
+        else:
+            self.layer = type(inner).__name__
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        marks, outermost = self._enter(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            marks.append((None, time.perf_counter()))
+        return self._report(request, response, marks) if outermost else response
+
+    async def __acall__(self, request):
+        marks, outermost = self._enter(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            marks.append((None, time.perf_counter()))
+        return self._report(request, response, marks) if outermost else response
+
+    def _enter(self, request):
+        marks = getattr(request, "_layer_marks", None)
+        outermost = marks is None
+        if outermost:
+            marks = request._layer_marks = []
+        marks.append((self.layer, time.perf_counter()))
+        return marks, outermost
+
     @staticmethod
-    def _client_ip(request):
-        xff = request.META.get("HTTP_X_FORWARDED_FOR")
-        if xff:
-            return xff.split(",")[0].strip()
-        return request.META.get("REMOTE_ADDR")
\ No newline at end of file
+    def layer_times(marks):
+        """[(layer, seconds)] from the entry marks (layer, t) and exit marks (None, t)."""
+        entries = [t for layer, t in marks if layer is not None]
+        layers = [layer for layer, t in marks if layer is not None]
+        exits = [t for layer, t in marks if layer is None][::-1]  # outermost first
+        times = []
+        for i, layer in enumerate(layers):
+            inner_in = entries[i + 1] if i + 1 < len(entries) else None
+            if inner_in is None:
+                # innermost, or the layer answered without calling the next one
+                seconds = exits[i] - entries[i]
+            else:
+                seconds = (inner_in - entries[i]) + (exits[i] - exits[i + 1])
+            times.append((layer, seconds))
+        return times
+
+    def _report(self, request, response, marks):
+        parts = []
+        for layer, seconds in self.layer_times(marks):
+            metrics.registry.observe("artq_middleware_duration_seconds", (("layer", layer),), seconds)
+            parts.append(f"{layer};dur={seconds * 1000:.3f}")
+        response.headers["Server-Timing"] = ", ".join(parts)
+        return response
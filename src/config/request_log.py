@@ -0,0 +1,217 @@
+"""
+Background writer for request log records.
+
+RequestLogMiddleware only builds a small dict and hands it to `submit()`.
+Decoding / masking request bodies, JSON encoding and file I/O all happen on
+one daemon thread that drains the queue in batches into a buffered,
+size-rotated JSON-lines file. When the queue is full the record is dropped
+and counted; the request never waits on logging.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+from . import fastjson
+from .metrics import registry
+
+log = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    'PATH': 'requests.jsonl',   # may contain {pid} for one file per worker process
+    'MAX_BYTES': 50 * 1024 * 1024,
+    'BACKUP_COUNT': 5,
+    'QUEUE_SIZE': 10000,
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': 1.0,
+    'MAX_BODY_BYTES': 4096,
+    'SAMPLE_RATES': {},         # path prefix -> fraction of 2xx/3xx requests kept
+}
+
+SENSITIVE_KEYS = {"password", "refresh", "access", "token", "code"}
+
+_STOP = object()
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'REQUEST_LOG', {})}
+
+
+def mask(data):
+    """Copy of a decoded body with sensitive keys masked, in nested objects and lists too."""
+    if isinstance(data, dict):
+        return {
+            k: "***" if isinstance(k, str) and k.lower() in SENSITIVE_KEYS else mask(v)
+            for k, v in data.items()
+        }
+    if isinstance(data, list):
+        return [mask(item) for item in data]
+    return data
+
+
+def mask_body(raw):
+    """Decode a captured JSON body and mask sensitive keys."""
+    try:
+        return mask(fastjson.loads(raw))
+    except ValueError:
+        return None
+
+
+class RotatingJsonLinesFile:
+    def __init__(self, path, max_bytes, backup_count):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._file = None
+        self._size = 0
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, 'a', encoding='utf-8', buffering=1 << 16)
+        self._size = self._file.tell()
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._open()
+
+    def write_lines(self, lines):
+        if self._file is None:
+            self._open()
+        chunk = "".join(lines)
+        self._file.write(chunk)
+        self._file.flush()
+        self._size += len(chunk.encode("utf-8"))  # bytes, like max_bytes and tell()
+        if self.max_bytes and self._size >= self.max_bytes:
+            self._rotate()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class RequestLogWriter:
+    thread_name = 'request-log-writer'
+
+    def __init__(self, config):
+        self.config = config
+        self.queue = queue.Queue(maxsize=config['QUEUE_SIZE'])
+        self.file = RotatingJsonLinesFile(
+            str(config['PATH']).format(pid=os.getpid()),
+            config['MAX_BYTES'],
+            config['BACKUP_COUNT'],
+        )
+        self.submitted = 0
+        self.dropped = 0
+        self._drop_lock = threading.Lock()
+        self.written = 0
+        self.pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+        self._thread.start()
+
+    def submit(self, record):
+        try:
+            self.queue.put_nowait(record)
+            self.submitted += 1
+        except queue.Full:
+            with self._drop_lock:
+                self.dropped += 1
+
+    def _run(self):
+        batch_size = self.config['BATCH_SIZE']
+        interval = self.config['FLUSH_INTERVAL']
+        while True:
+            try:
+                first = self.queue.get(timeout=interval)
+            except queue.Empty:
+                continue
+            batch = [first]
+            while len(batch) < batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = any(record is _STOP for record in batch)
+            self._write([record for record in batch if record is not _STOP])
+            if stop:
+                self.file.close()
+                return
+
+    def _write(self, batch):
+        lines = []
+        for record in batch:
+            raw_body = record.pop('raw_body', None)
+            if 'parsed_body' in record:
+                # decoded once already, by config.fastjson.FastJSONParser
+                record['body'] = mask(record.pop('parsed_body'))
+            elif raw_body:
+                body = mask_body(raw_body)
+                if body is not None:
+                    record['body'] = body
+            lines.append(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        try:
+            self.file.write_lines(lines)
+            self.written += len(lines)
+        except OSError:
+            log.exception("request log write failed, %d records lost", len(lines))
+
+    def close(self, timeout=5):
+        try:
+            self.queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def stats(self):
+        return {
+            'submitted': self.submitted,
+            'written': self.written,
+            'dropped': self.dropped,
+            'queued': self.queue.qsize(),
+        }
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """Process-wide writer, started on first use (and again after fork)."""
+    global _writer
+    if _writer is None or _writer.pid != os.getpid():
+        with _writer_lock:
+            if _writer is None or _writer.pid != os.getpid():
+                _writer = RequestLogWriter(get_config())
+                atexit.register(_writer.close)
+    return _writer
+
+
+def _collect_metrics():
+    writer = _writer
+    if writer is None or writer.pid != os.getpid():
+        return {}
+    return {
+        ('artq_request_log_written_total', ()): writer.written,
+        ('artq_request_log_dropped_total', ()): writer.dropped,
+    }
+
+
+registry.register_collector(_collect_metrics, {
+    'artq_request_log_written_total': 'Request log records written.',
+    'artq_request_log_dropped_total': 'Request log records dropped because the queue was full.',
+})
@@ -0,0 +1,260 @@
+"""
+Precomputed OpenAPI schema.
+
+SpectacularAPIView introspects every view and serializer on each request.
+Here the schema is generated once per code version, rendered to YAML and
+JSON, compressed (gzip, and br when the brotli package is installed) and
+kept in memory. Every variant carries a strong ETag, so /docs/ and /redoc/
+reloads are answered with 304.
+
+The schema comes from, in order: memory, the files written by
+`manage.py build_schema` into SCHEMA_CACHE['DIR'] for the current version,
+or a generation on the first request. The version is SCHEMA_CACHE['VERSION']
+(CODE_VERSION in the environment, e.g. the image's git sha) or, when unset,
+a hash of the modules of the project's installed apps and of the URLconf
+package (not their tests, migrations or management commands, nor anything
+else under BASE_DIR) and the installed schema libraries. Set it in
+production, the hash reads those files on the first schema request.
+"""
+import gzip
+import hashlib
+import os
+import threading
+from pathlib import Path
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseNotModified
+from django.views.decorators.http import require_GET
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DEFAULTS = {
+    'VERSION': None,
+    'DIR': None,
+}
+
+FORMATS = {
+    # format: content type
+    'yaml': 'application/vnd.oai.openapi; charset=utf-8',
+    'json': 'application/vnd.oai.openapi+json; charset=utf-8',
+}
+
+# dependencies whose upgrades change the generated schema
+PACKAGES = ('django', 'djangorestframework', 'djangorestframework-simplejwt', 'drf-spectacular')
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'SCHEMA_CACHE', {})}
+
+
+SKIPPED_SOURCES = ('tests', 'tests.py', 'migrations', 'management')
+
+
+def _source_files():
+    """The .py files of the project's own apps and URLconf package, which the schema comes from."""
+    from importlib import import_module
+    from django.apps import apps
+
+    base = Path(settings.BASE_DIR).resolve()
+    roots = {Path(app.path).resolve() for app in apps.get_app_configs()}
+    roots.add(Path(import_module(settings.ROOT_URLCONF).__file__).resolve().parent)
+    files = set()
+    for root in roots:
+        if not root.is_relative_to(base):
+            continue  # installed packages are covered by PACKAGES
+        for path in root.rglob('*.py'):
+            if not any(part in SKIPPED_SOURCES for part in path.relative_to(root).parts):
+                files.add(path)
+    return sorted(files)
+
+
+def code_version():
+    from importlib import metadata
+
+    config = get_config()
+    if config['VERSION']:
+        return str(config['VERSION'])
+    base = Path(settings.BASE_DIR).resolve()
+    digest = hashlib.sha256()
+    for path in _source_files():
+        digest.update(str(path.relative_to(base)).encode())
+        digest.update(path.read_bytes())
+    for package in PACKAGES:
+        try:
+            digest.update(f'{package}=={metadata.version(package)}'.encode())
+        except metadata.PackageNotFoundError:
+            pass
+    return digest.hexdigest()[:16]
+
+
+def schema_key():
+    # both view modes have the same schema, the async views are documented by their sync ones
+    return code_version()
+
+
+def generate():
+    """Render the schema: {format: bytes}."""
+    from drf_spectacular.renderers import OpenApiJsonRenderer, OpenApiYamlRenderer
+    from apps.accounts.schema import SchemaGenerator  # also registers the simplejwt subclass extensions
+
+    schema = SchemaGenerator().get_schema(request=None, public=True)
+    return {
+        'yaml': OpenApiYamlRenderer().render(schema, renderer_context={}),
+        'json': OpenApiJsonRenderer().render(schema, renderer_context={}),
+    }
+
+
+class Variant:
+    __slots__ = ('body', 'etag', 'encoding')
+
+    def __init__(self, body, etag, encoding=None):
+        self.body = body
+        self.etag = etag
+        self.encoding = encoding
+
+
+def compress(body):
+    """{encoding: bytes} for every encoding that is worth serving."""
+    out = {'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        out['br'] = brotli.compress(body, quality=11)
+    return out
+
+
+def _variant_set(body, compressed=None):
+    """{encoding or None: Variant} for one rendered format."""
+    tag = hashlib.sha256(body).hexdigest()[:32]
+    out = {None: Variant(body, f'"{tag}"')}
+    for encoding, data in (compressed or compress(body)).items():
+        # a strong ETag identifies the exact bytes, so each encoding gets its own
+        out[encoding] = Variant(data, f'"{tag}-{encoding}"', encoding)
+    return out
+
+
+def build_variants(rendered):
+    """{format: bytes} -> {format: {encoding or None: Variant}}."""
+    return {fmt: _variant_set(body) for fmt, body in rendered.items()}
+
+
+SUFFIXES = {None: '', 'gzip': '.gz', 'br': '.br'}
+
+
+def _file(directory, key, fmt, encoding=None):
+    return Path(directory) / f'schema-{key}.{fmt}{SUFFIXES[encoding]}'
+
+
+def write_files(directory, key, variants):
+    os.makedirs(directory, exist_ok=True)
+    for fmt, by_encoding in variants.items():
+        for encoding, variant in by_encoding.items():
+            path = _file(directory, key, fmt, encoding)
+            tmp = path.with_name(path.name + '.tmp')
+            tmp.write_bytes(variant.body)
+            os.replace(tmp, path)
+
+
+def read_files(directory, key):
+    """Variants written by build_schema for this key, or None."""
+    variants = {}
+    for fmt in FORMATS:
+        path = _file(directory, key, fmt)
+        if not path.exists():
+            return None
+        compressed = {
+            encoding: _file(directory, key, fmt, encoding).read_bytes()
+            for encoding in ('gzip', 'br')
+            if _file(directory, key, fmt, encoding).exists()
+        }
+        variants[fmt] = _variant_set(path.read_bytes(), compressed or None)
+    return variants
+
+
+_variants = None
+_lock = threading.Lock()
+
+
+def get_variants():
+    global _variants
+    if _variants is not None:
+        return _variants
+    with _lock:
+        if _variants is None:
+            directory = get_config()['DIR']
+            variants = read_files(directory, schema_key()) if directory else None
+            _variants = variants or build_variants(generate())
+    return _variants
+
+
+def warm():
+    """Load or generate the schema ahead of the first request."""
+    get_variants()
+
+
+def reset():
+    global _variants
+    with _lock:
+        _variants = None
+
+
+@receiver(setting_changed)
+def _reset_on_setting_change(*, setting, **kwargs):
+    if setting in ('SCHEMA_CACHE', 'SPECTACULAR_SETTINGS', 'AUTH_VIEW_MODE', 'ROOT_URLCONF'):
+        reset()
+
+
+def _negotiate_format(request):
+    fmt = request.GET.get('format')
+    if fmt in FORMATS:
+        return fmt
+    accept = request.headers.get('Accept', '')
+    return 'json' if 'json' in accept else 'yaml'
+
+
+def _negotiate_encoding(request, by_encoding):
+    accepted = {
+        part.split(';', 1)[0].strip()
+        for part in request.headers.get('Accept-Encoding', '').split(',')
+        if not part.strip().endswith(';q=0')
+    }
+    for encoding in ('br', 'gzip'):
+        if encoding in accepted and encoding in by_encoding:
+            return by_encoding[encoding]
+    return by_encoding[None]
+
+
+def _etag_matches(request, etag):
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    # If-None-Match uses the weak comparison
+    candidates = {tag.strip().removeprefix('W/') for tag in header.split(',')}
+    return etag in candidates
+
+
+@require_GET
+def schema_view(request):
+    fmt = _negotiate_format(request)
+    variant = _negotiate_encoding(request, get_variants()[fmt])
+
+    headers = {
+        'ETag': variant.etag,
+        'Vary': 'Accept, Accept-Encoding',
+        'Cache-Control': 'no-cache',  # always revalidate, the 304 is cheap
+    }
+    if _etag_matches(request, variant.etag):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(variant.body, content_type=FORMATS[fmt])
+        if variant.encoding:
+            response['Content-Encoding'] = variant.encoding
+        response['Content-Disposition'] = f'inline; filename="schema.{fmt}"'
+    for name, value in headers.items():
+        response[name] = value
+    return response
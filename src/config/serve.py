@@ -0,0 +1,175 @@
+"""
+Production server for `manage.py serve`: gunicorn prefork workers running the
+WSGI handler (sync / gthread workers) or the ASGI one (uvicorn workers).
+
+The master process builds the handler and runs config.warmup.warm() before
+forking (preload_app), so every worker starts from an image that has the
+URLconf, views, serializers, hashers and token backend loaded. Each worker
+then runs warm_worker() (the database-backed indexes) before taking requests.
+After MAX_REQUESTS (+ up to MAX_REQUESTS_JITTER, so workers don't restart
+together) a worker finishes its requests and is replaced by a fresh fork of
+the warm master. configure_workers() gives every worker its own request log
+and trace file and a shared metrics snapshot directory.
+
+gunicorn, and uvicorn for MODE=asgi, are only needed here; the rest of the
+project runs without them.
+"""
+import logging
+import multiprocessing
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+log = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'MODE': 'wsgi',             # wsgi or asgi
+    'BIND': '0.0.0.0:8000',
+    'WORKERS': 0,               # 0: 2 * CPUs + 1
+    'THREADS': 1,               # per wsgi worker; above 1 uses the gthread worker
+    'MAX_REQUESTS': 10000,      # 0 never recycles
+    'MAX_REQUESTS_JITTER': 1000,
+    'TIMEOUT': 30,
+    'GRACEFUL_TIMEOUT': 30,
+    'KEEPALIVE': 5,
+    'WARMUP': True,
+    'ACCESS_LOG': False,        # the request log (config.request_log) covers requests
+}
+
+MODES = ('wsgi', 'asgi')
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'SERVE', {})}
+
+
+def worker_class(config):
+    if config['MODE'] == 'asgi':
+        return 'uvicorn.workers.UvicornWorker'
+    return 'gthread' if config['THREADS'] > 1 else 'sync'
+
+
+def gunicorn_options(config):
+    """gunicorn settings for `config`."""
+    return {
+        'bind': [config['BIND']],
+        'workers': config['WORKERS'] or multiprocessing.cpu_count() * 2 + 1,
+        'threads': config['THREADS'],
+        'worker_class': worker_class(config),
+        'max_requests': config['MAX_REQUESTS'],
+        'max_requests_jitter': config['MAX_REQUESTS_JITTER'],
+        'timeout': config['TIMEOUT'],
+        'graceful_timeout': config['GRACEFUL_TIMEOUT'],
+        'keepalive': config['KEEPALIVE'],
+        'preload_app': True,
+        'accesslog': '-' if config['ACCESS_LOG'] else None,
+        'post_worker_init': post_worker_init if config['WARMUP'] else None,
+        'worker_exit': worker_exit,
+        'child_exit': child_exit,
+    }
+
+
+def _pid_path(path):
+    """requests.jsonl -> requests-{pid}.jsonl, unless the path has {pid} already."""
+    path = str(path)
+    if '{pid}' in path:
+        return path
+    root, ext = os.path.splitext(path)
+    return f'{root}-{{pid}}{ext}'
+
+
+def configure_workers():
+    """
+    Settings the forked workers need: a request log and a trace file per
+    process (two writers rotating one file lose lines), and a metrics
+    snapshot directory so /metrics adds up every worker. A METRICS
+    MULTIPROCESS_DIR set explicitly is kept; otherwise each run gets a new one.
+    """
+    for name in ('REQUEST_LOG', 'TRACING'):
+        value = getattr(settings, name, {})
+        if 'PATH' in value:
+            setattr(settings, name, {**value, 'PATH': _pid_path(value['PATH'])})
+    if not getattr(settings, 'METRICS', {}).get('MULTIPROCESS_DIR'):
+        directory = tempfile.mkdtemp(prefix='artq-metrics-')
+        settings.METRICS = {**getattr(settings, 'METRICS', {}), 'MULTIPROCESS_DIR': directory}
+    return settings.METRICS['MULTIPROCESS_DIR']
+
+
+def load_application(config):
+    """The Django handler of MODE, warmed when WARMUP is set; runs in the master."""
+    from django.db import connections
+    from . import warmup
+
+    if config['MODE'] == 'asgi':
+        from django.core.handlers.asgi import ASGIHandler
+        application = ASGIHandler()
+    else:
+        from django.core.handlers.wsgi import WSGIHandler
+        application = WSGIHandler()
+    if config['WARMUP']:
+        timings = warmup.warm(application)
+        log.info('warm-up: %s', ', '.join(f'{name} {seconds * 1000:.0f} ms' for name, seconds in timings.items()))
+    # the workers must not share a connection opened here
+    connections.close_all()
+    return application
+
+
+def post_worker_init(worker):
+    from . import warmup
+
+    warmup.warm_worker()
+
+
+def worker_exit(server, worker):
+    """Write the last metrics snapshot of a recycled worker, counted after it's gone."""
+    from . import metrics
+
+    directory = metrics.get_config()['MULTIPROCESS_DIR']
+    if directory:
+        try:
+            metrics.write_snapshot(directory)
+        except OSError:
+            pass
+
+
+def child_exit(server, worker):
+    """In the master, once the worker is gone: fold its snapshot into the exited workers' one."""
+    from . import metrics
+
+    directory = metrics.get_config()['MULTIPROCESS_DIR']
+    if directory:
+        try:
+            metrics.compact_snapshots(directory)
+        except OSError:
+            log.warning('could not compact the metrics snapshots', exc_info=True)
+
+
+def run(config=None):
+    config = config or get_config()
+    if config['MODE'] not in MODES:
+        raise ImproperlyConfigured(f"SERVE['MODE'] must be one of {', '.join(MODES)}, not {config['MODE']!r}.")
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError as exc:
+        raise ImproperlyConfigured("`serve` requires the gunicorn package.") from exc
+    if config['MODE'] == 'asgi':
+        try:
+            import uvicorn.workers  # noqa: F401
+        except ImportError as exc:
+            raise ImproperlyConfigured("SERVE['MODE'] = 'asgi' requires the uvicorn package.") from exc
+
+    configure_workers()
+    application = load_application(config)
+
+    class Server(BaseApplication):
+        def load_config(self):
+            for key, value in gunicorn_options(config).items():
+                if value is not None:
+                    self.cfg.set(key, value)
+
+        def load(self):
+            return application
+
+    Server().run()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 from datetime import timedelta
 
@@ -31,6 +32,11 @@ ALLOWED_HOSTS = []
 
 # Application definition
 
+# "full" (default) or "api": API-only workers skip admin autodiscovery at boot
+# (it runs on the first /admin/ request) and apps nothing under /v1/ uses.
+# Measure with `manage.py profile_startup --compare`.
+BOOT_PROFILE = os.environ.get('BOOT_PROFILE', 'full')
+
 INSTALLED_APPS = [
     # Local Apps
     'apps.accounts',
@@ -51,6 +57,22 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
 ]
 
+if BOOT_PROFILE == 'api':
+    INSTALLED_APPS = [
+        # same app label, registrations are loaded by config.admin_urls
+        'django.contrib.admin.apps.SimpleAdminConfig' if app == 'django.contrib.admin' else app
+        for app in INSTALLED_APPS
+        if app != 'phonenumber_field'  # no model uses its fields
+    ]
+
+# /schema/ is generated once per code version and served from memory (config.schema).
+# `manage.py build_schema` pre-generates it into DIR. Set CODE_VERSION (e.g. the git sha) in
+# production; without it VERSION is a hash of the project's app sources, read on first use.
+SCHEMA_CACHE = {
+    'VERSION': os.environ.get('CODE_VERSION'),
+    'DIR': os.environ.get('SCHEMA_CACHE_DIR'),
+}
+
 SPECTACULAR_SETTINGS = {
     'TITLE': 'ArtQ API',
     'DESCRIPTION': 'API documentation for ArtQ backend',
@@ -69,17 +91,43 @@ SPECTACULAR_SETTINGS = {
 }
 
 MIDDLEWARE = [
+    'config.middleware.MetricsMiddleware',
+    'config.middleware.TracingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
-    'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
-    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'config.middleware.DatabasePinMiddleware',
+    'config.middleware.BrowserMiddleware',
     'config.middleware.RequestLogMiddleware',
 ]
 
+# the session / cookie based layers, for the admin and browsable pages only.
+# /v1/ is JWT-authenticated (DRF sets request.user) and /.well-known/ public, so their
+# requests skip them
+BROWSER_MIDDLEWARE = {
+    'API_PREFIXES': ['/v1/', '/.well-known/'],
+    'MIDDLEWARE': [
+        'django.contrib.sessions.middleware.SessionMiddleware',
+        'django.middleware.csrf.CsrfViewMiddleware',
+        'django.contrib.auth.middleware.AuthenticationMiddleware',
+        'django.contrib.messages.middleware.MessageMiddleware',
+        'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    ],
+}
+
+# admin's checks look for these classes in MIDDLEWARE; they run inside BrowserMiddleware
+SILENCED_SYSTEM_CHECKS = ['admin.E408', 'admin.E409', 'admin.E410']
+
+# debug: time every middleware layer, reported in a Server-Timing header and
+# artq_middleware_duration_seconds. Adds a little overhead per layer
+MIDDLEWARE_TIMING = os.environ.get('MIDDLEWARE_TIMING') == '1'
+if MIDDLEWARE_TIMING:
+    MIDDLEWARE = [
+        path
+        for layer in MIDDLEWARE
+        for path in ('config.middleware.LayerTimingMiddleware', layer)
+    ] + ['config.middleware.LayerTimingMiddleware']
+
 ROOT_URLCONF = 'config.urls'
 
 TEMPLATES = [
@@ -99,6 +147,11 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'config.wsgi.application'
+ASGI_APPLICATION = 'config.asgi.application'
+
+# v1/auth/ view implementation: "sync" (DRF APIViews) or "async" (apps.accounts.async_views).
+# Use "async" when serving config.asgi, there the sync views cost a thread hop per request.
+AUTH_VIEW_MODE = os.environ.get('AUTH_VIEW_MODE', 'sync')
 
 # In developing phase, allow all origins. Change this in production.
 CORS_ALLOW_ALL_ORIGINS = True
@@ -118,9 +171,19 @@ REST_FRAMEWORK = {
     # Use drf-spectacular's AutoSchema for schema generation
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'apps.accounts.authentication.CachedJWTAuthentication',
     ),
     'EXCEPTION_HANDLER': 'config.exceptions.api_exception_handler',
+    # orjson, same output as DRF's JSONRenderer (config.fastjson)
+    'DEFAULT_RENDERER_CLASSES': (
+        'config.fastjson.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'config.fastjson.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
 }
 
 # Database
@@ -133,6 +196,92 @@ DATABASES = {
     }
 }
 
+# Postgres (the docker-compose `db` service) when POSTGRES_DB is set.
+# With DB_POOL=1 connections come from a per-process psycopg_pool (config.db.postgresql)
+# and are returned at the end of every request; otherwise each thread keeps its own
+# connection for DB_CONN_MAX_AGE seconds.
+if os.environ.get('POSTGRES_DB'):
+    DB_POOL = os.environ.get('DB_POOL', '1') == '1'
+    DATABASES['default'] = {
+        'ENGINE': 'config.db.postgresql',
+        'NAME': os.environ['POSTGRES_DB'],
+        'USER': os.environ.get('POSTGRES_USER', ''),
+        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': os.environ.get('POSTGRES_HOST', 'db'),
+        'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+        'CONN_MAX_AGE': 0 if DB_POOL else int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'connect_timeout': int(os.environ.get('DB_CONNECT_TIMEOUT', 5)),
+            'options': f"-c statement_timeout={int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 5000))}",
+            'pool': {
+                'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+                'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+                'timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)),   # wait for a free connection
+                'max_idle': float(os.environ.get('DB_POOL_MAX_IDLE', 300)),
+                'max_lifetime': float(os.environ.get('DB_POOL_MAX_LIFETIME', 3600)),
+            } if DB_POOL else False,
+        },
+    }
+    # renders the opclass indexes of accounts.User (admin search), which only exist
+    # on PostgreSQL; it imports psycopg and the migration writer, so SQLite setups
+    # go without it
+    INSTALLED_APPS.append('django.contrib.postgres')
+
+# Read replicas (config.db.routers): reads of the user and token tables go to
+# POSTGRES_REPLICA_HOSTS (comma separated, same credentials as the primary), or to
+# SQLITE_REPLICA_PATH locally; writes go to `default`. A client that wrote reads
+# from the primary for DB_STICKY_SECONDS, remembered by a cookie and, for API clients,
+# by its user / username in PIN_CACHE (shared by the workers only with REDIS_URL).
+# Tests run the replicas as mirrors of default.
+if os.environ.get('POSTGRES_DB') and os.environ.get('POSTGRES_REPLICA_HOSTS'):
+    for n, host in enumerate(os.environ['POSTGRES_REPLICA_HOSTS'].split(','), 1):
+        DATABASES[f'replica{n}'] = {
+            **DATABASES['default'],
+            'HOST': host.strip(),
+            'TEST': {'MIRROR': 'default'},
+        }
+elif os.environ.get('SQLITE_REPLICA_PATH') and DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    DATABASES['replica1'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ['SQLITE_REPLICA_PATH'],
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['config.db.routers.ReplicaRouter']
+DATABASE_REPLICAS = {
+    'REPLICAS': [alias for alias in DATABASES if alias != 'default'],
+    'STICKY_SECONDS': int(os.environ.get('DB_STICKY_SECONDS', 5)),
+    'PIN_CACHE': 'shared' if os.environ.get('REDIS_URL') else 'default',
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+
+REDIS_URL = os.environ.get('REDIS_URL')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+if REDIS_URL:
+    # cross-process state (blacklisted JTIs, ...)
+    CACHES['shared'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+    }
+
+
+# Celery (config.celery), run the worker with: celery -A config.celery worker
+# Without REDIS_URL the broker is in-memory, i.e. only usable with a worker in the same
+# process; CELERY_TASK_ALWAYS_EAGER=1 runs tasks in the publishing thread instead.
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL') or REDIS_URL or 'memory://'
+CELERY_TASK_ALWAYS_EAGER = os.environ.get('CELERY_TASK_ALWAYS_EAGER', '0') == '1'
+CELERY_TASK_IGNORE_RESULT = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
 
 AUTH_USER_MODEL = 'accounts.User'
 
@@ -154,11 +303,186 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Run password hashing (registration / login) in a process pool, see apps.accounts.hashing.
+# MAX_QUEUE bounds waiting hashes; beyond it requests get 503 instead of piling up.
+PASSWORD_HASHING_POOL = {
+    'ENABLED': os.environ.get('PASSWORD_HASHING_POOL', '0') == '1',
+    'MAX_WORKERS': int(os.environ.get('PASSWORD_HASHING_WORKERS', 0)) or None,
+    'MAX_QUEUE': int(os.environ.get('PASSWORD_HASHING_MAX_QUEUE', 64)),
+    'TIMEOUT': 10,
+}
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=15),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=30),
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
+    'TOKEN_OBTAIN_SERIALIZER': 'apps.accounts.serializers.FamilyTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'apps.accounts.serializers.IndexedTokenRefreshSerializer',
+    'TOKEN_VERIFY_SERIALIZER': 'apps.accounts.serializers.CachedTokenVerifySerializer',
+}
+
+# Token signing keys (apps.accounts.signing). JWT_ALGORITHM=EdDSA or ES256 signs with the
+# private keys in JWT_KEYS_DIR (`manage.py signing_key <kid>`), tagged with their `kid`, and
+# publishes the public keys at /.well-known/jwks.json so other services verify locally.
+# HS256 keeps the shared SECRET_KEY. Tokens issued before the switch stay valid here
+# while JWT_ACCEPT_HS256=1: set it for the switch, unset it after REFRESH_TOKEN_LIFETIME.
+JWT_SIGNING = {
+    'ALGORITHM': os.environ.get('JWT_ALGORITHM', 'HS256'),
+    'KEYS_DIR': os.environ.get('JWT_KEYS_DIR') or str(BASE_DIR / 'keys'),
+    'ACTIVE_KID': os.environ.get('JWT_ACTIVE_KID') or None,
+    'ACCEPT_HS256': os.environ.get('JWT_ACCEPT_HS256', '0') == '1',
+    'JWKS_MAX_AGE': int(os.environ.get('JWKS_MAX_AGE', 3600)),
+}
+
+# Refresh-token families (apps.accounts.families): rotation is one conditional UPDATE of the
+# family row, reuse of a rotated token revokes the family, and the OutstandingToken /
+# BlacklistedToken rows are written in batches by a background thread.
+TOKEN_FAMILIES = {
+    'ENABLED': os.environ.get('TOKEN_FAMILIES', '1') == '1',
+    'REUSE_GRACE': 10,
+    'FLUSH_INTERVAL': 1.0,
+}
+
+# In-memory index of blacklisted refresh-token JTIs, see apps.accounts.blacklist.
+# With SHARED_CACHE set, worker processes share entries through that cache alias;
+# without it each process re-syncs new rows from the database every SYNC_INTERVAL seconds.
+JTI_BLACKLIST = {
+    'SHARED_CACHE': 'shared' if REDIS_URL else None,
+    'SYNC_INTERVAL': 5,
+    'PRUNE_INTERVAL': 60,
+}
+
+# Users behind authenticated requests, cached per process with a version counter
+# bumped on save / delete (apps.accounts.user_cache). With SHARED_CACHE the counters
+# are shared, so a deactivation or password change is seen by every worker at once.
+USER_CACHE = {
+    'MAX_ENTRIES': int(os.environ.get('USER_CACHE_MAX_ENTRIES', 10000)),
+    'MAX_AGE': 60,
+    'SHARED_CACHE': 'shared' if REDIS_URL else None,
+}
+
+# Bloom filter in front of the username / email / phone availability checks
+# (GET /v1/auth/availability/ and the registration pre-check), see apps.accounts.availability.
+AVAILABILITY = {
+    'EXPECTED_USERS': int(os.environ.get('AVAILABILITY_EXPECTED_USERS', 1_000_000)),
+    'FALSE_POSITIVE_RATE': 0.01,
+    'SYNC_INTERVAL': 5,
+}
+
+# POST /v1/auth/registration/batch/ (admin only); larger loads go through manage.py import_users.
+# Its passwords are hashed in the PASSWORD_HASHING_POOL pool even when that is disabled.
+BULK_REGISTRATION = {
+    'MAX_ROWS': int(os.environ.get('BULK_REGISTRATION_MAX_ROWS', 200)),
+}
+
+# Verification email / SMS after registration, sent in batches by a Celery task
+# (apps.accounts.verification, apps.accounts.tasks). Registration only queues them.
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+VERIFICATION = {
+    'ENABLED': os.environ.get('VERIFICATION', '0') == '1',
+    'DEDUP_CACHE': 'shared' if REDIS_URL else 'default',
+    'DEDUP_TTL': 60,
+    'SMS_BACKEND': os.environ.get('VERIFICATION_SMS_BACKEND', 'apps.accounts.verification.ConsoleSMSBackend'),
+}
+
+# One-time verification codes (apps.accounts.otp), with a TTL and attempt counter, never
+# in the database. Issued by the Celery worker and checked by the web processes, so they
+# need the redis backend unless tasks run eagerly.
+OTP = {
+    'BACKEND': 'redis' if REDIS_URL else 'memory',
+    'REDIS_URL': REDIS_URL,
+    'TTL': 600,
+    'MAX_ATTEMPTS': 5,
+    'ISSUE_RATE': os.environ.get('OTP_ISSUE_RATE', '5/hour'),
+}
+
+# Token-bucket throttles in front of password hashing on login and registration, and
+# against account enumeration on the availability check (apps.accounts.throttling).
+# Rates are "<burst>/<period>"; buckets live in Redis when REDIS_URL is set so all
+# workers share them, otherwise in each process.
+THROTTLING = {
+    'BACKEND': 'redis' if REDIS_URL else 'memory',
+    'REDIS_URL': REDIS_URL,
+    'RATES': {
+        'login_ip': os.environ.get('THROTTLE_LOGIN_IP', '30/min'),
+        'login_username': os.environ.get('THROTTLE_LOGIN_USERNAME', '10/min'),
+        'registration_ip': os.environ.get('THROTTLE_REGISTRATION_IP', '10/min'),
+        'availability_ip': os.environ.get('THROTTLE_AVAILABILITY_IP', '60/min'),
+    },
+}
+
+# Verified-token cache used by CachedJWTAuthentication and the verify endpoint (per process).
+TOKEN_CACHE = {
+    'MAX_ENTRIES': int(os.environ.get('TOKEN_CACHE_MAX_ENTRIES', 10000)),
+}
+
+# Per-route request / DB / hashing metrics served on /metrics (config.metrics).
+# Set MULTIPROCESS_DIR when running several worker processes so /metrics sums all of them.
+METRICS = {
+    'ENABLED': os.environ.get('METRICS', '1') == '1',
+    'MULTIPROCESS_DIR': os.environ.get('METRICS_MULTIPROCESS_DIR') or None,
+    'FLUSH_INTERVAL': 5,
+    # who may scrape: peers in these networks (comma separated CIDRs), or a bearer token
+    'ALLOWED_NETWORKS': [
+        network for network in os.environ.get('METRICS_ALLOWED_NETWORKS', '127.0.0.1/32,::1/128').split(',') if network
+    ],
+    'TOKEN': os.environ.get('METRICS_TOKEN') or None,
+}
+
+# Request tracing (config.tracing): spans for queries, password hashing, token signing
+# and JSON rendering, one JSON line per span. W3C traceparent headers are continued.
+TRACING = {
+    'ENABLED': os.environ.get('TRACING', '0') == '1',
+    'SAMPLE_RATE': float(os.environ.get('TRACING_SAMPLE_RATE', 1.0)),
+    'PATH': os.environ.get('TRACING_PATH', str(BASE_DIR / 'traces.jsonl')),
+}
+
+# Per-endpoint query / latency budgets (config.budgets). The test suite checks the
+# query counts; latencies (p50 with the MD5 test hasher) only with BUDGET_LATENCY=1,
+# as `python -m benchmarks.budgets` does. Raise BUDGET_LATENCY_FACTOR on slower
+# machines. Queries count the request only, token bookkeeping is written behind
+# (apps.accounts.families).
+BUDGETS = {
+    'CHECK_LATENCY': os.environ.get('BUDGET_LATENCY', '0') == '1',
+    'LATENCY_FACTOR': float(os.environ.get('BUDGET_LATENCY_FACTOR', 1.0)),
+    'ENDPOINTS': {
+        'registration': {'queries': 1, 'ms': 30},
+        'availability': {'queries': 1, 'ms': 10},
+        'login': {'queries': 2, 'ms': 25},
+        'refresh': {'queries': 1, 'ms': 25},
+        'verify': {'queries': 0, 'ms': 10},
+        'logout': {'queries': 1, 'ms': 20},
+    },
+}
+
+# `manage.py serve` (config.serve): gunicorn workers forked from a warmed-up master
+# (config.warmup), recycled after SERVE_MAX_REQUESTS requests. SERVE_MODE=asgi runs
+# the ASGI handler on uvicorn workers (AUTH_VIEW_MODE=async).
+SERVE = {
+    'MODE': os.environ.get('SERVE_MODE', 'wsgi'),
+    'BIND': os.environ.get('SERVE_BIND', '0.0.0.0:8000'),
+    'WORKERS': int(os.environ.get('SERVE_WORKERS', 0)),
+    'THREADS': int(os.environ.get('SERVE_THREADS', 1)),
+    'MAX_REQUESTS': int(os.environ.get('SERVE_MAX_REQUESTS', 10000)),
+    'MAX_REQUESTS_JITTER': int(os.environ.get('SERVE_MAX_REQUESTS_JITTER', 1000)),
+    'TIMEOUT': int(os.environ.get('SERVE_TIMEOUT', 30)),
+    'WARMUP': os.environ.get('SERVE_WARMUP', '1') == '1',
+}
+
+# Request log (config.middleware.RequestLogMiddleware), written as JSON lines by a
+# background thread. Use {pid} in PATH when several worker processes share BASE_DIR.
+REQUEST_LOG = {
+    'ENABLED': os.environ.get('REQUEST_LOG', '1') == '1',
+    'PATH': os.environ.get('REQUEST_LOG_PATH', str(BASE_DIR / 'requests.jsonl')),
+    'MAX_BYTES': 50 * 1024 * 1024,
+    'BACKUP_COUNT': 5,
+    'QUEUE_SIZE': 10000,
+    'MAX_BODY_BYTES': 4096,
+    # path prefix -> fraction of successful requests logged (errors are always logged)
+    'SAMPLE_RATES': {
+        '/v1/auth/verify/': 0.1,
+    },
 }
 
 # Logging
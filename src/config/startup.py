@@ -0,0 +1,117 @@
+"""
+Cold-start measurement, run in a fresh interpreter by `manage.py profile_startup`.
+
+    python -m config.startup [METHOD] [PATH]
+
+Prints one JSON line: seconds spent in django.setup(), building the handler
+(middleware), loading the URLconf and serving the first request, plus the
+wall-clock time at which the first response was ready. With STARTUP_WARMUP=1
+config.warmup.warm() and warm_worker() run before the first request (as
+`manage.py serve` does before and after forking); steady_request_s is the median of the requests after it.
+"""
+import io
+import json
+import os
+import re
+import sys
+import time
+
+
+STEADY_REQUESTS = 21
+
+
+def first_request(handler, method, path):
+    environ = {
+        'REQUEST_METHOD': method,
+        'PATH_INFO': path,
+        'QUERY_STRING': '',
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'REMOTE_ADDR': '127.0.0.1',
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': '2',
+        'wsgi.input': io.BytesIO(b'{}'),
+        'wsgi.errors': sys.stderr,
+        'wsgi.url_scheme': 'http',
+        'wsgi.version': (1, 0),
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    status = {}
+
+    def start_response(line, headers, exc_info=None):
+        status['code'] = int(line.split(' ', 1)[0])
+
+    b''.join(handler(environ, start_response))
+    return status['code']
+
+
+def measure(method='POST', path='/v1/auth/verify/'):
+    started = time.perf_counter()
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    import django
+    django.setup()
+    setup_done = time.perf_counter()
+
+    from django.core.handlers.wsgi import WSGIHandler
+    handler = WSGIHandler()
+    handler_done = time.perf_counter()
+
+    from django.urls import get_resolver
+    get_resolver().url_patterns
+    urls_done = time.perf_counter()
+
+    if os.environ.get('STARTUP_WARMUP') == '1':
+        from config.warmup import warm, warm_worker
+        warm(handler)
+        warm_worker()
+    warm_done = time.perf_counter()
+
+    code = first_request(handler, method, path)
+    done = time.perf_counter()
+    ready_at = time.time()
+
+    steady = []
+    for _ in range(STEADY_REQUESTS):
+        start = time.perf_counter()
+        first_request(handler, method, path)
+        steady.append(time.perf_counter() - start)
+    return {
+        'setup_s': setup_done - started,
+        'handler_s': handler_done - setup_done,
+        'urlconf_s': urls_done - handler_done,
+        'warmup_s': warm_done - urls_done,
+        'first_request_s': done - warm_done,
+        'steady_request_s': sorted(steady)[len(steady) // 2],
+        'status': code,
+        'modules': len(sys.modules),
+        'ready_at': ready_at,
+    }
+
+
+IMPORTTIME = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def parse_importtime(stderr):
+    """-X importtime output -> [(module, self_us, cumulative_us, depth)]."""
+    rows = []
+    for line in stderr.splitlines():
+        match = IMPORTTIME.match(line)
+        if match:
+            rows.append((match[4], int(match[1]), int(match[2]), len(match[3]) // 2))
+    return rows
+
+
+def group(module):
+    """Bucket a module for the per-package report."""
+    parts = module.split('.')
+    if parts[0] == 'django' and len(parts) > 2 and parts[1] == 'contrib':
+        return '.'.join(parts[:3])
+    if parts[0] in ('django', 'rest_framework', 'rest_framework_simplejwt', 'apps', 'config') and len(parts) > 1:
+        return '.'.join(parts[:2])
+    return parts[0]
+
+
+if __name__ == '__main__':
+    print(json.dumps(measure(*sys.argv[1:3])))
@@ -0,0 +1,282 @@
+"""
+Opt-in request tracing: where the time of one request goes.
+
+With TRACING['ENABLED'], TracingMiddleware opens a root span per sampled
+request and the instrumented code adds child spans to it:
+
+    db.query         every SQL statement (an execute wrapper, like config.metrics)
+    password.make / password.verify     apps.accounts.hashing
+    jwt.encode / jwt.decode             apps.accounts.tokens.TracedTokenBackend
+    json.render / json.parse            config.fastjson
+
+A W3C `traceparent` request header is continued (same trace id, its span as
+parent, its sampled flag decides); other requests are sampled at SAMPLE_RATE.
+Sampled responses carry a `traceresponse` header with the trace id.
+
+Finished traces are handed to an exporter thread, which writes one JSON line
+per span to PATH (size-rotated like the request log). Spans use the OTLP
+field names, so the file can be replayed into a collector. When tracing is
+off, span() returns a shared no-op object and no wrapper is installed.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import os
+import random
+import re
+import secrets
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from .metrics import registry
+from .request_log import RequestLogWriter
+
+log = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': False,
+    'SAMPLE_RATE': 1.0,          # requests without a traceparent header
+    'PATH': 'traces.jsonl',      # may contain {pid}
+    'MAX_BYTES': 50 * 1024 * 1024,
+    'BACKUP_COUNT': 5,
+    'QUEUE_SIZE': 10000,
+    'BATCH_SIZE': 200,
+    'FLUSH_INTERVAL': 1.0,
+    'MAX_SPANS': 1000,           # per trace, the rest are counted as dropped
+}
+
+MAX_STATEMENT_CHARS = 500
+
+TRACEPARENT = re.compile(r'^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+current_span = contextvars.ContextVar('tracing_current_span', default=None)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'TRACING', {})}
+
+
+def parse_traceparent(value):
+    """'00-<trace id>-<parent id>-<flags>' -> (trace id, parent id, sampled), or None."""
+    match = TRACEPARENT.match((value or '').strip().lower())
+    if match is None:
+        return None
+    version, trace_id, parent_id, flags = match.groups()
+    if version == 'ff' or trace_id == '0' * 32 or parent_id == '0' * 16:
+        return None
+    return trace_id, parent_id, bool(int(flags, 16) & 1)
+
+
+def format_traceparent(trace_id, span_id, sampled=True):
+    return f'00-{trace_id}-{span_id}-{"01" if sampled else "00"}'
+
+
+class Trace:
+    __slots__ = ('trace_id', 'spans', 'max_spans', 'dropped')
+
+    def __init__(self, trace_id, max_spans):
+        self.trace_id = trace_id
+        self.spans = []
+        self.max_spans = max_spans
+        self.dropped = 0
+
+
+class Span:
+    __slots__ = ('trace', 'span_id', 'parent_id', 'name', 'attributes', 'start', 'end', 'error', '_token')
+
+    def __init__(self, trace, name, parent_id, attributes):
+        self.trace = trace
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start = self.end = 0
+        self.error = None
+        self._token = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def __enter__(self):
+        self.start = time.time_ns()
+        self._token = current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end = time.time_ns()
+        current_span.reset(self._token)
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        trace = self.trace
+        # list.append is atomic: sync_to_async threads add spans to the same trace
+        if len(trace.spans) < trace.max_spans:
+            trace.spans.append(self)
+        else:
+            trace.dropped += 1
+        return False
+
+    def as_dict(self):
+        out = {
+            'trace_id': self.trace.trace_id,
+            'span_id': self.span_id,
+            'parent_span_id': self.parent_id,
+            'name': self.name,
+            'start_time_unix_nano': self.start,
+            'end_time_unix_nano': self.end,
+            'duration_ms': round((self.end - self.start) / 1e6, 3),
+            'attributes': self.attributes,
+        }
+        if self.error:
+            out['status'] = {'code': 'ERROR', 'message': self.error}
+        return out
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP = _NoopSpan()
+
+
+def span(name, **attributes):
+    """Child span of the current one; a no-op outside a traced request."""
+    parent = current_span.get()
+    if parent is None:
+        return NOOP
+    return Span(parent.trace, name, parent.span_id, attributes)
+
+
+def start_request(request, config):
+    """Root span for a request, or None when it isn't sampled."""
+    parent = parse_traceparent(request.META.get('HTTP_TRACEPARENT'))
+    if parent is not None:
+        trace_id, parent_id, sampled = parent
+    else:
+        trace_id, parent_id = secrets.token_hex(16), None
+        sampled = config['SAMPLE_RATE'] >= 1 or random.random() < config['SAMPLE_RATE']
+    if not sampled:
+        return None
+    root = Span(Trace(trace_id, config['MAX_SPANS']), 'http.request', parent_id, {
+        'http.method': request.method,
+        'http.target': request.path,
+    })
+    request.trace_id = trace_id
+    return root
+
+
+def finish_request(root, request, response):
+    """Close the root span, export the trace and tag the response."""
+    match = getattr(request, 'resolver_match', None)
+    root.set('http.route', (match.url_name or match.view_name) if match else 'unmatched')
+    root.set('http.status_code', response.status_code)
+    response.headers['traceresponse'] = format_traceparent(root.trace.trace_id, root.span_id)
+    get_exporter().submit(root.trace)
+
+
+# -- database spans -----------------------------------------------------------
+
+def _trace_query(execute, sql, params, many, context):
+    parent = current_span.get()
+    if parent is None:
+        return execute(sql, params, many, context)
+    connection = context['connection']
+    # statement only, parameters may hold credentials
+    statement = str(sql)[:MAX_STATEMENT_CHARS]
+    with Span(parent.trace, 'db.query', parent.span_id, {
+        'db.system': connection.vendor,
+        'db.name': connection.alias,
+        'db.statement': statement,
+        'db.executemany': many,
+    }):
+        return execute(sql, params, many, context)
+
+
+@receiver(connection_created)
+def _install_query_tracer(sender, connection, **kwargs):
+    if not get_config()['ENABLED']:
+        return
+    # first in the list, like the query counter of config.metrics
+    if _trace_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _trace_query)
+
+
+# -- exporter -----------------------------------------------------------------
+
+class SpanExporter(RequestLogWriter):
+    """Writes finished traces as JSON lines, one span per line, off the request thread."""
+    thread_name = 'span-exporter'
+
+    def _write(self, batch):
+        lines = []
+        dropped = 0
+        for trace in batch:
+            dropped += trace.dropped
+            for item in trace.spans:
+                lines.append(json.dumps(item.as_dict(), ensure_ascii=False, default=str) + '\n')
+        if dropped:
+            registry.inc('artq_trace_spans_dropped_total', (), dropped)
+        try:
+            self.file.write_lines(lines)
+            self.written += len(lines)
+        except OSError:
+            log.exception('trace export failed, %d spans lost', len(lines))
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def get_exporter():
+    """Process-wide exporter, started on first use (and again after fork)."""
+    global _exporter
+    if _exporter is None or _exporter.pid != os.getpid():
+        with _exporter_lock:
+            if _exporter is None or _exporter.pid != os.getpid():
+                _exporter = SpanExporter(get_config())
+                atexit.register(_exporter.close)
+    return _exporter
+
+
+def flush(timeout=5):
+    """Write everything exported so far (tests, benchmarks)."""
+    global _exporter
+    with _exporter_lock:
+        exporter, _exporter = _exporter, None
+    if exporter is not None:
+        exporter.close(timeout)
+
+
+@receiver(setting_changed)
+def _reset_on_setting_change(*, setting, **kwargs):
+    if setting == 'TRACING':
+        flush()
+
+
+def _collect_metrics():
+    exporter = _exporter
+    if exporter is None or exporter.pid != os.getpid():
+        return {}
+    return {
+        ('artq_trace_spans_written_total', ()): exporter.written,
+        ('artq_trace_exports_dropped_total', ()): exporter.dropped,
+    }
+
+
+registry.register_collector(_collect_metrics, {
+    'artq_trace_spans_written_total': 'Trace spans written to the trace file.',
+    'artq_trace_exports_dropped_total': 'Traces dropped because the exporter queue was full.',
+})
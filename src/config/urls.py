@@ -14,29 +14,27 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
 from django.urls import path, include
-from rest_framework_simplejwt.views import (
-    TokenObtainPairView, 
-    TokenRefreshView,
-    TokenVerifyView,
-)
-from drf_spectacular.views import (
-    SpectacularAPIView,
-    SpectacularSwaggerView,
-    SpectacularRedocView,
-)
+from apps.accounts.signing import jwks_view
+from config.lazy import LazyView, lazy_include
+from config.metrics import metrics_view
+from config.schema import schema_view
 
 urlpatterns = [
-    path('admin/', admin.site.urls),
+    # admin site and docs views are imported on first use (config.lazy)
+    lazy_include('admin/', 'config.admin_urls', app_name='admin'),
+
+    # Prometheus scrape endpoint
+    path('metrics', metrics_view, name='metrics'),
     
-    # API schema and documentation
-    path('schema/', SpectacularAPIView.as_view(), name='schema'),
-    path('docs/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
-    path('redoc/', SpectacularRedocView.as_view(url_name='schema'), name='redoc'),
+    # API schema (generated once per code version, see config.schema) and documentation
+    path('schema/', schema_view, name='schema'),
+    path('docs/', LazyView('drf_spectacular.views.SpectacularSwaggerView', url_name='schema'), name='swagger-ui'),
+    path('redoc/', LazyView('drf_spectacular.views.SpectacularRedocView', url_name='schema'), name='redoc'),
     
-    # Auth with JWT
+    # public token signing keys, for verifying tokens locally (apps.accounts.signing)
+    path('.well-known/jwks.json', jwks_view, name='jwks'),
+
+    # Auth with JWT (refresh/ and verify/ live in apps.accounts.urls)
     path('v1/auth/', include('apps.accounts.urls')),
-    path('v1/auth/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
-    path('v1/auth/verify/', TokenVerifyView.as_view(), name='token_verify'),
 ]
@@ -0,0 +1,280 @@
+"""
+Warm-up before serving, so a fresh worker's first request costs what the
+hundredth does.
+
+`warm()` runs in the master process of `manage.py serve` before workers are
+forked (their memory is a copy-on-write image of it) and touches only
+CPU-side state:
+
+    urls          import and compile every pattern of ROOT_URLCONF, fill the
+                  reverse dicts, resolve LazyViews (not under BOOT_PROFILE=api,
+                  whose lazy parts stay lazy)
+    views         DRF policy objects of every view (authenticators, parsers,
+                  renderers, permissions, throttles) and the fields of every
+                  serializer in WARMUP['SERIALIZER_MODULES']
+    passwords     the hasher instances, the password validators
+                  (CommonPasswordValidator reads its 20k word list here)
+    tokens        sign and verify a throwaway JWT (PyJWT algorithms, key objects)
+    translations  the LANGUAGE_CODE catalogs
+    schema        config.schema.warm() (not under BOOT_PROFILE=api)
+    requests      WARMUP['REQUESTS'] through the application itself, so the
+                  middleware's lazy state is built too; they carry WARMUP_KEY
+                  and are left out of metrics, traces and the request log.
+                  They must not need the database
+
+It opens no database connection: a connection, pool thread or socket made
+before fork() would be shared by every worker. The database-backed indexes
+are filled by `warm_worker()`, in each worker after the fork, which also
+leaves the worker its (persistent) database connection; the availability
+index loads on a background thread.
+"""
+import asyncio
+import inspect
+import io
+import json
+import logging
+import sys
+import time
+
+from django.conf import settings
+
+log = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    'SERIALIZER_MODULES': ['apps.accounts.serializers'],
+    # (method, path, JSON body): requests that exercise the view stack without queries
+    'REQUESTS': [
+        ('POST', '/v1/auth/verify/', {'token': 'warmup'}),
+    ],
+}
+
+
+# set in the WSGI environ / ASGI scope of warm-up requests, which clients can't send
+WARMUP_KEY = 'artq.warmup'
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'WARMUP', {})}
+
+
+def is_warmup(request):
+    return bool(request.META.get(WARMUP_KEY) or getattr(request, 'scope', {}).get(WARMUP_KEY))
+
+
+def _lazy_allowed():
+    return settings.BOOT_PROFILE != 'api'
+
+
+def _patterns(resolver):
+    from django.urls import URLResolver
+
+    for pattern in resolver.url_patterns:
+        pattern.pattern.regex  # compiled on first access
+        if isinstance(pattern, URLResolver):
+            # config.lazy.lazy_include keeps the module path, include() the module
+            if isinstance(pattern.urlconf_name, str) and not _lazy_allowed():
+                continue
+            yield from _patterns(pattern)
+        else:
+            yield pattern
+
+
+def warm_urls():
+    from django.urls import get_resolver
+    from .lazy import LazyView
+
+    resolver = get_resolver()
+    patterns = list(_patterns(resolver))
+    if _lazy_allowed():
+        resolver.reverse_dict  # populates the nested resolvers too
+        for pattern in patterns:
+            if isinstance(pattern.callback, LazyView):
+                pattern.callback.resolve()
+    return patterns
+
+
+def warm_views(patterns):
+    from rest_framework.views import APIView
+
+    for pattern in patterns:
+        view_class = getattr(pattern.callback, 'cls', None) or getattr(pattern.callback, 'view_class', None)
+        if view_class is None or not issubclass(view_class, APIView):
+            continue
+        view = view_class(**getattr(pattern.callback, 'initkwargs', {}))
+        view.get_authenticators()
+        view.get_parsers()
+        view.get_renderers()
+        view.get_permissions()
+        view.get_throttles()
+        view.get_content_negotiator()
+        view.get_exception_handler()
+
+
+def warm_serializers(modules):
+    from importlib import import_module
+    from rest_framework.serializers import BaseSerializer
+
+    for name in modules:
+        module = import_module(name)
+        for value in vars(module).values():
+            if inspect.isclass(value) and issubclass(value, BaseSerializer) and value.__module__ == module.__name__:
+                try:
+                    value().fields
+                except Exception:
+                    log.debug('warm-up: %s.fields failed', value.__qualname__, exc_info=True)
+
+
+def warm_passwords():
+    from django.contrib.auth import hashers, password_validation
+
+    hashers.get_hashers()
+    hashers.get_hashers_by_algorithm()
+    # loads CommonPasswordValidator's list; the result doesn't matter
+    for validator in password_validation.get_default_password_validators():
+        try:
+            validator.validate('warm-up password 7f3a')
+        except Exception:
+            pass
+
+
+def warm_tokens():
+    from rest_framework_simplejwt.tokens import AccessToken, UntypedToken
+
+    UntypedToken(str(AccessToken()))
+
+
+def warm_translations():
+    from django.utils import translation
+
+    with translation.override(settings.LANGUAGE_CODE):
+        translation.gettext('This field is required.')
+
+
+def warm_schema():
+    if _lazy_allowed():
+        from . import schema
+
+        schema.warm()
+
+
+def _host():
+    """A name ALLOWED_HOSTS accepts, so the warm-up requests aren't DisallowedHost errors."""
+    for host in settings.ALLOWED_HOSTS:
+        if host != '*':
+            return host.lstrip('.')
+    return 'localhost'
+
+
+def wsgi_request(application, method, path, body):
+    environ = {
+        'REQUEST_METHOD': method,
+        'PATH_INFO': path,
+        'QUERY_STRING': '',
+        'HTTP_HOST': _host(),
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'REMOTE_ADDR': '127.0.0.1',
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.url_scheme': 'http',
+        'wsgi.version': (1, 0),
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        WARMUP_KEY: True,
+    }
+    status = {}
+
+    def start_response(line, headers, exc_info=None):
+        status['code'] = int(line.split(' ', 1)[0])
+
+    b''.join(application(environ, start_response))
+    return status['code']
+
+
+def asgi_request(application, method, path, body):
+    from asgiref.sync import async_to_sync
+
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': method, 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+        'query_string': b'', 'root_path': '',
+        'headers': [(b'host', _host().encode()), (b'content-type', b'application/json'),
+                    (b'content-length', str(len(body)).encode())],
+        'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+        WARMUP_KEY: True,
+    }
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    status = {}
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.Event().wait()  # no disconnect while the response is produced
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status['code'] = message['status']
+
+    # async_to_sync runs the loop in a thread it joins again and the
+    # thread-sensitive parts on this one: no thread outlives the call
+    async_to_sync(application)(scope, receive, send)
+    return status['code']
+
+
+def warm_requests(application, requests):
+    from django.core.handlers.asgi import ASGIHandler
+
+    send = asgi_request if isinstance(application, ASGIHandler) else wsgi_request
+    for method, path, body in requests:
+        send(application, method, path, json.dumps(body or {}).encode())
+
+
+def warm(application):
+    """Warm the process (and `application`, a WSGI or ASGI handler) before it forks; returns {step: seconds}."""
+    config = get_config()
+    timings = {}
+
+    def step(name, fn, *args):
+        start = time.perf_counter()
+        result = fn(*args)
+        timings[name] = time.perf_counter() - start
+        return result
+
+    if not config['ENABLED']:
+        return timings
+    patterns = step('urls', warm_urls)
+    step('views', warm_views, patterns)
+    step('serializers', warm_serializers, config['SERIALIZER_MODULES'])
+    step('passwords', warm_passwords)
+    step('tokens', warm_tokens)
+    step('translations', warm_translations)
+    step('schema', warm_schema)
+    step('requests', warm_requests, application, config['REQUESTS'])
+    return timings
+
+
+def warm_worker():
+    """
+    After fork, in each worker: the blacklist index loaded from the database,
+    the availability index (a full scan of the users) loading in the background
+    so the worker takes requests right away.
+    """
+    from django.db import close_old_connections
+    from apps.accounts.availability import availability_index
+    from apps.accounts.blacklist import blacklist_index
+
+    if not get_config()['ENABLED']:
+        return
+    availability_index.sync_if_due()  # a background thread
+    try:
+        blacklist_index.sync()
+    except Exception:
+        # a worker that can't reach the database still starts, the index loads on first use
+        log.warning('worker warm-up: loading the blacklist index failed', exc_info=True)
+    finally:
+        # kept open under CONN_MAX_AGE, for the worker's first request
+        close_old_connections()